@@ -1,6 +1,6 @@
 import g4f
-import httpx
 import asyncio
+from llm_providers import get_client
 
 # Popular free models that are generally reliable
 POPULAR_FREE_MODELS = [
@@ -17,26 +17,25 @@ async def get_openrouter_models(api_key: str):
     url = "https://openrouter.ai/api/v1/models"
     headers = {"Authorization": f"Bearer {api_key}"}
     
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(url, headers=headers, timeout=10.0)
-            if response.status_code == 200:
-                data = response.json()["data"]
-                models = []
-                for m in data:
-                    models.append({
-                        "name": m["id"],
-                        "provider": "OpenRouter",
-                        "display": f"{m['name']} ({m['pricing']['prompt']}/1M)",
-                        "context": m["context_length"],
-                        "cost_prompt": m["pricing"]["prompt"],
-                        "cost_completion": m["pricing"]["completion"]
-                    })
-                return models
-            else:
-                return {"error": f"Failed to fetch: {response.status_code}"}
-        except Exception as e:
-            return {"error": str(e)}
+    try:
+        response = await get_client(url).get(url, headers=headers, timeout=10.0)
+        if response.status_code == 200:
+            data = response.json()["data"]
+            models = []
+            for m in data:
+                models.append({
+                    "name": m["id"],
+                    "provider": "OpenRouter",
+                    "display": f"{m['name']} ({m['pricing']['prompt']}/1M)",
+                    "context": m["context_length"],
+                    "cost_prompt": m["pricing"]["prompt"],
+                    "cost_completion": m["pricing"]["completion"]
+                })
+            return models
+        else:
+            return {"error": f"Failed to fetch: {response.status_code}"}
+    except Exception as e:
+        return {"error": str(e)}
 
 async def search_models(query: str, openrouter_key: str = None):
     """
@@ -102,40 +101,39 @@ async def verify_model(model_name: str, provider_type: str, api_key: str = None,
             return True, response
             
         elif provider_type == "OpenRouter":
-            async with httpx.AsyncClient() as client:
-                resp = await client.post(
-                    "https://openrouter.ai/api/v1/chat/completions",
-                    headers={"Authorization": f"Bearer {api_key}"},
-                    json={
-                        "model": model_name,
-                        "messages": [{"role": "user", "content": test_query}]
-                    },
-                    timeout=10.0
-                )
-                if resp.status_code == 200:
-                    return True, resp.json()["choices"][0]["message"]["content"]
-                else:
-                    return False, f"Status: {resp.status_code}"
+            url = "https://openrouter.ai/api/v1/chat/completions"
+            resp = await get_client(url).post(
+                url,
+                headers={"Authorization": f"Bearer {api_key}"},
+                json={
+                    "model": model_name,
+                    "messages": [{"role": "user", "content": test_query}]
+                },
+                timeout=10.0
+            )
+            if resp.status_code == 200:
+                return True, resp.json()["choices"][0]["message"]["content"]
+            else:
+                return False, f"Status: {resp.status_code}"
 
         elif provider_type == "Ollama":
-            async with httpx.AsyncClient() as client:
-                # base_url should be the full generate endpoint or we construct it
-                # Usually passed as "http://localhost:11434/api/generate" or similar base
-                # Let's assume base_url is the root like "http://localhost:11434"
-                url = f"{base_url}/api/generate"
-                resp = await client.post(
-                    url,
-                    json={
-                        "model": model_name,
-                        "prompt": test_query,
-                        "stream": False
-                    },
-                    timeout=120.0
-                )
-                if resp.status_code == 200:
-                    return True, resp.json()["response"]
-                else:
-                    return False, f"Status: {resp.status_code} - {resp.text[:50]}"
+            # base_url should be the full generate endpoint or we construct it
+            # Usually passed as "http://localhost:11434/api/generate" or similar base
+            # Let's assume base_url is the root like "http://localhost:11434"
+            url = f"{base_url}/api/generate"
+            resp = await get_client(url).post(
+                url,
+                json={
+                    "model": model_name,
+                    "prompt": test_query,
+                    "stream": False
+                },
+                timeout=120.0
+            )
+            if resp.status_code == 200:
+                return True, resp.json()["response"]
+            else:
+                return False, f"Status: {resp.status_code} - {resp.text[:50]}"
                     
         return False, "Unknown Provider"
         
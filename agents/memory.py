@@ -1,8 +1,24 @@
-import chromadb
-from chromadb.utils import embedding_functions
+import importlib.util
+import gzip
+import hashlib
 import json
 import os
-from datetime import datetime
+import queue
+import sqlite3
+import asyncio
+import atexit
+import bisect
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+# chromadb and the embedding model are imported/loaded lazily (see get_collection),
+# but callers still rely on an ImportError here to detect that memory is unavailable
+if importlib.util.find_spec("chromadb") is None:
+    raise ImportError("chromadb is not installed")
 
 # Import centralized config for portability
 try:
@@ -13,67 +29,408 @@ except ImportError:
     MEMORY_DB_PATH = "./memory_db"
     os.makedirs(MEMORY_DB_PATH, exist_ok=True)
 
-# Initialize ChromaDB with configurable path
-chroma_client = chromadb.PersistentClient(path=MEMORY_DB_PATH)
+try:
+    from config import MEMORY_WORKERS, MEMORY_WRITE_QUEUE_SIZE, MEMORY_BATCH_SIZE, MEMORY_FLUSH_INTERVAL
+except ImportError:
+    MEMORY_WORKERS = 2
+    MEMORY_WRITE_QUEUE_SIZE = 1000
+    MEMORY_BATCH_SIZE = 32
+    MEMORY_FLUSH_INTERVAL = 2.0
+
+try:
+    from config import MEMORY_PAGE_SIZE
+except ImportError:
+    MEMORY_PAGE_SIZE = 500
+
+try:
+    from config import MEMORY_DEDUP_THRESHOLD, MEMORY_RETENTION
+except ImportError:
+    MEMORY_DEDUP_THRESHOLD = 0.97
+    MEMORY_RETENTION = {}
+
+try:
+    from config import EMBEDDING_CACHE_SIZE, EMBEDDING_CACHE_PATH
+except ImportError:
+    EMBEDDING_CACHE_SIZE = 10000
+    EMBEDDING_CACHE_PATH = ""
+
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+
+# --- Lazy, process-wide Chroma client and embedding model ---
+# Opening the SQLite store and loading the sentence-transformers weights takes
+# seconds, so nothing happens at import time: the first caller (or warm_up /
+# preload) initializes them once and everyone else shares the same instances.
+_init_lock = threading.RLock()
+_model_lock = threading.Lock()  # separate, so collection reads don't wait for the model to load
+_chroma_client = None
+_embedding_function = None
+_collections = {}
+
+def get_chroma_client():
+    """Shared chromadb.PersistentClient for MEMORY_DB_PATH."""
+    global _chroma_client
+    if _chroma_client is None:
+        with _init_lock:
+            if _chroma_client is None:
+                import chromadb
+                _chroma_client = chromadb.PersistentClient(path=MEMORY_DB_PATH)
+    return _chroma_client
+
+def get_embedding_function():
+    """Shared sentence-transformers embedding function."""
+    global _embedding_function
+    if _embedding_function is None:
+        with _model_lock:
+            if _embedding_function is None:
+                from chromadb.utils import embedding_functions
+                _embedding_function = embedding_functions.SentenceTransformerEmbeddingFunction(model_name=EMBEDDING_MODEL)
+    return _embedding_function
+
+def get_collection(name: str = "llm_memory", metadata: dict = None):
+    """
+    Shared collection `name` (created on first use). No embedding function is
+    attached: vectors are always passed in from embed(), so reading metadata or
+    documents never has to load the embedding model.
+    """
+    if name not in _collections:
+        with _init_lock:
+            if name not in _collections:
+                _collections[name] = get_chroma_client().get_or_create_collection(
+                    name=name,
+                    embedding_function=None,
+                    metadata=metadata
+                )
+    return _collections[name]
+
+# --- Embedding cache ---
+# The same queries (and Q&A texts) come back over and over; embed each distinct
+# text once per model. In-memory LRU in front of an optional SQLite store
+# (EMBEDDING_CACHE_PATH) so the cache also survives restarts.
+_embedding_cache = OrderedDict()
+_embedding_lock = threading.Lock()
+_embedding_db = None
+_embedding_stats = {"hits": 0, "disk_hits": 0, "misses": 0}
+
+def _embedding_key(text: str) -> str:
+    return hashlib.sha1(f"{EMBEDDING_MODEL}\0{text}".encode("utf-8")).hexdigest()
+
+def _get_embedding_db():
+    global _embedding_db
+    if _embedding_db is None and EMBEDDING_CACHE_PATH:
+        _embedding_db = sqlite3.connect(EMBEDDING_CACHE_PATH, check_same_thread=False)
+        _embedding_db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB)")
+    return _embedding_db
+
+def _remember(key: str, vector: list):
+    _embedding_cache[key] = vector
+    _embedding_cache.move_to_end(key)
+    while len(_embedding_cache) > EMBEDDING_CACHE_SIZE:
+        _embedding_cache.popitem(last=False)
 
-# Use a standard embedding model
-sentence_transformer_ef = embedding_functions.SentenceTransformerEmbeddingFunction(model_name="all-MiniLM-L6-v2")
+def embed(texts: list) -> list:
+    """
+    Embeddings for `texts` (same order), computing only the ones not cached.
+    Misses are encoded in a single batch. Pass the result to Chroma as
+    query_embeddings/embeddings so it doesn't embed the text again.
+    """
+    keys = [_embedding_key(text) for text in texts]
+    found = {}
+    with _embedding_lock:
+        for key in keys:
+            if key in _embedding_cache:
+                _embedding_cache.move_to_end(key)
+                found[key] = _embedding_cache[key]
+                _embedding_stats["hits"] += 1
+
+        db = _get_embedding_db()
+        pending = [key for key in dict.fromkeys(keys) if key not in found]
+        if db and pending:
+            marks = ",".join("?" * len(pending))
+            for key, blob in db.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({marks})", pending):
+                found[key] = array("f", blob).tolist()
+                _remember(key, found[key])
+                _embedding_stats["disk_hits"] += 1
+
+    missing = {key: text for key, text in zip(keys, texts) if key not in found}
+    if missing:
+        vectors = get_embedding_function()(list(missing.values()))
+        computed = {key: [float(x) for x in vector] for key, vector in zip(missing, vectors)}
+        found.update(computed)
+        with _embedding_lock:
+            _embedding_stats["misses"] += len(computed)
+            for key, vector in computed.items():
+                _remember(key, vector)
+            db = _get_embedding_db()
+            if db:
+                with db:
+                    db.executemany(
+                        "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                        [(key, array("f", vector).tobytes()) for key, vector in computed.items()]
+                    )
+    return [found[key] for key in keys]
+
+def embedding_cache_stats():
+    """Hit/miss counters of the embedding cache (for /metrics)."""
+    with _embedding_lock:
+        return {**_embedding_stats, "size": len(_embedding_cache), "max_size": EMBEDDING_CACHE_SIZE, "disk": bool(EMBEDDING_CACHE_PATH)}
+
+def warm_up():
+    """Load the client, embedding model and memory collection now instead of on the first query."""
+    get_collection()
+    get_embedding_function()
+    return True
+
+_preload_thread = None
+
+def preload():
+    """Start warm_up on a background thread (once per process); returns the thread."""
+    global _preload_thread
+    with _init_lock:
+        if _preload_thread is None:
+            def run():
+                try:
+                    warm_up()
+                except Exception as e:
+                    print(f"Warning: memory preload failed: {e}")
+            _preload_thread = threading.Thread(target=run, name="memory-preload", daemon=True)
+            _preload_thread.start()
+    return _preload_thread
+
+def is_warm():
+    """True once the embedding model is loaded (vector queries won't pay the startup cost)."""
+    return _embedding_function is not None
+
+def __getattr__(name):
+    # Backwards compatibility for code importing the old module-level globals
+    if name == "chroma_client":
+        return get_chroma_client()
+    if name == "sentence_transformer_ef":
+        return get_embedding_function()
+    if name == "collection":
+        return get_collection()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# Callbacks (event, ids, documents) run after memories are added ("add") or
+# removed ("delete"), e.g. to keep the lexical index in agents/retrieval.py in sync
+_listeners = []
 
-# Get or create collection
-collection = chroma_client.get_or_create_collection(
-    name="llm_memory",
-    embedding_function=sentence_transformer_ef
-)
+def add_listener(callback):
+    _listeners.append(callback)
+
+def _notify(event: str, ids: list, documents: list = None):
+    for callback in _listeners:
+        try:
+            callback(event, ids, documents)
+        except Exception as e:
+            print(f"Warning: memory listener failed: {e}")
 
 def add_to_memory(query: str, answer: str, source: str):
     """
     Save a Q&A pair to the vector database.
     """
-    timestamp = datetime.now().isoformat()
-    
-    # Create a unique ID
-    doc_id = f"{source}_{timestamp}"
-    
-    # We store the Q&A pair as the document text for retrieval
-    document_text = f"Question: {query}\nAnswer: {answer}"
+    return add_many_to_memory([(query, answer, source)])
+
+def add_many_to_memory(pairs: list, timestamps: list = None):
+    """
+    Save several (query, answer, source) pairs with a single collection.add:
+    one batched embedding pass and one SQLite transaction for the whole batch.
+    """
+    if not pairs:
+        return True
+    timestamps = timestamps or [datetime.now().isoformat()] * len(pairs)
+
+    documents, metadatas, ids = [], [], []
+    for (query, answer, source), timestamp in zip(pairs, timestamps):
+        # Create a unique ID (suffixed if the same source/timestamp repeats in the batch)
+        doc_id = f"{source}_{timestamp}"
+        if doc_id in ids:
+            doc_id = f"{doc_id}_{len(ids)}"
+        
+        # We store the Q&A pair as the document text for retrieval
+        documents.append(f"Question: {query}\nAnswer: {answer}")
+        metadatas.append({"query": query, "answer": answer, "source": source, "timestamp": timestamp})
+        ids.append(doc_id)
     
-    collection.add(
-        documents=[document_text],
-        metadatas=[{"query": query, "answer": answer, "source": source, "timestamp": timestamp}],
-        ids=[doc_id]
-    )
+    get_collection().add(documents=documents, embeddings=embed(documents), metadatas=metadatas, ids=ids)
+    _index_history(added=[(meta["timestamp"], doc_id) for meta, doc_id in zip(metadatas, ids)])
+    _notify("add", ids, documents)
     return True
 
-def retrieve_context(query: str, n_results: int = 2):
+def retrieve_context(query: str, n_results: int = None, max_tokens: int = None):
     """
-    Retrieve relevant past Q&A pairs for a given query.
+    Retrieve relevant past Q&A pairs for a given query (hybrid BM25 + vector
+    search, see agents/retrieval.py), up to `n_results` pairs or `max_tokens`.
     """
-    results = collection.query(
-        query_texts=[query],
-        n_results=n_results
-    )
+    from agents.retrieval import hybrid_search
     
     context = ""
-    if results["documents"]:
-        for i, doc in enumerate(results["documents"][0]):
-            context += f"\n[Memory {i+1}]: {doc}\n"
+    for i, (_, doc) in enumerate(hybrid_search(query, max_results=n_results, max_tokens=max_tokens)):
+        context += f"\n[Memory {i+1}]: {doc}\n"
             
     return context
 
-def export_dataset(output_file: str = "training_data.jsonl"):
+# --- History ---
+HISTORY_FIELDS = ("id", "query", "answer", "type", "timestamp")
+
+def iter_memories(page_size: int = None):
+    """
+    Yield (id, metadata) for every stored memory in storage (insertion) order.
+    Fetched page by page and without documents/embeddings, so memory use is
+    bounded by page_size no matter how large the collection is.
+    """
+    page_size = page_size or MEMORY_PAGE_SIZE
+    collection = get_collection()
+    offset = 0
+    while True:
+        page = collection.get(include=["metadatas"], limit=page_size, offset=offset)
+        yield from zip(page["ids"], page["metadatas"])
+        if len(page["ids"]) < page_size:
+            return
+        offset += page_size
+
+def _history_item(doc_id: str, meta: dict, fields=HISTORY_FIELDS):
+    item = {
+        "id": doc_id,
+        "query": meta.get("query", ""),
+        "answer": meta.get("answer", "No answer stored"),
+        "type": meta.get("source", "Unknown"),
+        "timestamp": meta.get("timestamp", "")
+    }
+    return {field: item[field] for field in fields}
+
+def _parse_cursor(cursor: str):
+    # Cursors are "<timestamp>" or "<timestamp>|<id>" (the id breaks ties between equal timestamps)
+    if not cursor:
+        return None
+    timestamp, _, doc_id = cursor.partition("|")
+    return (timestamp, doc_id)
+
+def _in_range(key, before, after):
+    if before and (key >= before if before[1] else key[0] >= before[0]):
+        return False
+    if after and (key <= after if after[1] else key[0] <= after[0]):
+        return False
+    return True
+
+# Sorted (timestamp, id) keys of every memory. Built by one metadata scan on
+# first use and kept current on add/delete (like the BM25 index in
+# agents/retrieval.py), so a history page is a binary search plus one
+# collection.get of that page's ids instead of a scan of the whole store.
+_history_keys = None
+_history_lock = threading.Lock()
+
+def _history_index() -> list:
+    global _history_keys
+    with _history_lock:
+        if _history_keys is None:
+            _history_keys = sorted((meta.get("timestamp", ""), doc_id) for doc_id, meta in iter_memories())
+        return _history_keys
+
+def _index_history(added=(), deleted=()):
+    with _history_lock:
+        if _history_keys is None:
+            return  # built (with these changes) on first use
+        for key in added:
+            i = bisect.bisect_left(_history_keys, key)
+            if i == len(_history_keys) or _history_keys[i] != key:
+                _history_keys.insert(i, key)
+        if deleted:
+            deleted = set(deleted)
+            _history_keys[:] = [key for key in _history_keys if key[1] not in deleted]
+
+def _history_range(before, after, limit: int = None, newest_first: bool = True) -> list:
+    """Copy of the index keys between the exclusive cursors (the `limit` newest or oldest of them)."""
+    keys = _history_index()
+    with _history_lock:
+        hi = len(keys)
+        if before:
+            hi = bisect.bisect_left(keys, before) if before[1] else bisect.bisect_left(keys, before[0], key=lambda k: k[0])
+        lo = 0
+        if after:
+            lo = bisect.bisect_right(keys, after) if after[1] else bisect.bisect_right(keys, after[0], key=lambda k: k[0])
+        hi = max(lo, hi)
+        if limit is not None:
+            return keys[max(lo, hi - limit):hi][::-1] if newest_first else keys[lo:min(hi, lo + limit)]
+        return keys[lo:hi]
+
+def _fetch_history(keys: list, fields):
+    """History items for index keys (same order); ids deleted meanwhile are skipped."""
+    if not keys:
+        return []
+    page = get_collection().get(ids=[doc_id for _, doc_id in keys], include=["metadatas"])
+    metas = dict(zip(page["ids"], page["metadatas"]))
+    return [_history_item(doc_id, metas[doc_id], fields) for _, doc_id in keys if doc_id in metas]
+
+def get_history(limit: int = 50, before: str = None, after: str = None, newest_first: bool = True, fields=HISTORY_FIELDS):
+    """
+    One page of history ordered by timestamp. `before`/`after` are exclusive
+    cursors (a timestamp, or the next_cursor of a previous page). The page is
+    located in the in-process (timestamp, id) index and only its items are read.
+    Returns (items, next_cursor); next_cursor is None on the last page.
     """
-    Export all memory items to a JSONL file for fine-tuning.
+    page = _history_range(_parse_cursor(before), _parse_cursor(after), limit, newest_first)
+
+    items = _fetch_history(page, fields)
+    next_cursor = None
+    if len(page) == limit:
+        timestamp, doc_id = page[-1]
+        next_cursor = f"{timestamp}|{doc_id}"
+    return items, next_cursor
+
+def iter_history(before: str = None, after: str = None, fields=HISTORY_FIELDS):
+    """Every history item, newest first, for full dumps (read MEMORY_PAGE_SIZE items at a time)."""
+    keys = _history_range(_parse_cursor(before), _parse_cursor(after))
+    for end in range(len(keys), 0, -MEMORY_PAGE_SIZE):
+        yield from _fetch_history(keys[max(end - MEMORY_PAGE_SIZE, 0):end][::-1], fields)
+
+# --- Export ---
+EXPORT_SUFFIXES = {None: "", "gzip": ".gz", "zstd": ".zst"}
+
+def _open_export(path: str, compression: str, mode: str):
+    """Text-mode writer for the export file, optionally compressed."""
+    if compression == "gzip":
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    if compression == "zstd":
+        import zstandard
+        return zstandard.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+def _read_watermark(path: str):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            mark = json.load(f)
+        return f"{mark['timestamp']}|{mark['id']}"
+    except (OSError, ValueError, KeyError):
+        return None
+
+def export_dataset(output_file: str = "training_data.jsonl", compression: str = None, incremental: bool = False):
+    """
+    Export memory items to a JSONL file for fine-tuning.
     Format: {"instruction": query, "input": "", "output": answer}
+
+    Pages through metadatas only (no documents/embeddings) and writes as it
+    goes, so memory use stays bounded. `compression` is None, "gzip" or
+    "zstd". With `incremental`, only items newer than the watermark left by
+    the previous run are appended (gzip/zstd members concatenate cleanly).
     """
-    # Get all data
-    all_data = collection.get()
-    
-    if not all_data["metadatas"]:
-        return "No data to export."
-        
+    if compression not in EXPORT_SUFFIXES:
+        return f"Unknown compression '{compression}'. Use gzip or zstd."
+    if compression == "zstd" and importlib.util.find_spec("zstandard") is None:
+        return "zstd export requires the 'zstandard' package (pip install zstandard)."
+    suffix = EXPORT_SUFFIXES[compression]
+    if suffix and not output_file.endswith(suffix):
+        output_file += suffix
+    watermark_file = f"{output_file}.watermark"
+    since = _read_watermark(watermark_file) if incremental else None
+    after = _parse_cursor(since)
+
     count = 0
-    with open(output_file, "w", encoding="utf-8") as f:
-        for metadata in all_data["metadatas"]:
+    newest = None
+    with _open_export(output_file, compression, "a" if since else "w") as f:
+        for doc_id, metadata in iter_memories():
+            key = (metadata.get("timestamp", ""), doc_id)
+            if not _in_range(key, None, after):
+                continue
             entry = {
                 "instruction": metadata["query"],
                 "input": "",
@@ -82,5 +439,188 @@ def export_dataset(output_file: str = "training_data.jsonl"):
             }
             f.write(json.dumps(entry) + "\n")
             count += 1
-            
-    return f"Exported {count} items to {output_file}"
+            newest = max(newest, key) if newest else key
+
+    if newest:
+        with open(watermark_file, "w", encoding="utf-8") as f:
+            json.dump({"timestamp": newest[0], "id": newest[1]}, f)
+
+    if count == 0:
+        return "No new data to export." if since else "No data to export."
+    return f"Exported {count} {'new ' if since else ''}items to {output_file}"
+
+# --- Compaction ---
+def _dir_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+def compact_memory(similarity: float = None, retention: dict = None, dry_run: bool = False, neighbors: int = 10):
+    """
+    Shrink the memory collection:
+    1. Retention per source: `retention` maps a source (or "*" for any other
+       source) to {"max_age_days": N, "max_count": N}; older/excess entries go.
+    2. Near-duplicates: entries whose embeddings have cosine similarity >=
+       `similarity` with a better entry are dropped. Better = not an error
+       answer, then newest.
+    Returns a report of what was (or, with dry_run, would be) removed and the
+    size of the store before/after.
+    """
+    import numpy as np
+
+    similarity = MEMORY_DEDUP_THRESHOLD if similarity is None else similarity
+    retention = MEMORY_RETENTION if retention is None else retention
+    bytes_before = _dir_size(MEMORY_DB_PATH)
+    now = datetime.now()
+
+    # Rank key per entry: (usable answer, timestamp, id); ids/timestamps only, no documents
+    by_source = {}
+    for doc_id, meta in iter_memories():
+        usable = not str(meta.get("answer", "")).startswith("Error")
+        by_source.setdefault(meta.get("source", "Unknown"), []).append((usable, meta.get("timestamp", ""), doc_id))
+
+    expired, over_limit = set(), set()
+    for source, keys in by_source.items():
+        rule = retention.get(source, retention.get("*", {}))
+        keys.sort(key=lambda k: (k[1], k[2]), reverse=True)  # newest first
+        if rule.get("max_age_days"):
+            cutoff = (now - timedelta(days=rule["max_age_days"])).isoformat()
+            expired.update(k[2] for k in keys if k[1] < cutoff)
+        if rule.get("max_count"):
+            live = [k for k in keys if k[2] not in expired]
+            over_limit.update(k[2] for k in live[rule["max_count"]:])
+
+    # Best entries first, so each cluster keeps its best member
+    ranked = sorted((k for keys in by_source.values() for k in keys if k[2] not in expired and k[2] not in over_limit), reverse=True)
+    rank = {k[2]: i for i, k in enumerate(ranked)}
+    duplicates = set()
+    collection = get_collection()
+    if 0 < similarity <= 1 and len(ranked) > 1:
+        for start in range(0, len(ranked), MEMORY_PAGE_SIZE):
+            page_ids = [k[2] for k in ranked[start:start + MEMORY_PAGE_SIZE] if k[2] not in duplicates]
+            if not page_ids:
+                continue
+            page = collection.get(ids=page_ids, include=["embeddings"])
+            results = collection.query(
+                query_embeddings=page["embeddings"],
+                n_results=min(neighbors + 1, len(rank)),
+                include=["embeddings"]
+            )
+            rows = sorted(zip(page["ids"], page["embeddings"], results["ids"], results["embeddings"]), key=lambda row: rank[row[0]])
+            for doc_id, vector, hit_ids, hit_vectors in rows:
+                if doc_id in duplicates:
+                    continue
+                vector = np.asarray(vector, dtype=float)
+                for other, other_vector in zip(hit_ids, hit_vectors):
+                    if other not in rank or rank[other] <= rank[doc_id] or other in duplicates:
+                        continue
+                    other_vector = np.asarray(other_vector, dtype=float)
+                    cosine = float(vector @ other_vector / (np.linalg.norm(vector) * np.linalg.norm(other_vector) or 1.0))
+                    if cosine >= similarity:
+                        duplicates.add(other)
+
+    victims = list(expired | over_limit | duplicates)
+    if not dry_run:
+        for start in range(0, len(victims), MEMORY_PAGE_SIZE):
+            collection.delete(ids=victims[start:start + MEMORY_PAGE_SIZE])
+        _index_history(deleted=victims)
+        _notify("delete", victims)
+
+    bytes_after = _dir_size(MEMORY_DB_PATH)
+    return {
+        "scanned": sum(len(keys) for keys in by_source.values()),
+        "expired": len(expired),
+        "over_limit": len(over_limit),
+        "duplicates": len(duplicates),
+        "removed": len(victims),
+        "dry_run": dry_run,
+        "bytes_before": bytes_before,
+        "bytes_after": bytes_after,
+        # SQLite keeps freed pages and reuses them for new memories, so the file
+        # may not shrink right away even though the index/row count did
+        "reclaimed_bytes": max(bytes_before - bytes_after, 0)
+    }
+
+# --- Async API ---
+# Embedding (sentence-transformers) and Chroma/SQLite calls are CPU/IO bound and
+# synchronous; running them on the event loop stalls every other connection.
+# Reads go through a small bounded thread pool, writes through a background queue.
+_executor = ThreadPoolExecutor(max_workers=MEMORY_WORKERS, thread_name_prefix="memory")
+
+async def run_blocking(func, *args):
+    """Run a blocking memory/embedding call on the memory thread pool."""
+    return await asyncio.get_running_loop().run_in_executor(_executor, func, *args)
+
+async def aretrieve_context(query: str, n_results: int = None, max_tokens: int = None):
+    """Async retrieve_context that does not block the event loop."""
+    return await run_blocking(retrieve_context, query, n_results, max_tokens)
+
+_write_queue = queue.Queue(maxsize=MEMORY_WRITE_QUEUE_SIZE)
+_writer = None
+_writer_lock = threading.Lock()
+_FLUSH = object()  # queue marker: write the current batch now
+
+def _writer_loop():
+    # Write-behind: gather pairs until the batch is full, the flush interval
+    # has passed since the first one, or a flush is requested, then save them in one go
+    while True:
+        batch, stamps, markers = [], [], 0
+        deadline = None
+        while len(batch) < MEMORY_BATCH_SIZE:
+            timeout = None if deadline is None else deadline - time.monotonic()
+            if timeout is not None and timeout <= 0:
+                break
+            try:
+                item = _write_queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is _FLUSH:
+                markers += 1
+                break
+            query, answer, source, timestamp = item
+            batch.append((query, answer, source))
+            stamps.append(timestamp)
+            if deadline is None:
+                deadline = time.monotonic() + MEMORY_FLUSH_INTERVAL
+        try:
+            add_many_to_memory(batch, stamps)
+        except Exception as e:
+            print(f"Warning: background memory save of {len(batch)} pairs failed: {e}")
+        finally:
+            for _ in range(len(batch) + markers):
+                _write_queue.task_done()
+
+def _ensure_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is None or not _writer.is_alive():
+            _writer = threading.Thread(target=_writer_loop, name="memory-writer", daemon=True)
+            _writer.start()
+
+def enqueue_memory(query: str, answer: str, source: str):
+    """
+    Fire-and-forget add_to_memory: the Q&A pair is saved by a background
+    writer (batched with others) so the caller can respond immediately.
+    Returns False (and drops the pair) if the write queue is full.
+    """
+    _ensure_writer()
+    try:
+        _write_queue.put_nowait((query, answer, source, datetime.now().isoformat()))
+        return True
+    except queue.Full:
+        print("Warning: memory write queue full, dropping Q&A pair")
+        return False
+
+def flush_memory():
+    """Write any buffered Q&A pairs now and block until they are saved."""
+    if _writer is not None and _writer.is_alive():
+        _write_queue.put(_FLUSH)
+        _write_queue.join()
+
+# Don't lose queued writes when the process exits normally
+atexit.register(flush_memory)
@@ -0,0 +1,116 @@
+import hashlib
+import json
+import time
+from typing import Optional
+
+from agents.memory import get_collection, embed
+
+# Import centralized config for portability
+try:
+    from config import SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_TTL, SEMANTIC_CACHE_MAX_ENTRIES
+except ImportError:
+    SEMANTIC_CACHE_THRESHOLD = 0.95
+    SEMANTIC_CACHE_TTL = 86400.0
+    SEMANTIC_CACHE_MAX_ENTRIES = 1000
+
+def _collection():
+    # Separate collection from llm_memory: cosine space so distances map to similarity.
+    # Resolved lazily so importing the cache doesn't load the embedding model.
+    return get_collection("response_cache", metadata={"hnsw:space": "cosine"})
+
+def _normalize(query: str) -> str:
+    return " ".join(query.lower().split())
+
+def cache_key(online_models: list, offline_models: list, synthesizer_model: Optional[str]) -> str:
+    """
+    Key for a provider selection. Answers are only reused for the same set of
+    models and synthesizer, regardless of the order they were selected in.
+    """
+    selection = {
+        "online": sorted(online_models),
+        "offline": sorted(offline_models),
+        "synthesizer": synthesizer_model or ""
+    }
+    return hashlib.sha1(json.dumps(selection, sort_keys=True).encode()).hexdigest()
+
+def lookup(query: str, key: str, threshold: float = SEMANTIC_CACHE_THRESHOLD):
+    """
+    Return the cached answer for the most similar query under `key`, or None.
+    Hit: {"final_answer", "individual_responses", "similarity", "cached_query"}.
+    """
+    try:
+        results = _collection().query(
+            query_embeddings=embed([query]),
+            n_results=1,
+            where={"cache_key": key},
+            include=["metadatas", "distances"]
+        )
+    except Exception:
+        # Chroma raises when the filtered set is empty on some versions
+        return None
+
+    if not results["ids"] or not results["ids"][0]:
+        return None
+
+    doc_id = results["ids"][0][0]
+    meta = results["metadatas"][0][0]
+    similarity = 1.0 - results["distances"][0][0]
+    now = time.time()
+
+    if now - meta["created"] > SEMANTIC_CACHE_TTL:
+        _collection().delete(ids=[doc_id])
+        return None
+    if similarity < threshold:
+        return None
+
+    _collection().update(ids=[doc_id], metadatas=[{**meta, "last_hit": now, "hits": meta.get("hits", 0) + 1}])
+    return {
+        "final_answer": meta["final_answer"],
+        "individual_responses": json.loads(meta["responses"]),
+        "similarity": similarity,
+        "cached_query": meta["query"]
+    }
+
+def store(query: str, key: str, final_answer: str, responses: dict):
+    """Cache a synthesized answer. Failed syntheses are never cached."""
+    if final_answer.startswith("Error"):
+        return False
+
+    now = time.time()
+    doc_id = f"{key}_{hashlib.sha1(_normalize(query).encode()).hexdigest()}"
+    _collection().upsert(
+        ids=[doc_id],
+        documents=[query],
+        embeddings=embed([query]),
+        metadatas=[{
+            "cache_key": key,
+            "query": query,
+            "final_answer": final_answer,
+            "responses": json.dumps(responses),
+            "created": now,
+            "last_hit": now,
+            "hits": 0
+        }]
+    )
+    _evict()
+    return True
+
+def _evict():
+    """Drop expired entries, then the least recently used ones beyond the size cap."""
+    if _collection().count() <= SEMANTIC_CACHE_MAX_ENTRIES:
+        return
+
+    entries = _collection().get(include=["metadatas"])
+    now = time.time()
+    expired, live = [], []
+    for doc_id, meta in zip(entries["ids"], entries["metadatas"]):
+        if now - meta["created"] > SEMANTIC_CACHE_TTL:
+            expired.append(doc_id)
+        else:
+            live.append((meta["last_hit"], doc_id))
+
+    live.sort()
+    overflow = max(len(live) - SEMANTIC_CACHE_MAX_ENTRIES, 0)
+    victims = expired + [doc_id for _, doc_id in live[:overflow]]
+    if victims:
+        _collection().delete(ids=victims)
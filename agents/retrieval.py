@@ -0,0 +1,202 @@
+import math
+import re
+import threading
+from collections import Counter
+
+from agents import memory
+
+# Import centralized config for portability
+try:
+    from config import MEMORY_CONTEXT_TOKENS, MEMORY_MAX_RESULTS, MEMORY_MIN_SIMILARITY, MEMORY_MIN_KEYWORD_MATCH
+except ImportError:
+    MEMORY_CONTEXT_TOKENS = 600
+    MEMORY_MAX_RESULTS = 8
+    MEMORY_MIN_SIMILARITY = 0.3
+    MEMORY_MIN_KEYWORD_MATCH = 0.4
+
+RRF_K = 60  # reciprocal-rank fusion constant (standard value)
+CANDIDATES = 20  # hits taken from each retriever before fusion
+
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how i in is it of on or "
+    "that the this to was what when where which who why will with you question answer".split()
+)
+
+def tokenize(text: str):
+    return [t for t in re.findall(r"\w+", text.lower()) if t not in STOPWORDS]
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token for English text)."""
+    return len(text) // 4 + 1
+
+class BM25Index:
+    """
+    In-memory inverted index over the memory documents, scored with Okapi BM25.
+    Only term frequencies are kept, not the texts themselves.
+    """
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = {}  # term -> {doc_id: term frequency}
+        self.lengths = {}   # doc_id -> number of tokens
+        self.terms = {}     # doc_id -> distinct terms (to unindex it)
+        self.total_length = 0
+        self.lock = threading.Lock()
+
+    def add(self, doc_id: str, text: str):
+        terms = Counter(tokenize(text))
+        with self.lock:
+            self._remove(doc_id)
+            for term, tf in terms.items():
+                self.postings.setdefault(term, {})[doc_id] = tf
+            self.lengths[doc_id] = sum(terms.values())
+            self.terms[doc_id] = tuple(terms)
+            self.total_length += self.lengths[doc_id]
+
+    def remove(self, doc_id: str):
+        with self.lock:
+            self._remove(doc_id)
+
+    def _remove(self, doc_id: str):
+        if doc_id not in self.lengths:
+            return
+        self.total_length -= self.lengths.pop(doc_id)
+        for term in self.terms.pop(doc_id):
+            docs = self.postings[term]
+            del docs[doc_id]
+            if not docs:
+                del self.postings[term]
+
+    def search(self, query: str, k: int = CANDIDATES):
+        """Top `k` (doc_id, score) for the query terms, best first."""
+        with self.lock:
+            n = len(self.lengths)
+            if not n:
+                return []
+            avg_length = self.total_length / n
+            scores = Counter()
+            for term in set(tokenize(query)):
+                docs = self.postings.get(term)
+                if not docs:
+                    continue
+                idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+                for doc_id, tf in docs.items():
+                    norm = 1 - self.b + self.b * self.lengths[doc_id] / avg_length
+                    scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + self.k1 * norm)
+            return scores.most_common(k)
+
+    def query_weight(self, query: str) -> float:
+        """
+        Summed IDF of the query terms (terms missing from the index included):
+        roughly the score of a document matching every term once, used to
+        judge how much of the query a hit covers.
+        """
+        with self.lock:
+            n = len(self.lengths)
+            return sum(math.log(1 + (n - len(self.postings.get(term, ())) + 0.5) / (len(self.postings.get(term, ())) + 0.5))
+                       for term in set(tokenize(query)))
+
+    def __len__(self):
+        return len(self.lengths)
+
+_index = None
+_index_lock = threading.Lock()
+_pending = None  # memory changes that happen while the index is being built
+_pending_lock = threading.Lock()
+
+def _apply(index: BM25Index, event: str, ids: list, documents: list = None):
+    if event == "add":
+        for doc_id, text in zip(ids, documents):
+            index.add(doc_id, text)
+    elif event == "delete":
+        for doc_id in ids:
+            index.remove(doc_id)
+
+def get_index():
+    """The BM25 index, built from the memory collection on first use and kept in sync after."""
+    global _index, _pending
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                with _pending_lock:
+                    _pending = []
+                index = BM25Index()
+                for doc_id, meta in memory.iter_memories():
+                    index.add(doc_id, f"Question: {meta.get('query', '')}\nAnswer: {meta.get('answer', '')}")
+                with _pending_lock:
+                    for change in _pending:
+                        _apply(index, *change)
+                    _pending = None
+                    _index = index
+    return _index
+
+def _on_memory_change(event: str, ids: list, documents: list = None):
+    with _pending_lock:
+        if _index is None:
+            if _pending is not None:
+                _pending.append((event, ids, documents))
+            return  # not built yet: the first search reads everything
+    _apply(_index, event, ids, documents)
+
+memory.add_listener(_on_memory_change)
+
+def _vector_hits(query: str, k: int):
+    results = memory.get_collection().query(
+        query_embeddings=memory.embed([query]),
+        n_results=k,
+        include=["documents", "distances"]
+    )
+    hits = []
+    for doc_id, doc, distance in zip(results["ids"][0], results["documents"][0], results["distances"][0]):
+        # Default l2 space on normalized MiniLM vectors: squared distance = 2 - 2 * cosine
+        if 1 - distance / 2 >= MEMORY_MIN_SIMILARITY:
+            hits.append((doc_id, doc))
+    return hits
+
+def hybrid_search(query: str, max_results: int = None, max_tokens: int = None, lexical_only: bool = None):
+    """
+    Memories for `query`, best first, as [(doc_id, document)]. BM25 and vector
+    hits are fused by reciprocal rank, then cut at `max_results` or when the
+    documents would exceed `max_tokens`. Vector hits below
+    MEMORY_MIN_SIMILARITY and BM25 hits covering less than
+    MEMORY_MIN_KEYWORD_MATCH of the query's term weight (e.g. a single shared
+    common word) are dropped before fusion. Until the embedding model
+    is loaded (or with lexical_only) only the BM25 index is used, and the model
+    starts loading in the background.
+    """
+    max_results = max_results or MEMORY_MAX_RESULTS
+    max_tokens = max_tokens or MEMORY_CONTEXT_TOKENS
+    if lexical_only is None:
+        lexical_only = not memory.is_warm()
+        if lexical_only:
+            memory.preload()
+
+    fused = Counter()
+    documents = {}
+    index = get_index()
+    cutoff = MEMORY_MIN_KEYWORD_MATCH * index.query_weight(query)
+    lexical = [(doc_id, score) for doc_id, score in index.search(query, CANDIDATES) if score >= cutoff]
+    for rank, (doc_id, _) in enumerate(lexical):
+        fused[doc_id] += 1 / (RRF_K + rank + 1)
+    if not lexical_only:
+        for rank, (doc_id, doc) in enumerate(_vector_hits(query, CANDIDATES)):
+            fused[doc_id] += 1 / (RRF_K + rank + 1)
+            documents[doc_id] = doc
+
+    ranked = [doc_id for doc_id, _ in fused.most_common(max_results)]
+    missing = [doc_id for doc_id in ranked if doc_id not in documents]
+    if missing:
+        found = memory.get_collection().get(ids=missing, include=["documents"])
+        documents.update(zip(found["ids"], found["documents"]))
+
+    selected, used = [], 0
+    for doc_id in ranked:
+        doc = documents.get(doc_id)
+        if doc is None:
+            continue
+        cost = estimate_tokens(doc)
+        if selected and used + cost > max_tokens:
+            break
+        selected.append((doc_id, doc))
+        used += cost
+    return selected
@@ -1,17 +1,46 @@
-from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
-from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
+from fastapi import FastAPI, HTTPException, Query, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from contextlib import asynccontextmanager
+from typing import List, Optional, Dict, Any, Literal
 import uvicorn
 import asyncio
-import httpx
 import os
 import json
 from sse_starlette.sse import EventSourceResponse
-from llm_providers import fetch_openai, fetch_anthropic, fetch_gemini, fetch_perplexity, fetch_ollama, fetch_generic_openai_compatible
-from offline_model import synthesize_responses
+from llm_providers import fan_out, fan_out_stream, close_clients, pool_stats, is_success
+from provider_registry import get_registry, resolve, build_tasks
+from offline_model import synthesize_responses, synthesize_responses_stream, synthesize_map_reduce, synthesize_map_reduce_stream, prompt_stats
+from singleflight import SingleFlight
+from consensus import find_consensus, agreement_summary, CONSENSUS_ENABLED
+from provider_health import health_report
+from retry_policy import retry_stats
+from rate_limiter import limiter_stats
+from fleet import fleet
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Startup/shutdown hooks: load the embedding model and scan the Ollama fleet in
+    the background on startup (the API accepts requests right away) and schedule
+    memory compaction; finish queued memory saves and release pooled upstream
+    connections on exit.
+    """
+    if MEMORY_AVAILABLE and MEMORY_PRELOAD:
+        preload()
+    fleet.refresh_in_background()
+    compaction = None
+    if MEMORY_AVAILABLE and MEMORY_COMPACT_INTERVAL > 0:
+        compaction = asyncio.create_task(compact_periodically(MEMORY_COMPACT_INTERVAL * 3600))
+    yield
+    if compaction:
+        compaction.cancel()
+    if MEMORY_AVAILABLE:
+        await asyncio.to_thread(flush_memory)
+    await close_clients()
 
 # Initialize FastAPI
-app = FastAPI(title="AI Nexus API", description="Backend for AI Nexus Mobile App")
+app = FastAPI(title="AI Nexus API", description="Backend for AI Nexus Mobile App", lifespan=lifespan)
 
 # Add CORS Middleware
 from fastapi.middleware.cors import CORSMiddleware
@@ -31,20 +60,259 @@ class ChatRequest(BaseModel):
     offline_models: List[str] = [] # List of model names (assumed local for now)
     use_memory: bool = True
     synthesizer_model: Optional[str] = None # Name of model to use for synthesis
+    quorum: Optional[int] = Field(None, ge=1) # Synthesize as soon as this many models answered
+    deadline_ms: Optional[int] = Field(None, ge=1) # Synthesize with whatever arrived by this deadline
+    use_cache: bool = True # Reuse the answer of a near-identical earlier query
+    synthesis_mode: Literal["single", "map_reduce"] = "single" # map_reduce: merge groups of responses in parallel first
 
 class ChatResponse(BaseModel):
     final_answer: str
     individual_responses: Dict[str, str]
+    dropped_models: List[str] = []
+    cached: bool = False
+    agreement: Optional[Dict[str, Any]] = None # Pairwise agreement between the model answers
 
 # --- Memory Integration ---
 MEMORY_AVAILABLE = False
 try:
-    from agents.memory import add_to_memory, retrieve_context, export_dataset
-    import chromadb
+    from agents.memory import aretrieve_context, enqueue_memory, flush_memory, export_dataset, get_history, iter_history, preload, embedding_cache_stats, compact_memory, HISTORY_FIELDS
     MEMORY_AVAILABLE = True
 except ImportError:
     pass
 
+try:
+    from config import MEMORY_PRELOAD, EXPORT_PATH, MEMORY_COMPACT_INTERVAL
+except ImportError:
+    MEMORY_PRELOAD = True
+    EXPORT_PATH = "training_data.jsonl"
+    MEMORY_COMPACT_INTERVAL = 0
+
+async def compact_periodically(interval: float):
+    """Background job: compact memory every `interval` seconds (off the event loop)."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            report = await asyncio.to_thread(compact_memory)
+            print(f"Memory compaction: removed {report['removed']} of {report['scanned']} entries")
+        except Exception as e:
+            print(f"Warning: memory compaction failed: {e}")
+
+# --- Semantic Response Cache ---
+try:
+    from config import SEMANTIC_CACHE_ENABLED
+except ImportError:
+    SEMANTIC_CACHE_ENABLED = True
+
+CACHE_AVAILABLE = False
+response_cache = None
+if SEMANTIC_CACHE_ENABLED:
+    try:
+        from agents import response_cache
+        from agents.memory import run_blocking
+        CACHE_AVAILABLE = True
+    except ImportError:
+        pass
+
+async def lookup_cached_answer(query: str, online_models: List[str], offline_models: List[str], synthesizer_model: Optional[str]):
+    """
+    Returns (cache_key, hit). cache_key is None when caching is unavailable;
+    hit is None on a miss.
+    """
+    if not CACHE_AVAILABLE:
+        return None, None
+    key = response_cache.cache_key(online_models, offline_models, synthesizer_model or "llama3")
+    try:
+        # Embedding the query runs on the bounded memory pool, like retrieval
+        return key, await run_blocking(response_cache.lookup, query, key)
+    except Exception as e:
+        print(f"Warning: semantic cache lookup failed: {e}")
+        return key, None
+
+# Strong references to fire-and-forget tasks so they are not garbage collected mid-run
+_background_tasks = set()
+
+def store_cached_answer(cache_key: Optional[str], query: str, final_answer: str, responses: Dict[str, str], dropped: Dict[str, str]):
+    """Cache the answer in the background so the response is not held up by the embedding."""
+    # Partial answers (quorum/deadline cut-offs) are not reused for later queries
+    if not cache_key or dropped:
+        return
+
+    def store():
+        try:
+            response_cache.store(query, cache_key, final_answer, responses)
+        except Exception as e:
+            print(f"Warning: semantic cache store failed: {e}")
+
+    task = asyncio.ensure_future(run_blocking(store))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+# --- Provider Fan-out ---
+def build_provider_tasks(query: str, online_models: List[str], offline_models: List[str], stream: bool = False):
+    """
+    Map the selected model names to (name, coroutine) pairs for fan_out, or to
+    (name, async iterator) pairs for fan_out_stream when `stream` is set.
+    Shared by /chat, /ws/chat and /stream/chat so they dispatch identically.
+    """
+    return build_tasks(resolve(online_models, offline_models), query, streaming=stream)
+
+def find_dropped(tasks: list, responses: Dict[str, str], quorum: Optional[int] = None, deadline_ms: Optional[int] = None):
+    """
+    Providers that were cut off by quorum/deadline, mapped to the marker
+    reported in individual_responses.
+    """
+    succeeded = sum(1 for res in responses.values() if is_success(res))
+    if quorum and succeeded >= quorum:
+        reason = f"Dropped: quorum of {quorum} responses reached first"
+    else:
+        reason = f"Dropped: no response within {deadline_ms} ms"
+    return {name: reason for name, _ in tasks if name not in responses}
+
+def to_seconds(deadline_ms: Optional[int]):
+    return deadline_ms / 1000 if deadline_ms else None
+
+# --- Chat Pipeline ---
+async def chat_pipeline(request: ChatRequest, source: str, stream: bool = True):
+    """
+    Run one chat request end to end and yield (event, payload) pairs:
+    status, model, delta, response, error, dropped, synthesis_delta and a
+    final complete. `stream` selects token-streaming providers and synthesis.
+    /chat only reads the complete payload; /stream/chat and /ws/chat forward
+    every event to the client.
+    """
+    # 0. Semantic cache: near-identical query with the same models answered before
+    cache_key = None
+    if request.use_cache:
+        cache_key, hit = await lookup_cached_answer(request.query, request.online_models, request.offline_models, request.synthesizer_model)
+        if hit:
+            yield "status", {"stage": "cached", "message": "Answered from cache"}
+            yield "complete", {
+                "final_answer": hit["final_answer"],
+                "individual_responses": hit["individual_responses"],
+                "dropped_models": [],
+                "cached": True
+            }
+            return
+
+    yield "status", {"stage": "processing", "message": "Processing query..."}
+
+    # 1. Retrieve Context
+    context = ""
+    if MEMORY_AVAILABLE and request.use_memory:
+        try:
+            context = await aretrieve_context(request.query)
+        except:
+            pass
+
+    # 2. Query Providers (concurrently, results/token deltas emitted as they arrive)
+    responses = {}
+    tasks = build_provider_tasks(request.query, request.online_models, request.offline_models, stream=stream)
+    for name, _ in tasks:
+        yield "model", {"model": name, "status": "querying"}
+
+    deadline = to_seconds(request.deadline_ms)
+    if stream:
+        events = fan_out_stream(tasks, quorum=request.quorum, deadline=deadline)
+    else:
+        events = (
+            (name, "done", res, error)
+            async for name, res, error in fan_out(tasks, quorum=request.quorum, deadline=deadline)
+        )
+
+    async for name, kind, res, error in events:
+        if kind == "delta":
+            yield "delta", {"model": name, "delta": res}
+            continue
+        responses[name] = res
+        if error is None:
+            yield "response", {"model": name, "content": res}
+        else:
+            yield "error", {"model": name, "error": str(error)}
+
+    dropped = find_dropped(tasks, responses, request.quorum, request.deadline_ms)
+    for name, reason in dropped.items():
+        yield "dropped", {"model": name, "reason": reason}
+
+    # 3. Consensus: skip the LLM synthesis when the models already agree
+    consensus = None
+    if CONSENSUS_ENABLED:
+        consensus = await asyncio.to_thread(find_consensus, responses)
+    agreement = agreement_summary(consensus, skipped=consensus["answer"] is not None) if consensus else None
+    if consensus and consensus["answer"] is not None:
+        final_answer = consensus["answer"]
+        yield "status", {"stage": "consensus", "message": f"Models agree ({consensus['agreement']:.0%}), using {consensus['best']}'s answer"}
+        if stream:
+            yield "synthesis_delta", {"delta": final_answer}
+    else:
+        # Only the parts the models disagree on (if consensus ran) go to the synthesizer
+        synthesis_input = consensus["responses"] if consensus else responses
+        yield "status", {"stage": "synthesizing", "message": "Synthesizing final answer..."}
+        target_model = request.synthesizer_model if request.synthesizer_model else "llama3"
+        synthesis_options = {}
+        if request.synthesis_mode == "map_reduce":
+            # Offline models share the synthesis work (each on its least loaded fleet replica), the synthesizer does the final merge
+            synthesis_options["nodes"] = [(None, model) for model in request.offline_models] or None
+        if stream:
+            synthesize_stream = synthesize_map_reduce_stream if request.synthesis_mode == "map_reduce" else synthesize_responses_stream
+            chunks = []
+            async for delta in synthesize_stream(
+                request.query, 
+                synthesis_input, 
+                context=context,
+                target_model=target_model,
+                **synthesis_options
+            ):
+                chunks.append(delta)
+                yield "synthesis_delta", {"delta": delta}
+            final_answer = "".join(chunks)
+        else:
+            synthesize = synthesize_map_reduce if request.synthesis_mode == "map_reduce" else synthesize_responses
+            final_answer = await synthesize(
+                request.query, 
+                synthesis_input, 
+                context=context,
+                target_model=target_model,
+                **synthesis_options
+            )
+
+    store_cached_answer(cache_key, request.query, final_answer, responses, dropped)
+
+    # 4. Save to Memory (fire-and-forget, the client gets the answer right away)
+    if MEMORY_AVAILABLE and request.use_memory:
+        enqueue_memory(request.query, final_answer, source)
+
+    yield "complete", {
+        "final_answer": final_answer,
+        "individual_responses": {**responses, **dropped},
+        "dropped_models": list(dropped),
+        "cached": False,
+        "agreement": agreement
+    }
+
+# --- Request Coalescing ---
+# Concurrent identical requests (mobile retries, trending questions) share one
+# fan-out and one synthesis; every subscriber receives the same event stream.
+chat_flights = SingleFlight()
+
+def flight_key(request: ChatRequest, stream: bool) -> str:
+    return json.dumps([
+        " ".join(request.query.lower().split()),
+        sorted(request.online_models),
+        sorted(request.offline_models),
+        request.synthesizer_model or "llama3",
+        # Options that change the answer also separate flights
+        request.quorum,
+        request.deadline_ms,
+        request.use_memory,
+        request.use_cache,
+        request.synthesis_mode,
+        stream
+    ])
+
+def run_chat(request: ChatRequest, source: str, stream: bool = True):
+    """Subscribe to the chat pipeline for this request, joining an identical in-flight one."""
+    return chat_flights.subscribe(flight_key(request, stream), lambda: chat_pipeline(request, source, stream))
+
 # --- Endpoints ---
 
 @app.get("/")
@@ -55,9 +323,13 @@ def root():
             "health": "/health",
             "models": "/models",
             "history": "/history",
+            "history_stream": "/history/stream",
+            "export": "/export",
+            "compact_memory": "/memory/compact",
             "chat": "/chat",
             "ws_chat": "/ws/chat",
             "stream_chat": "/stream/chat",
+            "metrics": "/metrics",
             "docs": "/docs"
         }
     }
@@ -68,131 +340,106 @@ def health_check():
 
 @app.get("/models")
 async def get_models():
-    """Fetch available models (Online & Local Ollama)"""
-    online = ["Free Web (g4f)", "ChatGPT (OpenAI)", "Claude (Anthropic)", "Gemini (Google)", "Perplexity"]
+    """
+    Available models (Online & Ollama fleet) from the cached fleet discovery, the
+    fleet nodes, online model prices and the circuit breaker health of providers used so far
+    """
+    online = [p for p in get_registry().values() if p.online]
+    nodes = await asyncio.to_thread(fleet.inventory)
+    offline = sorted({model for node in nodes if node["reachable"] for model in node["models"]})
+    costs = {p.label: list(p.cost) for p in online if any(p.cost)}
+    return {"online": [p.label for p in online], "offline": offline, "nodes": nodes, "costs": costs, "health": health_report()}
+
+@app.get("/metrics")
+def get_metrics():
+    """Connection pool, provider retry/rate limit, Ollama fleet, request coalescing, prompt size and embedding cache metrics"""
+    metrics = {
+        "http_pool": pool_stats(),
+        "retries": {provider: dict(stats) for provider, stats in retry_stats.items()},
+        "rate_limits": limiter_stats(),
+        "fleet": fleet.stats(),
+        "chat_flights": chat_flights.stats(),
+        "synthesis_prompt": dict(prompt_stats)
+    }
+    if MEMORY_AVAILABLE:
+        metrics["embedding_cache"] = embedding_cache_stats()
+    return metrics
+
+def parse_fields(fields: Optional[str]):
+    """Comma-separated field projection for history items (all fields if empty)."""
+    if not fields:
+        return HISTORY_FIELDS
+    selected = tuple(f.strip() for f in fields.split(",") if f.strip())
+    unknown = [f for f in selected if f not in HISTORY_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return selected
+
+@app.get("/history")
+def get_history_page(limit: int = Query(50, ge=1, le=1000), before: Optional[str] = None, after: Optional[str] = None,
+                     order: str = Query("desc", pattern="^(asc|desc)$"), fields: Optional[str] = None):
+    """
+    Chat history from Memory (ChromaDB), ordered by timestamp and paginated.
+    Pass `next_cursor` back as `before` (order=desc) or `after` (order=asc) for the next page.
+    """
+    if not MEMORY_AVAILABLE:
+        return {"error": "Memory module not available"}
     
-    # Import config for Ollama URL  
+    projection = parse_fields(fields)
     try:
-        from config import get_ollama_tags_url
-        ollama_tags_url = get_ollama_tags_url()
-    except ImportError:
-        ollama_tags_url = "http://localhost:11434/api/tags"
+        history, next_cursor = get_history(limit, before=before, after=after, newest_first=order == "desc", fields=projection)
+        return {"history": history, "next_cursor": next_cursor}
+    except Exception as e:
+        return {"error": str(e)}
+
+@app.get("/history/stream")
+def stream_history(before: Optional[str] = None, after: Optional[str] = None, fields: Optional[str] = None):
+    """Full history dump as NDJSON (one item per line, newest first), streamed page by page."""
+    if not MEMORY_AVAILABLE:
+        raise HTTPException(status_code=503, detail="Memory module not available")
+    
+    projection = parse_fields(fields)
+    lines = (json.dumps(item) + "\n" for item in iter_history(before=before, after=after, fields=projection))
+    return StreamingResponse(lines, media_type="application/x-ndjson")
+
+@app.post("/export")
+def export_memory(compression: Optional[str] = Query(None, pattern="^(gzip|zstd)$"), incremental: bool = False):
+    """Write the fine-tuning dataset (JSONL) to EXPORT_PATH on the server, same as the Knowledge tab."""
+    if not MEMORY_AVAILABLE:
+        raise HTTPException(status_code=503, detail="Memory module not available")
     
-    offline = []
     try:
-        async with httpx.AsyncClient() as client:
-            resp = await client.get(ollama_tags_url, timeout=2.0)
-            if resp.status_code == 200:
-                offline = [m["name"] for m in resp.json()["models"]]
+        return {"message": export_dataset(EXPORT_PATH, compression=compression, incremental=incremental)}
     except Exception as e:
-        print(f"Warning: Could not fetch Ollama models from {ollama_tags_url}: {e}")
-        
-    return {"online": online, "offline": offline}
+        raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/history")
-def get_history():
-    """Retrieve full chat history from Memory (ChromaDB)"""
+@app.post("/memory/compact")
+def compact_memory_endpoint(similarity: Optional[float] = Query(None, gt=0, le=1), dry_run: bool = False):
+    """Drop near-duplicate and expired memories (retention rules from MEMORY_RETENTION)."""
     if not MEMORY_AVAILABLE:
-        return {"error": "Memory module not available"}
+        raise HTTPException(status_code=503, detail="Memory module not available")
     
     try:
-        # We need to access the collection directly to get all items
-        # This is a bit of a hack since agents/memory.py abstracts it, 
-        # but for a full history dump we need raw access or a new function.
-        # Let's try to read the JSONL export if it exists, or query the DB.
-        # For simplicity/robustness, let's add a 'get_all_memories' to memory.py later.
-        # For now, we'll return a placeholder or try to read the DB if possible.
-        
-        # Better approach: Let's assume we update memory.py to support this.
-        # But since I can't edit memory.py in this single tool call, I'll implement a read here.
-        
-        client = chromadb.PersistentClient(path="./memory_db")
-        collection = client.get_or_create_collection(name="knowledge_base")
-        
-        # Get all items
-        results = collection.get()
-        
-        history = []
-        if results["ids"]:
-            for i in range(len(results["ids"])):
-                # Metadatas contains the answer and type
-                meta = results["metadatas"][i]
-                doc = results["documents"][i] # The query
-                
-                history.append({
-                    "id": results["ids"][i],
-                    "query": doc,
-                    "answer": meta.get("answer", "No answer stored"),
-                    "type": meta.get("type", "Unknown"),
-                    "timestamp": meta.get("timestamp", "")
-                })
-        
-        # Sort by timestamp if possible, otherwise reverse
-        return {"history": history[::-1]} # Newest first
-        
+        return compact_memory(similarity=similarity, dry_run=dry_run)
     except Exception as e:
-        return {"error": str(e)}
+        raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/chat", response_model=ChatResponse)
 async def chat_endpoint(request: ChatRequest):
     """Unified Chat Endpoint"""
-    
-    # 1. Retrieve Context
-    context = ""
-    if MEMORY_AVAILABLE and request.use_memory:
-        try:
-            context = retrieve_context(request.query)
-        except:
-            pass
-
-    # 2. Query Providers
-    responses = {}
-    async with httpx.AsyncClient() as client:
-        tasks = []
-        
-        # Online
-        if "ChatGPT (OpenAI)" in request.online_models:
-            tasks.append(("ChatGPT", fetch_openai(request.query, client)))
-        if "Claude (Anthropic)" in request.online_models:
-            tasks.append(("Claude", fetch_anthropic(request.query, client)))
-        if "Gemini (Google)" in request.online_models:
-            tasks.append(("Gemini", fetch_gemini(request.query, client)))
-        if "Perplexity" in request.online_models:
-            tasks.append(("Perplexity", fetch_perplexity(request.query, client)))
-            
-        # Offline
-        for model in request.offline_models:
-            tasks.append((f"Ollama ({model})", fetch_ollama(request.query, model, client)))
-            
-        # Execute
-        for name, coro in tasks:
-            try:
-                res = await coro
-                responses[name] = res
-            except Exception as e:
-                responses[name] = f"Error: {str(e)}"
-    
-    # 3. Synthesize
-    target_model = request.synthesizer_model if request.synthesizer_model else "llama3"
-    # Check if target model is in offline list or default
-    
-    final_answer = await synthesize_responses(
-        request.query, 
-        responses, 
-        context=context,
-        target_model=target_model
-    )
-    
-    # 4. Save to Memory
-    if MEMORY_AVAILABLE and request.use_memory:
-        try:
-            add_to_memory(request.query, final_answer, "Mobile-Synthesized")
-        except:
-            pass
-            
-    return ChatResponse(final_answer=final_answer, individual_responses=responses)
+    async for event, payload in run_chat(request, "Mobile-Synthesized", stream=False):
+        if event == "complete":
+            return ChatResponse(**payload)
 
 # --- WebSocket Endpoint ---
+def to_ws_message(event: str, payload: dict) -> dict:
+    """Translate a pipeline event into the WebSocket {"status": ...} message format."""
+    if event == "status":
+        return {"status": payload["stage"], "message": payload["message"]}
+    if event == "model":
+        return {"status": "querying", "model": payload["model"]}
+    return {"status": event, **payload}
+
 @app.websocket("/ws/chat")
 async def websocket_chat(websocket: WebSocket):
     """
@@ -208,87 +455,10 @@ async def websocket_chat(websocket: WebSocket):
             # Receive message
             data = await websocket.receive_text()
             request_data = json.loads(data)
+            request = ChatRequest(**request_data)
             
-            query = request_data.get("query")
-            online_models = request_data.get("online_models", [])
-            offline_models = request_data.get("offline_models", [])
-            use_memory = request_data.get("use_memory", True)
-            synthesizer_model = request_data.get("synthesizer_model", "llama3")
-            
-            # Send processing status
-            await websocket.send_json({"status": "processing", "message": "Processing query..."})
-            
-            # Retrieve context
-            context = ""
-            if MEMORY_AVAILABLE and use_memory:
-                try:
-                    context = retrieve_context(query)
-                except:
-                    pass
-            
-            # Query providers
-            responses = {}
-            async with httpx.AsyncClient() as client:
-                tasks = []
-                
-                # Online
-                if "ChatGPT (OpenAI)" in online_models:
-                    tasks.append(("ChatGPT", fetch_openai(query, client)))
-                if "Claude (Anthropic)" in online_models:
-                    tasks.append(("Claude", fetch_anthropic(query, client)))
-                if "Gemini (Google)" in online_models:
-                    tasks.append(("Gemini", fetch_gemini(query, client)))
-                if "Perplexity" in online_models:
-                    tasks.append(("Perplexity", fetch_perplexity(query, client)))
-                if "Free Web (g4f)" in online_models:
-                    from llm_providers import fetch_g4f
-                    tasks.append(("GPT-4 (Free)", fetch_g4f(query, "gpt_4", "GPT-4")))
-                    
-                # Offline
-                for model in offline_models:
-                    tasks.append((f"Ollama ({model})", fetch_ollama(query, model, client)))
-                    
-                # Execute and stream results
-                for name, coro in tasks:
-                    await websocket.send_json({"status": "querying", "model": name})
-                    try:
-                        res = await coro
-                        responses[name] = res
-                        await websocket.send_json({
-                            "status": "response", 
-                            "model": name,
-                            "content": res
-                        })
-                    except Exception as e:
-                        responses[name] = f"Error: {str(e)}"
-                        await websocket.send_json({
-                            "status": "error",
-                            "model": name,
-                            "error": str(e)
-                        })
-            
-            # Synthesize
-            await websocket.send_json({"status": "synthesizing", "message": "Synthesizing final answer..."})
-            final_answer = await synthesize_responses(
-                query, 
-                responses, 
-                context=context,
-                target_model=synthesizer_model
-            )
-            
-            # Save to memory
-            if MEMORY_AVAILABLE and use_memory:
-                try:
-                    add_to_memory(query, final_answer, "WebSocket-Synthesized")
-                except:
-                    pass
-            
-            # Send final response
-            await websocket.send_json({
-                "status": "complete",
-                "final_answer": final_answer,
-                "individual_responses": responses
-            })
+            async for event, payload in run_chat(request, "WebSocket-Synthesized"):
+                await websocket.send_json(to_ws_message(event, payload))
             
     except WebSocketDisconnect:
         print("WebSocket client disconnected")
@@ -304,74 +474,8 @@ async def stream_chat(request: ChatRequest):
     Returns progressive updates as models respond.
     """
     async def event_generator():
-        # Retrieve context
-        context = ""
-        if MEMORY_AVAILABLE and request.use_memory:
-            try:
-                context = retrieve_context(request.query)
-            except:
-                pass
-        
-        yield {"event": "status", "data": json.dumps({"message": "Processing query..."})}
-        
-        # Query providers
-        responses = {}
-        async with httpx.AsyncClient() as client:
-            tasks = []
-            
-            # Online
-            if "ChatGPT (OpenAI)" in request.online_models:
-                tasks.append(("ChatGPT", fetch_openai(request.query, client)))
-            if "Claude (Anthropic)" in request.online_models:
-                tasks.append(("Claude", fetch_anthropic(request.query, client)))
-            if "Gemini (Google)" in request.online_models:
-                tasks.append(("Gemini", fetch_gemini(request.query, client)))
-            if "Perplexity" in request.online_models:
-                tasks.append(("Perplexity", fetch_perplexity(request.query, client)))
-            if "Free Web (g4f)" in request.online_models:
-                from llm_providers import fetch_g4f
-                tasks.append(("GPT-4 (Free)", fetch_g4f(request.query, "gpt_4", "GPT-4")))
-                
-            # Offline
-            for model in request.offline_models:
-                tasks.append((f"Ollama ({model})", fetch_ollama(request.query, model, client)))
-                
-            # Execute and stream
-            for name, coro in tasks:
-                yield {"event": "model", "data": json.dumps({"model": name, "status": "querying"})}
-                try:
-                    res = await coro
-                    responses[name] = res
-                    yield {"event": "response", "data": json.dumps({"model": name, "content": res})}
-                except Exception as e:
-                    responses[name] = f"Error: {str(e)}"
-                    yield {"event": "error", "data": json.dumps({"model": name, "error": str(e)})}
-        
-        # Synthesize
-        yield {"event": "status", "data": json.dumps({"message": "Synthesizing..."})}
-        target_model = request.synthesizer_model if request.synthesizer_model else "llama3"
-        final_answer = await synthesize_responses(
-            request.query, 
-            responses, 
-            context=context,
-            target_model=target_model
-        )
-        
-        # Save to memory
-        if MEMORY_AVAILABLE and request.use_memory:
-            try:
-                add_to_memory(request.query, final_answer, "Stream-Synthesized")
-            except:
-                pass
-        
-        # Send final
-        yield {
-            "event": "complete",
-            "data": json.dumps({
-                "final_answer": final_answer,
-                "individual_responses": responses
-            })
-        }
+        async for event, payload in run_chat(request, "Stream-Synthesized"):
+            yield {"event": event, "data": json.dumps(payload)}
     
     return EventSourceResponse(event_generator())
 
@@ -1,8 +1,11 @@
 import streamlit as st
 import asyncio
-import httpx
-from llm_providers import fetch_openai, fetch_anthropic, fetch_gemini, fetch_perplexity, fetch_ollama, fetch_generic_openai_compatible, fetch_g4f
-from offline_model import synthesize_responses
+from llm_providers import fan_out, close_clients
+from provider_registry import resolve, ollama_provider, build_tasks, reload_registry
+from offline_model import synthesize_responses, synthesize_map_reduce
+from consensus import find_consensus, CONSENSUS_ENABLED
+from provider_health import CircuitOpenError
+from fleet import fleet
 import qrcode
 import socket
 import io
@@ -27,7 +30,10 @@ if "custom_providers" not in st.session_state:
 if "network_nodes" not in st.session_state:
     st.session_state.network_nodes = []
 
-PROVIDERS_FILE = "custom_providers.json"
+try:
+    from config import CUSTOM_PROVIDERS_FILE as PROVIDERS_FILE
+except ImportError:
+    PROVIDERS_FILE = "custom_providers.json"
 
 def load_providers():
     if os.path.exists(PROVIDERS_FILE):
@@ -41,16 +47,31 @@ def load_providers():
 def save_providers(providers):
     with open(PROVIDERS_FILE, "w") as f:
         json.dump(providers, f)
+    reload_registry()
 
 if not st.session_state.custom_providers:
     st.session_state.custom_providers = load_providers()
 
 try:
-    from agents.memory import add_to_memory, retrieve_context, export_dataset
+    from agents.memory import aretrieve_context, enqueue_memory, export_dataset, preload, compact_memory
     MEMORY_AVAILABLE = True
 except ImportError:
     MEMORY_AVAILABLE = False
 
+try:
+    from config import MEMORY_PRELOAD, EXPORT_PATH
+except ImportError:
+    MEMORY_PRELOAD = True
+    EXPORT_PATH = "training_data.jsonl"
+
+@st.cache_resource(show_spinner=False)
+def start_memory_preload():
+    """Load the embedding model once per server process, in the background, so reruns don't wait on it."""
+    return preload()
+
+if MEMORY_AVAILABLE and MEMORY_PRELOAD:
+    start_memory_preload()
+
 from agents.discovery import get_g4f_models, get_openrouter_models, verify_model, search_models
 
 def get_local_ip():
@@ -63,6 +84,18 @@ def get_local_ip():
     except:
         return "127.0.0.1"
 
+def run_async(coro):
+    """
+    asyncio.run wrapper for Streamlit callbacks: each call gets a fresh event
+    loop, so the pooled HTTP clients bound to it are closed before it exits.
+    """
+    async def runner():
+        try:
+            return await coro
+        finally:
+            await close_clients()
+    return asyncio.run(runner())
+
 # --- Navigation Functions ---
 def go_to_landing():
     st.session_state.page = "landing"
@@ -426,6 +459,11 @@ def render_desktop_app():
                 default=standard_options
             )
 
+            with st.expander("⚡ Early Synthesis", expanded=False):
+                st.caption("Don't let one slow model hold up the answer.")
+                quorum = st.number_input("Synthesize after N answers (0 = wait for all)", min_value=0, value=0, step=1)
+                deadline_s = st.number_input("Deadline in seconds (0 = none)", min_value=0.0, value=0.0, step=1.0)
+
         # --- TAB 2: OFFLINE & NETWORK ---
         with tab_offline:
             st.subheader("Local & Network Fleet")
@@ -433,6 +471,7 @@ def render_desktop_app():
             
             selected_ollama_models = []
             synthesizer_model_option = None
+            map_reduce_synthesis = False
             
             if use_ollama:
                 # Network Nodes Manager
@@ -452,52 +491,47 @@ def render_desktop_app():
                             col_n, col_d = st.columns([4, 1])
                             col_n.text(f"🟢 {node['name']}")
                             if col_d.button("❌", key=f"del_node_{i}"):
-                                st.session_state.network_nodes.pop(i)
+                                fleet.remove_node(st.session_state.network_nodes.pop(i)["url"])
                                 st.rerun()
 
                 col_refresh, _ = st.columns([1, 2])
                 with col_refresh:
                     if st.button("🔄 Refresh Fleet"):
+                        fleet.rescan()
                         st.rerun()
 
-                # Distributed Model Discovery
-                all_discovered_models = [] 
-                
-                # 1. Localhost
-                try:
-                    tags = httpx.get("http://localhost:11434/api/tags", timeout=1.0).json()["models"]
-                    for m in tags:
-                        all_discovered_models.append({
-                            "display": f"🏠 [Local] {m['name']}",
-                            "model": m["name"],
-                            "url": "http://localhost:11434/api/generate",
-                            "node": "Local"
-                        })
-                except:
-                    pass
-
-                # 2. Network Nodes
+                # Distributed Model Discovery: network nodes join the fleet, whose cached scan
+                # (all nodes probed concurrently, refreshed in the background) groups the nodes
+                # serving the same model into one replica pool
                 for node in st.session_state.network_nodes:
-                    try:
-                        base_url = node["url"].rstrip("/")
-                        tags = httpx.get(f"{base_url}/api/tags", timeout=2.0).json()["models"]
-                        for m in tags:
-                            all_discovered_models.append({
-                                "display": f"🌐 [{node['name']}] {m['name']}",
-                                "model": m["name"],
-                                "url": f"{base_url}/api/generate",
-                                "node": node["name"]
-                            })
-                    except:
+                    fleet.add_node(node["name"], node["url"])
+                pools = {}
+                for node in fleet.inventory():
+                    if node["reachable"]:
+                        for model in node["models"]:
+                            pools.setdefault(model, []).append(node["name"])
+                    elif node["reachable"] is False and node["name"] != "Local":
                         st.error(f"❌ Unreachable: {node['name']}")
 
+                # Requests for a model are balanced over its pool, so it is selected once
+                all_discovered_models = [
+                    {
+                        "display": f"{'🏠' if nodes == ['Local'] else '🌐'} [{', '.join(nodes)}] {model}",
+                        "model": model,
+                        "url": None,
+                        "nodes": nodes
+                    }
+                    for model, nodes in pools.items()
+                ]
+
                 if all_discovered_models:
                     model_options = [m["display"] for m in all_discovered_models]
                     
                     selected_displays = st.multiselect(
                         "Select Fleet Models", 
                         model_options,
-                        default=[model_options[0]] if model_options else []
+                        default=[model_options[0]] if model_options else [],
+                        help="Each request goes to the least loaded healthy node serving the model."
                     )
                     
                     for display in selected_displays:
@@ -509,7 +543,7 @@ def render_desktop_app():
                     st.divider()
                     st.markdown("**🧠 The Brain (Synthesizer)**")
                     synthesizer_display = st.selectbox(
-                        "Select Synthesizer Node",
+                        "Select Synthesizer Model",
                         model_options,
                         index=0
                     )
@@ -518,6 +552,12 @@ def render_desktop_app():
                         if m["display"] == synthesizer_display:
                             synthesizer_model_option = m
                             break
+                    
+                    map_reduce_synthesis = st.toggle(
+                        "Map-Reduce Synthesis",
+                        value=False,
+                        help="Merge groups of responses in parallel on the selected fleet models, then let the Brain combine the partial answers. Useful with many models."
+                    )
                 else:
                     st.warning("No offline models found.")
                     st.info("Ensure Ollama is running (`ollama serve`).")
@@ -531,9 +571,31 @@ def render_desktop_app():
                 enable_context = st.toggle("Enable Context (Recall)", value=True)
                 
                 st.divider()
+                export_cols = st.columns(2)
+                with export_cols[0]:
+                    export_compression = st.selectbox("Compression", ["None", "gzip", "zstd"], key="export_compression")
+                with export_cols[1]:
+                    export_incremental = st.checkbox("Only new items since last export", value=False, key="export_incremental",
+                                                     help="Appends to the existing export instead of rewriting it.")
                 if st.button("📂 Export Dataset (JSONL)"):
-                    msg = export_dataset()
+                    with st.spinner("Exporting..."):
+                        msg = export_dataset(
+                            EXPORT_PATH,
+                            compression=None if export_compression == "None" else export_compression,
+                            incremental=export_incremental
+                        )
                     st.success(msg)
+                
+                st.divider()
+                st.caption("Remove near-duplicate answers and apply the retention rules (MEMORY_RETENTION).")
+                if st.button("🧹 Compact Memory"):
+                    with st.spinner("Compacting memory..."):
+                        report = compact_memory()
+                    st.success(
+                        f"Removed {report['removed']} of {report['scanned']} memories "
+                        f"({report['duplicates']} duplicates, {report['expired'] + report['over_limit']} past retention), "
+                        f"reclaimed {report['reclaimed_bytes'] / 1024:.0f} KB."
+                    )
             else:
                 st.error("Dependencies missing.")
                 enable_learning = False
@@ -576,7 +638,7 @@ def render_desktop_app():
 
                 if st.button("Scan for Models"):
                     with st.spinner("Scanning..."):
-                        st.session_state.discovered_g4f_models = asyncio.run(get_g4f_models())
+                        st.session_state.discovered_g4f_models = run_async(get_g4f_models())
                 
                 if st.session_state.discovered_g4f_models:
                     for m in st.session_state.discovered_g4f_models:
@@ -591,7 +653,7 @@ def render_desktop_app():
                         else:
                             if col_act.button("Test & Add", key=f"add_{m['name']}"):
                                 with st.status(f"Verifying {m['name']}...") as status:
-                                    success, msg = asyncio.run(verify_model(m['name'], "g4f"))
+                                    success, msg = run_async(verify_model(m['name'], "g4f"))
                                     if success:
                                         status.update(label="✅ Verified!", state="complete")
                                         new_p = {
@@ -615,7 +677,7 @@ def render_desktop_app():
                 or_key = st.text_input("OpenRouter API Key", type="password")
                 if st.button("Fetch Models") and or_key:
                     with st.spinner("Fetching catalog..."):
-                        models = asyncio.run(get_openrouter_models(or_key))
+                        models = run_async(get_openrouter_models(or_key))
                         if isinstance(models, list):
                             st.success(f"Found {len(models)} models!")
                             # Search
@@ -652,36 +714,20 @@ def render_desktop_app():
 
                 if st.button("Scan Network"):
                     with st.spinner("Scanning fleet..."):
-                        found_models = []
-                        # 1. Localhost
-                        try:
-                            tags = httpx.get("http://localhost:11434/api/tags", timeout=1.0).json()["models"]
-                            for m in tags:
-                                found_models.append({
-                                    "display": f"🏠 [Local] {m['name']}",
-                                    "model": m["name"],
-                                    "base_url": "http://localhost:11434",
-                                    "node": "Local"
-                                })
-                        except:
-                            pass
-
-                        # 2. Network Nodes
                         for node in st.session_state.network_nodes:
-                            try:
-                                base_url = node["url"].rstrip("/")
-                                tags = httpx.get(f"{base_url}/api/tags", timeout=2.0).json()["models"]
-                                for m in tags:
-                                    found_models.append({
-                                        "display": f"🌐 [{node['name']}] {m['name']}",
-                                        "model": m["name"],
-                                        "base_url": base_url,
-                                        "node": node["name"]
-                                    })
-                            except:
-                                pass
-                        
-                        st.session_state.discovered_ollama_models = found_models
+                            fleet.add_node(node["name"], node["url"])
+                        fleet.rescan()
+                        st.session_state.discovered_ollama_models = [
+                            {
+                                "display": f"{'🏠' if node['name'] == 'Local' else '🌐'} [{node['name']}] {model}",
+                                "model": model,
+                                "base_url": node["url"],
+                                "node": node["name"]
+                            }
+                            for node in fleet.inventory()
+                            if node["reachable"]
+                            for model in node["models"]
+                        ]
                 
                 if st.session_state.discovered_ollama_models:
                     for m in st.session_state.discovered_ollama_models:
@@ -696,7 +742,7 @@ def render_desktop_app():
                         else:
                             if col_act.button("Test & Add", key=f"add_ollama_{m['display']}"):
                                 with st.status(f"Verifying {m['model']} on {m['node']}...") as status:
-                                    success, msg = asyncio.run(verify_model(m['model'], "Ollama", base_url=m["base_url"]))
+                                    success, msg = run_async(verify_model(m['model'], "Ollama", base_url=m["base_url"]))
                                     if success:
                                         status.update(label="✅ Verified!", state="complete")
                                         new_p = {
@@ -726,7 +772,7 @@ def render_desktop_app():
 
                 if st.button("Search") and search_query:
                     with st.spinner(f"Searching for '{search_query}'..."):
-                        st.session_state.search_results = asyncio.run(search_models(search_query, or_key_search))
+                        st.session_state.search_results = run_async(search_models(search_query, or_key_search))
                 
                 if st.session_state.search_results:
                     st.success(f"Found {len(st.session_state.search_results)} models.")
@@ -747,13 +793,13 @@ def render_desktop_app():
                                     with st.status(f"Verifying {m['name']}...") as status:
                                         # Verify based on source
                                         if m["source"] == "g4f":
-                                            success, msg = asyncio.run(verify_model(m['name'], "g4f"))
+                                            success, msg = run_async(verify_model(m['name'], "g4f"))
                                             ptype = "g4f_discovered"
                                             base_url = ""
                                             api_key = ""
                                             template = "Custom"
                                         elif m["source"] == "OpenRouter":
-                                            success, msg = asyncio.run(verify_model(m['name'], "OpenRouter", api_key=or_key_search))
+                                            success, msg = run_async(verify_model(m['name'], "OpenRouter", api_key=or_key_search))
                                             ptype = "OpenRouter" # Or custom type if needed
                                             base_url = "https://openrouter.ai/api/v1"
                                             api_key = or_key_search
@@ -793,100 +839,11 @@ def render_desktop_app():
         ask_button = st.button("🚀 Ask the Swarm")
 
     if ask_button and query:
-        # Build active providers list
-        active_providers = []
-        
-        # Map friendly names to internal functions
-        if "ChatGPT (OpenAI)" in selected_online_models:
-            active_providers.append({"name": "ChatGPT", "type": "online", "func": fetch_openai})
-        if "Claude (Anthropic)" in selected_online_models:
-            active_providers.append({"name": "Claude", "type": "online", "func": fetch_anthropic})
-        if "Gemini (Google)" in selected_online_models:
-            active_providers.append({"name": "Gemini", "type": "online", "func": fetch_gemini})
-        if "Perplexity" in selected_online_models:
-            active_providers.append({"name": "Perplexity", "type": "online", "func": fetch_perplexity})
-        
-        # Add Custom Providers
-        for custom_provider in st.session_state.custom_providers:
-            if custom_provider["name"] in selected_online_models:
-                # Create a partial function or wrapper for the custom provider
-                # We need to capture the specific config for this provider
-                # Check type
-                if custom_provider.get("type") == "g4f_discovered":
-                    def make_g4f_fetcher(cp):
-                        async def fetcher(q, c):
-                            # fetch_g4f doesn't use client, it uses g4f internal
-                            return await fetch_g4f(q, cp["model"], cp["name"])
-                        return fetcher
-                    
-                    active_providers.append({
-                        "name": custom_provider["name"],
-                        "type": "g4f_discovered",
-                        "func": make_g4f_fetcher(custom_provider)
-                    })
-                elif custom_provider.get("type") == "ollama_discovered":
-                    def make_ollama_disc_fetcher(cp):
-                        async def fetcher(q, c):
-                            try:
-                                # Use the stored base_url
-                                url = f"{cp['base_url']}/api/generate"
-                                resp = await c.post(
-                                    url,
-                                    json={"model": cp["model"], "prompt": q, "stream": False},
-                                    timeout=60.0
-                                )
-                                resp.raise_for_status()
-                                return resp.json()["response"]
-                            except Exception as e:
-                                return f"Error ({cp['name']}): {str(e)}"
-                        return fetcher
-
-                    active_providers.append({
-                        "name": custom_provider["name"],
-                        "type": "ollama_discovered",
-                        "func": make_ollama_disc_fetcher(custom_provider)
-                    })
-                else:
-                    # Generic OpenAI Compatible
-                    def make_custom_fetcher(cp):
-                        async def fetcher(q, c):
-                            return await fetch_generic_openai_compatible(
-                                q, cp["api_key"], cp["base_url"], cp["model"], cp["name"], c
-                            )
-                        return fetcher
-                    
-                    active_providers.append({
-                        "name": custom_provider["name"],
-                        "type": "custom",
-                        "func": make_custom_fetcher(custom_provider)
-                    })
-        
-        # Add Distributed Ollama Models
+        # Resolve the selection to provider descriptors (built-ins and custom_providers.json
+        # come from the shared registry, fleet models are routed to a node per request)
+        active_providers = resolve(selected_online_models)
         for m in selected_ollama_models:
-            # We need a custom fetcher for remote nodes too, or update fetch_ollama
-            # Let's update fetch_ollama to take a URL, or create a wrapper here.
-            # Since fetch_ollama is in llm_providers.py and hardcoded to localhost, 
-            # we should probably create a dynamic fetcher here similar to custom providers.
-            
-            def make_ollama_fetcher(model_obj):
-                async def fetcher(q, c):
-                    try:
-                        resp = await c.post(
-                            model_obj["url"],
-                            json={"model": model_obj["model"], "prompt": q, "stream": False},
-                            timeout=60.0
-                        )
-                        resp.raise_for_status()
-                        return resp.json()["response"]
-                    except Exception as e:
-                        return f"Error ({model_obj['display']}): {str(e)}"
-                return fetcher
-
-            active_providers.append({
-                "name": m["display"],
-                "type": "ollama_distributed",
-                "func": make_ollama_fetcher(m)
-            })
+            active_providers.append(ollama_provider(m["model"], url=m["url"], name=m["display"]))
 
         if not active_providers:
             st.warning("Please select at least one model in the sidebar.")
@@ -898,47 +855,39 @@ def render_desktop_app():
             async def run_process():
                 responses = {}
                 
-                async with httpx.AsyncClient() as client:
-                    tasks = []
-                    
-                    # 1. Retrieve Context (Memory)
-                    retrieved_context = ""
-                    if MEMORY_AVAILABLE and enable_context:
-                        status_box.write("🧠 Retrieving relevant memory...")
-                        try:
-                            retrieved_context = retrieve_context(query)
-                            if retrieved_context:
-                                status_box.write("✅ Memory retrieved")
-                        except Exception as e:
-                            status_box.write(f"⚠️ Memory retrieval failed: {e}")
-
-                    # Create tasks
-                    for provider in active_providers:
-                        status_box.write(f"⏳ Querying {provider['name']}...")
-                        # All providers now have a 'func' wrapper
-                        coro = provider["func"](query, client)
-                        
-                        # Wrap coroutine to return name + result
-                        async def task_wrapper(name, c):
-                            try:
-                                res = await c
-                                return name, res
-                            except Exception as e:
-                                return name, f"Error: {str(e)}"
-                                
-                        tasks.append(task_wrapper(provider["name"], coro))
-                    
-                    # Execute tasks as they complete
-                    for future in asyncio.as_completed(tasks):
-                        name, result = await future
-                        responses[name] = result
+                # 1. Retrieve Context (Memory)
+                retrieved_context = ""
+                if MEMORY_AVAILABLE and enable_context:
+                    status_box.write("🧠 Retrieving relevant memory...")
+                    try:
+                        retrieved_context = await aretrieve_context(query)
+                        if retrieved_context:
+                            status_box.write("✅ Memory retrieved")
+                    except Exception as e:
+                        status_box.write(f"⚠️ Memory retrieval failed: {e}")
+
+                # Create tasks
+                for provider in active_providers:
+                    status_box.write(f"⏳ Querying {provider.name}...")
+                tasks = build_tasks(active_providers, query)
+                
+                # Execute tasks as they complete (stopping early at quorum/deadline)
+                async for name, result, error in fan_out(tasks, quorum=quorum or None, deadline=deadline_s or None):
+                    responses[name] = result
+                    if isinstance(error, CircuitOpenError):
+                        status_box.write(f"⛔ {name} skipped (failing repeatedly, circuit open)")
+                    else:
                         status_box.write(f"✅ {name} finished")
                 
+                dropped = [p.name for p in active_providers if p.name not in responses]
+                for name in dropped:
+                    status_box.write(f"✂️ {name} dropped (quorum/deadline reached)")
+                
                 status_box.update(label="All queries complete! Synthesizing...", state="running")
                 
                 # 2. Synthesize with offline model (passing context and target)
                 # Determine target synthesizer
-                target_url = "http://localhost:11434/api/generate"
+                target_url = None  # least loaded fleet node serving the model
                 target_model = "llama3"
                 
                 if synthesizer_model_option:
@@ -946,30 +895,52 @@ def render_desktop_app():
                     target_model = synthesizer_model_option["model"]
                     status_box.write(f"🧠 Synthesizing with {synthesizer_model_option['display']}...")
                 
-                final_answer = await synthesize_responses(
-                    query, 
-                    responses, 
-                    context=retrieved_context,
-                    target_url=target_url,
-                    target_model=target_model
-                )
+                # Skip the LLM entirely when the models already agree
+                consensus = find_consensus(responses) if CONSENSUS_ENABLED else None
+                if consensus and consensus["answer"] is not None:
+                    status_box.write(f"🤝 Models agree ({consensus['agreement']:.0%}), using {consensus['best']}'s answer")
+                    final_answer = consensus["answer"]
+                else:
+                    # Only the parts the models disagree on (if consensus ran) go to the synthesizer
+                    synthesis_input = consensus["responses"] if consensus else responses
+                    if map_reduce_synthesis:
+                        # Groups go round-robin over the selected models (each on its least loaded replica), the Brain merges the partials
+                        workers = list(dict.fromkeys([m["model"] for m in selected_ollama_models] + [target_model]))
+                        nodes = [(None, model) for model in workers]
+                        status_box.write(f"🕸️ Map-reduce synthesis with {len(workers)} model(s) across the fleet...")
+                        final_answer = await synthesize_map_reduce(
+                            query,
+                            synthesis_input,
+                            context=retrieved_context,
+                            target_url=target_url,
+                            target_model=target_model,
+                            nodes=nodes
+                        )
+                    else:
+                        final_answer = await synthesize_responses(
+                            query, 
+                            synthesis_input, 
+                            context=retrieved_context,
+                            target_url=target_url,
+                            target_model=target_model
+                        )
                 
                 # 3. Save to Memory (Learning)
                 if MEMORY_AVAILABLE and enable_learning:
-                    status_box.write("💾 Saving knowledge to memory...")
-                    try:
-                        # We save the synthesized answer as the "expert" answer
-                        add_to_memory(query, final_answer, "Synthesized")
-                        status_box.write("✅ Knowledge saved")
-                    except Exception as e:
-                        status_box.write(f"⚠️ Failed to save memory: {e}")
+                    # We save the synthesized answer as the "expert" answer (in the background)
+                    if enqueue_memory(query, final_answer, "Synthesized"):
+                        status_box.write("✅ Knowledge queued for saving")
+                    else:
+                        status_box.write("⚠️ Memory write queue is full, answer not saved")
                 
                 status_box.update(label="Processing Complete!", state="complete", expanded=False)
-                return responses, final_answer
+                for name in dropped:
+                    responses[name] = "Dropped: quorum or deadline reached before this model answered"
+                return responses, final_answer, consensus
 
-            # Streamlit runs sync by default, so we use asyncio.run
+            # Streamlit runs sync by default, so we use asyncio.run (via run_async)
             try:
-                responses, final_answer = asyncio.run(run_process())
+                responses, final_answer, consensus = run_async(run_process())
                 
                 # Display Final Answer
                 st.markdown("### ✨ Synthesized Answer")
@@ -989,6 +960,13 @@ def render_desktop_app():
                         with col:
                             st.markdown(f"#### {provider}")
                             st.markdown(f'<div class="provider-card">{response}</div>', unsafe_allow_html=True)
+                
+                if consensus:
+                    with st.expander(f"🤝 Agreement Matrix ({consensus['agreement']:.0%}, {consensus['method']})", expanded=False):
+                        st.table({
+                            model: {other: f"{consensus['matrix'][i][j]:.2f}" for j, other in enumerate(consensus["models"])}
+                            for i, model in enumerate(consensus["models"])
+                        })
 
             except Exception as e:
                 st.error(f"An error occurred: {str(e)}")
@@ -5,6 +5,15 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+# Use the provider registry of the main app (pooled, rate limited) when it is importable
+try:
+    from provider_registry import resolve, gather_responses
+    REGISTRY_AVAILABLE = True
+except ImportError:
+    REGISTRY_AVAILABLE = False
+
+PROVIDER_LABELS = ["ChatGPT (OpenAI)", "Claude (Anthropic)", "Gemini (Google)", "Perplexity"]
+
 # Timeout for API calls
 TIMEOUT = 30.0
 
@@ -102,6 +111,10 @@ async def fetch_perplexity(query: str, client: httpx.AsyncClient):
         return f"Error (Perplexity): {str(e)}"
 
 async def get_all_responses(query: str):
+    if REGISTRY_AVAILABLE:
+        # Same dispatch as the main API: pooled clients, retries, rate limits, free fallback
+        return await gather_responses(query, resolve(PROVIDER_LABELS))
+
     async with httpx.AsyncClient() as client:
         results = await asyncio.gather(
             fetch_openai(query, client),
@@ -2,6 +2,7 @@
 Configuration module for AI Nexus - Centralized settings for portability
 """
 import os
+import json
 from pathlib import Path
 from typing import Optional
 
@@ -11,6 +12,7 @@ BASE_DIR = Path(__file__).parent.absolute()
 # Data directories
 MEMORY_DB_PATH = os.getenv("MEMORY_DB_PATH", str(BASE_DIR / "memory_db"))
 HAR_COOKIES_PATH = os.getenv("HAR_COOKIES_PATH", str(BASE_DIR / "har_and_cookies"))
+EXPORT_PATH = os.getenv("EXPORT_PATH", str(BASE_DIR / "training_data.jsonl"))
 CUSTOM_PROVIDERS_FILE = os.getenv("CUSTOM_PROVIDERS_FILE", str(BASE_DIR / "custom_providers.json"))
 
 # Network configuration
@@ -34,10 +36,101 @@ PERPLEXITY_API_KEY = os.getenv("PERPLEXITY_API_KEY", "")
 API_TIMEOUT = float(os.getenv("API_TIMEOUT", "30.0"))
 OLLAMA_TIMEOUT = float(os.getenv("OLLAMA_TIMEOUT", "60.0"))
 
+# HTTP connection pooling (limits apply per upstream host)
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "20"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "10"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30.0"))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "true").lower() == "true"
+
+# Built-in provider models
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o")
+ANTHROPIC_MODEL = os.getenv("ANTHROPIC_MODEL", "claude-3-opus-20240229")
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-pro")
+PERPLEXITY_MODEL = os.getenv("PERPLEXITY_MODEL", "llama-3-sonar-large-32k-online")
+# USD per 1K prompt/completion tokens by provider name, e.g. PROVIDER_COSTS='{"ChatGPT": [0.005, 0.015]}'
+PROVIDER_COSTS = json.loads(os.getenv("PROVIDER_COSTS", "{}") or "{}")
+
 # Feature flags
 ENABLE_MEMORY = os.getenv("ENABLE_MEMORY", "true").lower() == "true"
 ENABLE_G4F = os.getenv("ENABLE_G4F", "true").lower() == "true"
 
+# Memory (ChromaDB) background work
+MEMORY_WORKERS = int(os.getenv("MEMORY_WORKERS", "2"))  # threads for embedding/Chroma reads
+MEMORY_WRITE_QUEUE_SIZE = int(os.getenv("MEMORY_WRITE_QUEUE_SIZE", "1000"))  # pending saves before dropping
+MEMORY_BATCH_SIZE = int(os.getenv("MEMORY_BATCH_SIZE", "32"))  # Q&A pairs embedded/written per batch
+MEMORY_FLUSH_INTERVAL = float(os.getenv("MEMORY_FLUSH_INTERVAL", "2.0"))  # max seconds a pair waits for its batch
+MEMORY_PAGE_SIZE = int(os.getenv("MEMORY_PAGE_SIZE", "500"))  # records fetched per page when scanning memory
+# Memory compaction: near-duplicate threshold and per-source retention, e.g.
+# MEMORY_RETENTION='{"*": {"max_age_days": 180}, "Mobile-Synthesized": {"max_count": 5000}}'
+MEMORY_DEDUP_THRESHOLD = float(os.getenv("MEMORY_DEDUP_THRESHOLD", "0.97"))  # cosine similarity
+MEMORY_RETENTION = json.loads(os.getenv("MEMORY_RETENTION", "{}") or "{}")
+MEMORY_COMPACT_INTERVAL = float(os.getenv("MEMORY_COMPACT_INTERVAL", "0"))  # hours between automatic compactions (0 = off)
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "10000"))  # embeddings kept in memory (LRU)
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "")  # optional SQLite file to persist embeddings across restarts
+MEMORY_CONTEXT_TOKENS = int(os.getenv("MEMORY_CONTEXT_TOKENS", "600"))  # token budget for recalled memories per query
+MEMORY_MAX_RESULTS = int(os.getenv("MEMORY_MAX_RESULTS", "8"))  # most memories recalled per query
+MEMORY_MIN_SIMILARITY = float(os.getenv("MEMORY_MIN_SIMILARITY", "0.3"))  # cosine; weaker vector hits are ignored
+MEMORY_MIN_KEYWORD_MATCH = float(os.getenv("MEMORY_MIN_KEYWORD_MATCH", "0.4"))  # BM25 score / query term weight (IDF); weaker keyword hits are ignored
+MEMORY_PRELOAD = os.getenv("MEMORY_PRELOAD", "true").lower() == "true"  # load the embedding model in the background at startup
+
+# Synthesis prompt size: tokens of provider responses + memory sent to the synthesizer.
+# Per-model overrides (exact name or family before ':'), e.g. SYNTHESIS_PROMPT_BUDGETS='{"llama3": 6000, "codegemma": 2000}'
+SYNTHESIS_PROMPT_TOKENS = int(os.getenv("SYNTHESIS_PROMPT_TOKENS", "3000"))
+SYNTHESIS_PROMPT_BUDGETS = json.loads(os.getenv("SYNTHESIS_PROMPT_BUDGETS", "{}") or "{}")
+# Synthesis fallback chain (ollama, openai, g4f). A fallback starts when the running
+# backend fails or is still busy after its hedge delay (seconds, last value repeats; empty = only on failure).
+# Hedging sends the full prompt, memory context included, to the next backend: OpenAI costs money and
+# g4f goes to third-party free-web services. Keep it empty (default) or set it near OLLAMA_TIMEOUT
+# unless that trade-off is acceptable for slow local synthesis.
+SYNTHESIS_CHAIN = [b.strip() for b in os.getenv("SYNTHESIS_CHAIN", "ollama,openai,g4f").split(",") if b.strip()]
+SYNTHESIS_HEDGE_DELAYS = [float(d) for d in os.getenv("SYNTHESIS_HEDGE_DELAYS", "").split(",") if d.strip()]
+MAP_REDUCE_GROUP_SIZE = int(os.getenv("MAP_REDUCE_GROUP_SIZE", "3"))  # responses merged per partial synthesis in map-reduce mode
+
+# Provider circuit breakers: a provider is skipped for CIRCUIT_OPEN_SECONDS once at least
+# CIRCUIT_MIN_CALLS calls in the last CIRCUIT_WINDOW seconds failed (or were slow) at CIRCUIT_ERROR_RATE.
+# Slow = CIRCUIT_SLOW_SHARE of the provider's timeout (API_TIMEOUT, OLLAMA_TIMEOUT, ...), else CIRCUIT_SLOW_CALL seconds
+CIRCUIT_ENABLED = os.getenv("CIRCUIT_ENABLED", "true").lower() == "true"
+CIRCUIT_WINDOW = float(os.getenv("CIRCUIT_WINDOW", "120"))  # seconds of call history considered
+CIRCUIT_MIN_CALLS = int(os.getenv("CIRCUIT_MIN_CALLS", "4"))  # calls in the window before the circuit can open
+CIRCUIT_ERROR_RATE = float(os.getenv("CIRCUIT_ERROR_RATE", "0.5"))  # share of failed/slow calls that opens it
+CIRCUIT_SLOW_CALL = float(os.getenv("CIRCUIT_SLOW_CALL", "25"))  # seconds; slower answers count as failures (timeout unknown)
+CIRCUIT_SLOW_SHARE = float(os.getenv("CIRCUIT_SLOW_SHARE", "0.8"))  # share of the provider's timeout that counts as slow
+CIRCUIT_OPEN_SECONDS = float(os.getenv("CIRCUIT_OPEN_SECONDS", "30"))  # cooldown before a probe call is let through
+
+# Provider retries (429/5xx/connection errors) with decorrelated jitter; Retry-After and
+# rate-limit reset headers are honored, waits longer than RETRY_MAX_DELAY or past the request deadline give up
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "3"))  # attempts per provider call, including the first
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "0.5"))  # seconds, smallest backoff
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "20"))  # seconds, longest single wait
+
+# Client-side rate limits per provider (and API key): requests and tokens per minute, e.g.
+# RATE_LIMITS='{"OpenAI": {"rpm": 500, "tpm": 30000}, "Anthropic": {"rpm": 50}}'
+# Unset limits are learned from the providers' rate-limit headers (times RATE_LIMIT_HEADROOM)
+RATE_LIMITS = json.loads(os.getenv("RATE_LIMITS", "{}") or "{}")
+RATE_LIMIT_HEADROOM = float(os.getenv("RATE_LIMIT_HEADROOM", "0.9"))  # share of a reported quota we use
+RATE_LIMIT_MAX_WAIT = float(os.getenv("RATE_LIMIT_MAX_WAIT", "30"))  # seconds a call may queue without a request deadline
+RATE_LIMIT_OUTPUT_TOKENS = int(os.getenv("RATE_LIMIT_OUTPUT_TOKENS", "500"))  # answer tokens reserved per call until usage is known
+
+# Ollama fleet: extra nodes besides OLLAMA_URL, e.g.
+# FLEET_NODES='[{"name": "Attic PC", "url": "http://10.0.0.5:11434", "weight": 2}]'
+# Nodes serving the same model form a replica pool; requests go to the least loaded healthy one
+FLEET_NODES = json.loads(os.getenv("FLEET_NODES", "[]") or "[]")
+FLEET_STRATEGY = os.getenv("FLEET_STRATEGY", "least_outstanding")  # or "ewma" (latency EWMA x queue length)
+FLEET_EWMA_ALPHA = float(os.getenv("FLEET_EWMA_ALPHA", "0.3"))  # weight of the newest latency sample
+FLEET_DISCOVERY_TTL = float(os.getenv("FLEET_DISCOVERY_TTL", "30"))  # seconds a node's model list is served before a background rescan
+FLEET_PROBE_TIMEOUT = float(os.getenv("FLEET_PROBE_TIMEOUT", "2.0"))  # seconds per /api/tags probe (nodes are probed concurrently)
+
+# Consensus check before synthesis: when the answers agree this much (mean pairwise
+# similarity), the most central one is returned without an LLM synthesis pass
+CONSENSUS_ENABLED = os.getenv("CONSENSUS_ENABLED", "true").lower() == "true"
+CONSENSUS_THRESHOLD = float(os.getenv("CONSENSUS_THRESHOLD", "0.97"))  # cosine, MiniLM embeddings (word overlap never skips)
+
+# Semantic response cache (answers near-identical queries without calling providers)
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() == "true"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))  # cosine similarity
+SEMANTIC_CACHE_TTL = float(os.getenv("SEMANTIC_CACHE_TTL", "86400"))  # seconds
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "1000"))
+
 # Create required directories
 def ensure_directories():
     """Create required directories if they don't exist"""
@@ -0,0 +1,134 @@
+"""
+Deterministic consensus check before LLM synthesis: compares the provider
+answers pairwise (MiniLM embeddings when the memory model is loaded, word
+overlap otherwise). When the embeddings show near-identical answers, the most
+central one is returned as-is and synthesis is skipped; otherwise only the
+parts the answers disagree on are passed to the synthesizer along with the
+most central answer. Word overlap can't tell "it is safe" from "it is not
+safe", so it only reports agreement and never skips or trims synthesis.
+"""
+import math
+import re
+
+try:
+    from agents.memory import embed, is_warm
+except ImportError:
+    embed = None
+    is_warm = lambda: False
+
+# Import centralized config for portability
+try:
+    from config import CONSENSUS_ENABLED, CONSENSUS_THRESHOLD
+except ImportError:
+    CONSENSUS_ENABLED = True
+    CONSENSUS_THRESHOLD = 0.97
+
+def _cosine(a, b) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+def _words(text: str) -> set:
+    return set(re.findall(r"\w+", text.lower()))
+
+def _jaccard(a: set, b: set) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+def _use_embeddings() -> bool:
+    # Never load the model just for this: word overlap until memory has warmed it up
+    return embed is not None and is_warm()
+
+def _similarities(texts: list, method: str):
+    """Pairwise similarity matrix of `texts` (list of lists, 1.0 on the diagonal)."""
+    if method == "embedding":
+        vectors = embed(texts)
+        sim = lambda i, j: _cosine(vectors[i], vectors[j])
+    else:
+        words = [_words(text) for text in texts]
+        sim = lambda i, j: _jaccard(words[i], words[j])
+    n = len(texts)
+    matrix = [[1.0] * n for _ in range(n)]
+    for i in range(n):
+        for j in range(i + 1, n):
+            matrix[i][j] = matrix[j][i] = round(sim(i, j), 4)
+    return matrix
+
+def _paragraphs(text: str) -> list:
+    return [p.strip() for p in text.split("\n\n") if p.strip()]
+
+def _novel_parts(best: str, other: str, method: str, threshold: float) -> str:
+    """Paragraphs of `other` that no paragraph of `best` already covers."""
+    best_parts, other_parts = _paragraphs(best), _paragraphs(other)
+    if not best_parts or not other_parts:
+        return other
+    matrix = _similarities(best_parts + other_parts, method)
+    novel = [
+        part for j, part in enumerate(other_parts, start=len(best_parts))
+        if max(matrix[i][j] for i in range(len(best_parts))) < threshold
+    ]
+    return "\n\n".join(novel)
+
+def find_consensus(responses: dict, threshold: float = None):
+    """
+    Agreement between the usable (non-error) responses. Returns None with
+    fewer than two, else a dict with:
+      models, matrix      pairwise similarity (order of `models`)
+      scores              mean similarity of each model to the others
+      agreement           mean pairwise similarity
+      method              "embedding" or "jaccard"
+      best                most central model
+      answer              its answer when the embeddings agree >= threshold (skip synthesis), else None
+      responses           what to synthesize otherwise: with embeddings the best answer in full
+                          and only the parts of the others that it doesn't cover, with word
+                          overlap all usable answers unchanged
+    """
+    usable = {name: text for name, text in responses.items() if not text.startswith("Error")}
+    if len(usable) < 2:
+        return None
+
+    method = "embedding" if _use_embeddings() else "jaccard"
+    threshold = CONSENSUS_THRESHOLD if threshold is None else threshold
+
+    models = list(usable)
+    matrix = _similarities([usable[m] for m in models], method)
+    n = len(models)
+    scores = {m: round(sum(matrix[i][j] for j in range(n) if j != i) / (n - 1), 4) for i, m in enumerate(models)}
+    agreement = round(sum(scores.values()) / n, 4)
+    # Most central answer; longer wins ties (usually the more complete one)
+    best = max(models, key=lambda m: (scores[m], len(usable[m])))
+
+    result = {
+        "models": models,
+        "matrix": matrix,
+        "scores": scores,
+        "agreement": agreement,
+        "method": method,
+        "best": best,
+        "answer": usable[best] if method == "embedding" and agreement >= threshold else None,
+        "responses": None
+    }
+    if method == "jaccard":
+        result["responses"] = usable  # shared words say nothing about contradictions: synthesize everything
+    elif result["answer"] is None:
+        reduced = {best: usable[best]}
+        for m in models:
+            if m != best:
+                novel = _novel_parts(usable[best], usable[m], method, threshold)
+                if novel:
+                    reduced[m] = novel
+        result["responses"] = reduced
+    return result
+
+def agreement_summary(consensus: dict, skipped: bool) -> dict:
+    """JSON-friendly agreement info for API responses."""
+    return {
+        "models": consensus["models"],
+        "matrix": consensus["matrix"],
+        "scores": consensus["scores"],
+        "agreement": consensus["agreement"],
+        "method": consensus["method"],
+        "best": consensus["best"],
+        "synthesis_skipped": skipped
+    }
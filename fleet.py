@@ -0,0 +1,251 @@
+"""
+Ollama fleet scheduler. Nodes that serve the same model form a replica pool;
+each call for a model is routed to the pool member with the fewest requests in
+flight (FLEET_STRATEGY=least_outstanding, ties broken by latency) or the lowest
+expected wait (FLEET_STRATEGY=ewma: latency EWMA x queue length), relative to
+the node's weight. Every (node, model) pair has a circuit breaker, so a node
+that is down or lacks the model drops out of the pool until it recovers.
+
+Which node serves which model is discovered by probing every node's
+/api/tags concurrently. Results are cached for FLEET_DISCOVERY_TTL seconds;
+stale entries are served while a background refresh runs, so a slow or dead
+node never stalls the caller.
+"""
+import asyncio
+import random
+import threading
+import time
+from contextlib import asynccontextmanager
+from urllib.parse import urlsplit
+
+import httpx
+
+from provider_health import get_breaker, OPEN, CircuitOpenError
+
+# Import centralized config for portability
+try:
+    from config import OLLAMA_URL as OLLAMA_BASE_URL, FLEET_NODES, FLEET_STRATEGY, FLEET_EWMA_ALPHA
+except ImportError:
+    OLLAMA_BASE_URL = "http://localhost:11434"
+    FLEET_NODES = []
+    FLEET_STRATEGY = "least_outstanding"
+    FLEET_EWMA_ALPHA = 0.3
+
+try:
+    from config import FLEET_DISCOVERY_TTL, FLEET_PROBE_TIMEOUT, OLLAMA_TIMEOUT
+except ImportError:
+    FLEET_DISCOVERY_TTL = 30.0
+    FLEET_PROBE_TIMEOUT = 2.0
+    OLLAMA_TIMEOUT = 60.0
+
+def base_url(url: str) -> str:
+    """Node address of an Ollama URL (drops /api/... paths)."""
+    parts = urlsplit(url.rstrip("/"))
+    return f"{parts.scheme}://{parts.netloc}"
+
+class Node:
+    def __init__(self, name: str, url: str, weight: float = 1.0, models=None):
+        self.name = name
+        self.url = base_url(url)
+        self.weight = max(float(weight), 0.1)
+        self.models = set(models) if models is not None else None  # None = not discovered yet
+        self.outstanding = 0
+        self.ewma = None  # seconds per request
+        self.requests = 0
+        self.failures = 0
+        self.reachable = None  # result of the last /api/tags probe
+        self.checked_at = None
+        self.error = None
+
+    @property
+    def generate_url(self) -> str:
+        return f"{self.url}/api/generate"
+
+    def breaker(self, model: str):
+        return get_breaker(f"Ollama {self.name} ({model})", OLLAMA_TIMEOUT)
+
+    def score(self, strategy: str):
+        load = (self.outstanding + 1) / self.weight
+        latency = self.ewma or 0.0  # unmeasured nodes get tried first
+        if strategy == "ewma":
+            return (latency * load, load)
+        return (load, latency)
+
+class Fleet:
+    """Registry of Ollama nodes and the routing between them (shared by all requests of the process)."""
+
+    def __init__(self, strategy: str = FLEET_STRATEGY):
+        self.strategy = strategy
+        self.nodes = {}
+        self.lock = threading.Lock()
+        self.refresher = None
+
+    def add_node(self, name: str, url: str, weight: float = 1.0, models=None) -> Node:
+        """Register (or update) a node. `models` is the list of model names it serves, if known."""
+        key = base_url(url)
+        with self.lock:
+            node = self.nodes.get(key)
+            if node is None:
+                node = self.nodes[key] = Node(name, key, weight, models)
+            else:
+                node.name, node.weight = name, max(float(weight), 0.1)
+                if models is not None:
+                    node.models = set(models)
+        return node
+
+    def remove_node(self, url: str):
+        with self.lock:
+            self.nodes.pop(base_url(url), None)
+
+    def replicas(self, model: str):
+        """Nodes serving `model`; known replicas first, undiscovered nodes only if there are none."""
+        nodes = [n for n in self.nodes.values() if n.reachable is not False]
+        known = [n for n in nodes if n.models is not None and model in n.models]
+        return known or [n for n in nodes if n.models is None]
+
+    def pick(self, model: str):
+        """The node to send the next `model` request to (already leased), or None if no replica is usable."""
+        with self.lock:
+            candidates = []
+            for node in self.replicas(model):
+                breaker = node.breaker(model)
+                if breaker.state == OPEN and breaker.retry_in() > 0:
+                    continue
+                candidates.append(node)
+            random.shuffle(candidates)  # spread ties
+            for node in sorted(candidates, key=lambda n: n.score(self.strategy)):
+                if node.breaker(model).allow():
+                    node.outstanding += 1
+                    return node
+        return None
+
+    def release(self, node: Node, model: str, ok: bool, latency: float = None, pinned: bool = False):
+        """End a lease: update the load and latency EWMA, and the breaker unless the call was pinned."""
+        with self.lock:
+            node.outstanding -= 1
+            node.requests += 1
+            if not ok and latency is not None:
+                node.failures += 1
+            if latency is not None:
+                node.ewma = latency if node.ewma is None else FLEET_EWMA_ALPHA * latency + (1 - FLEET_EWMA_ALPHA) * node.ewma
+        if pinned:
+            return
+        if latency is None:
+            node.breaker(model).release()
+        else:
+            node.breaker(model).record(ok, latency)
+
+    @asynccontextmanager
+    async def route(self, model: str, url: str = None):
+        """
+        Lease a generate URL for one `model` request. A `url` pins the request
+        to that node (still tracked if it is part of the fleet); otherwise the
+        best replica is chosen. Raises CircuitOpenError when the model has
+        replicas but none is healthy; only a model without any replica goes to
+        the default Ollama host.
+        """
+        if url:
+            node = self.nodes.get(base_url(url))
+            if node is None:
+                yield url
+                return
+            with self.lock:
+                node.outstanding += 1
+        else:
+            node = self.pick(model)
+            if node is None:
+                if self.replicas(model):
+                    raise CircuitOpenError(f"no healthy fleet node for {model}: every replica's circuit is open")
+                yield f"{OLLAMA_BASE_URL}/api/generate"
+                return
+        pinned = bool(url)
+        started = time.monotonic()
+        try:
+            yield url or node.generate_url
+        except Exception:
+            self.release(node, model, False, time.monotonic() - started, pinned)
+            raise
+        except BaseException:  # cancelled (quorum, deadline, client gone)
+            self.release(node, model, False, None, pinned)
+            raise
+        else:
+            self.release(node, model, True, time.monotonic() - started, pinned)
+
+    # --- Discovery ---
+
+    async def probe(self, node: Node, client: httpx.AsyncClient):
+        """Fetch the model list of one node."""
+        try:
+            response = await client.get(f"{node.url}/api/tags", timeout=FLEET_PROBE_TIMEOUT)
+            response.raise_for_status()
+            node.models = {m["name"] for m in response.json()["models"]}
+            node.reachable, node.error = True, None
+        except Exception as e:
+            node.reachable, node.error = False, str(e) or type(e).__name__
+        node.checked_at = time.monotonic()
+
+    async def refresh(self, client: httpx.AsyncClient = None):
+        """Probe all nodes concurrently (the scan takes as long as the slowest node, at most FLEET_PROBE_TIMEOUT)."""
+        nodes = list(self.nodes.values())
+        if client is not None:
+            await asyncio.gather(*(self.probe(node, client) for node in nodes))
+            return
+        async with httpx.AsyncClient() as client:
+            await asyncio.gather(*(self.probe(node, client) for node in nodes))
+
+    def refresh_in_background(self) -> threading.Thread:
+        """Start a refresh in a worker thread unless one is already running; returns that thread."""
+        with self.lock:
+            if self.refresher is None or not self.refresher.is_alive():
+                self.refresher = threading.Thread(target=lambda: asyncio.run(self.refresh()), daemon=True)
+                self.refresher.start()
+            return self.refresher
+
+    def rescan(self):
+        """Refresh now and wait for it (bounded by the probe timeout)."""
+        self.refresh_in_background().join(FLEET_PROBE_TIMEOUT + 1.0)
+
+    def inventory(self, max_age: float = FLEET_DISCOVERY_TTL) -> list:
+        """
+        Cached discovery results, one dict per node. Entries older than
+        `max_age` are refreshed in the background and served as they are;
+        only nodes never probed are waited for (once, concurrently).
+        """
+        now = time.monotonic()
+        nodes = list(self.nodes.values())
+        if any(n.checked_at is None for n in nodes):
+            self.rescan()
+        elif any(now - n.checked_at > max_age for n in nodes):
+            self.refresh_in_background()
+        return [
+            {
+                "name": n.name,
+                "url": n.url,
+                "reachable": n.reachable,
+                "models": sorted(n.models or ()),
+                "error": n.error,
+                "age": round(now - n.checked_at, 1) if n.checked_at is not None else None
+            }
+            for n in nodes
+        ]
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                node.name: {
+                    "url": node.url,
+                    "weight": node.weight,
+                    "models": sorted(node.models) if node.models is not None else None,
+                    "outstanding": node.outstanding,
+                    "latency_ewma": round(node.ewma, 3) if node.ewma is not None else None,
+                    "requests": node.requests,
+                    "failures": node.failures,
+                    "reachable": node.reachable
+                }
+                for node in self.nodes.values()
+            }
+
+fleet = Fleet()
+fleet.add_node("Local", OLLAMA_BASE_URL)
+for _entry in FLEET_NODES:
+    fleet.add_node(_entry.get("name") or _entry["url"], _entry["url"], _entry.get("weight", 1.0))
@@ -2,8 +2,15 @@ import os
 import httpx
 import asyncio
 import json
+import time
+import weakref
 import g4f
+from urllib.parse import urlsplit
 from dotenv import load_dotenv
+from provider_health import get_breaker, CircuitOpenError
+from retry_policy import send_with_retry, stream_with_retry, retry_call, set_deadline
+from rate_limiter import get_limiter, request_tokens, RateLimitExceeded
+from fleet import fleet
 
 load_dotenv()
 
@@ -18,6 +25,113 @@ except ImportError:
     OLLAMA_URL = "http://localhost:11434/api/generate"
     OLLAMA_TIMEOUT = 60.0
 
+try:
+    from config import OPENAI_MODEL, ANTHROPIC_MODEL, GEMINI_MODEL, PERPLEXITY_MODEL
+except ImportError:
+    OPENAI_MODEL = "gpt-4o"
+    ANTHROPIC_MODEL = "claude-3-opus-20240229"
+    GEMINI_MODEL = "gemini-pro"
+    PERPLEXITY_MODEL = "llama-3-sonar-large-32k-online"
+
+try:
+    from config import HTTP_MAX_CONNECTIONS, HTTP_MAX_KEEPALIVE, HTTP_KEEPALIVE_EXPIRY, HTTP2_ENABLED
+except ImportError:
+    HTTP_MAX_CONNECTIONS = 20
+    HTTP_MAX_KEEPALIVE = 10
+    HTTP_KEEPALIVE_EXPIRY = 30.0
+    HTTP2_ENABLED = True
+
+OPENAI_URL = "https://api.openai.com/v1/chat/completions"
+ANTHROPIC_URL = "https://api.anthropic.com/v1/messages"
+GEMINI_URL = "https://generativelanguage.googleapis.com/v1beta"
+PERPLEXITY_URL = "https://api.perplexity.ai/chat/completions"
+
+# --- Pooled HTTP Clients ---
+# One AsyncClient per (event loop, upstream origin): provider calls reuse warm
+# TCP/TLS connections and every host gets its own connection limits.
+# Keyed by loop because httpx connections cannot be shared across event loops
+# (Streamlit runs each query in a fresh asyncio.run loop).
+_clients = weakref.WeakKeyDictionary()
+_pool_stats = {}
+
+try:
+    import h2  # noqa: F401
+    H2_AVAILABLE = True
+except ImportError:
+    H2_AVAILABLE = False
+
+def _origin(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+def get_client(url: str) -> httpx.AsyncClient:
+    """
+    Return the shared client for the origin of `url`, creating it on first use.
+    HTTPS upstreams negotiate HTTP/2 when the `h2` package is installed.
+    """
+    loop = asyncio.get_running_loop()
+    origin = _origin(url)
+    clients = _clients.setdefault(loop, {})
+    client = clients.get(origin)
+    if client is None or client.is_closed:
+        stats = _pool_stats.setdefault(origin, {"clients_created": 0, "requests": 0, "http_versions": {}})
+        stats["clients_created"] += 1
+
+        async def on_request(request):
+            stats["requests"] += 1
+
+        async def on_response(response):
+            version = response.http_version
+            stats["http_versions"][version] = stats["http_versions"].get(version, 0) + 1
+
+        client = httpx.AsyncClient(
+            http2=HTTP2_ENABLED and H2_AVAILABLE and origin.startswith("https://"),
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+            ),
+            event_hooks={"request": [on_request], "response": [on_response]},
+        )
+        clients[origin] = client
+    return client
+
+async def close_clients():
+    """Close every pooled client owned by the running event loop."""
+    clients = _clients.pop(asyncio.get_running_loop(), {})
+    for client in clients.values():
+        await client.aclose()
+
+def pool_stats() -> dict:
+    """
+    Per-origin pool metrics: request counts, negotiated HTTP versions and
+    the current open/idle connection counts of the live clients.
+    """
+    report = {origin: {**stats, "open_connections": 0, "idle_connections": 0}
+              for origin, stats in _pool_stats.items()}
+    for clients in list(_clients.values()):
+        for origin, client in clients.items():
+            # httpx does not expose pool state publicly; read it best-effort
+            pool = getattr(getattr(client, "_transport", None), "_pool", None)
+            for conn in getattr(pool, "connections", []):
+                report[origin]["open_connections"] += 1
+                if conn.is_idle():
+                    report[origin]["idle_connections"] += 1
+    return report
+
+
+# g4f rate limits are worth waiting for; retrying them on another model is not
+G4F_RETRY_ERRORS = tuple(getattr(g4f.errors, name) for name in ("RateLimitError",) if hasattr(getattr(g4f, "errors", None), name))
+
+def rate_limits(provider: str, api_key: str, query: str) -> dict:
+    """Rate limiter arguments of send_with_retry/stream_with_retry for one call."""
+    return {"limiter": get_limiter(provider, api_key), "tokens": request_tokens(query)}
+
+def settle(limits: dict, usage: dict, *fields):
+    """Replace the token estimate of a call with the usage the provider reported."""
+    used = sum(usage.get(field) or 0 for field in fields) if isinstance(usage, dict) else 0
+    limits["limiter"].settle(limits["tokens"], used)
+
 async def fetch_g4f(query: str, model: str, provider_name: str):
     """
     Fallback to g4f (Free Web) if API key is missing.
@@ -31,10 +145,17 @@ async def fetch_g4f(query: str, model: str, provider_name: str):
             model_obj = g4f.models.default
         
         try:
-            response = await g4f.ChatCompletion.create_async(
-                model=model_obj,
-                messages=[{"role": "user", "content": query}],
+            # Rate limits are retried with backoff; other failures fall through to the default model
+            response = await retry_call(
+                lambda: g4f.ChatCompletion.create_async(
+                    model=model_obj,
+                    messages=[{"role": "user", "content": query}],
+                ),
+                f"{provider_name} (Free Web)",
+                G4F_RETRY_ERRORS
             )
+        except G4F_RETRY_ERRORS:
+            raise
         except Exception as e:
             # If specific model failed (e.g. auth required), try default
             print(f"⚠️ Model {model} failed: {e}. Falling back to default.")
@@ -48,66 +169,79 @@ async def fetch_g4f(query: str, model: str, provider_name: str):
     except Exception as e:
         return f"Error ({provider_name} - Free Web): {str(e)}"
 
-async def fetch_openai(query: str, client: httpx.AsyncClient):
-    api_key = os.getenv("OPENAI_API_KEY")
+async def fetch_openai(query: str, client: httpx.AsyncClient = None, model: str = OPENAI_MODEL, url: str = OPENAI_URL, api_key: str = None, timeout: float = TIMEOUT):
+    api_key = os.getenv("OPENAI_API_KEY") if api_key is None else api_key
     if not api_key:
         return await fetch_g4f(query, "gpt-4o", "ChatGPT")
     
+    client = client or get_client(url)
+    limits = rate_limits("OpenAI", api_key, query)
     try:
-        response = await client.post(
-            "https://api.openai.com/v1/chat/completions",
+        response = await send_with_retry(
+            client, "POST", url, "OpenAI", **limits,
             headers={"Authorization": f"Bearer {api_key}"},
             json={
-                "model": "gpt-4o",
+                "model": model,
                 "messages": [{"role": "user", "content": query}]
             },
-            timeout=TIMEOUT
+            timeout=timeout
         )
         response.raise_for_status()
-        return response.json()["choices"][0]["message"]["content"]
+        data = response.json()
+        settle(limits, data.get("usage"), "total_tokens")
+        return data["choices"][0]["message"]["content"]
+    except RateLimitExceeded:
+        raise  # refused locally: not a provider failure
     except Exception as e:
         return f"Error (OpenAI): {str(e)}"
 
-async def fetch_anthropic(query: str, client: httpx.AsyncClient):
-    api_key = os.getenv("ANTHROPIC_API_KEY")
+async def fetch_anthropic(query: str, client: httpx.AsyncClient = None, model: str = ANTHROPIC_MODEL, url: str = ANTHROPIC_URL, api_key: str = None, timeout: float = TIMEOUT):
+    api_key = os.getenv("ANTHROPIC_API_KEY") if api_key is None else api_key
     if not api_key:
         return await fetch_g4f(query, "claude-3-opus", "Claude")
     
+    client = client or get_client(url)
+    limits = rate_limits("Anthropic", api_key, query)
     try:
-        response = await client.post(
-            "https://api.anthropic.com/v1/messages",
+        response = await send_with_retry(
+            client, "POST", url, "Anthropic", **limits,
             headers={
                 "x-api-key": api_key,
                 "anthropic-version": "2023-06-01",
                 "content-type": "application/json"
             },
             json={
-                "model": "claude-3-opus-20240229",
+                "model": model,
                 "max_tokens": 1024,
                 "messages": [{"role": "user", "content": query}]
             },
-            timeout=TIMEOUT
+            timeout=timeout
         )
         response.raise_for_status()
-        return response.json()["content"][0]["text"]
+        data = response.json()
+        settle(limits, data.get("usage"), "input_tokens", "output_tokens")
+        return data["content"][0]["text"]
+    except RateLimitExceeded:
+        raise  # refused locally: not a provider failure
     except Exception as e:
         return f"Error (Anthropic): {str(e)}"
 
-async def fetch_gemini(query: str, client: httpx.AsyncClient):
-    api_key = os.getenv("GOOGLE_API_KEY")
+async def fetch_gemini(query: str, client: httpx.AsyncClient = None, model: str = GEMINI_MODEL, url: str = GEMINI_URL, api_key: str = None, timeout: float = TIMEOUT):
+    api_key = os.getenv("GOOGLE_API_KEY") if api_key is None else api_key
     if not api_key:
         return await fetch_g4f(query, "gemini-pro", "Gemini")
     
     try:
         # Gemini API structure is slightly different, often uses URL params for key
-        url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-pro:generateContent?key={api_key}"
-        response = await client.post(
-            url,
+        url = f"{url.rstrip('/')}/models/{model}:generateContent?key={api_key}"
+        client = client or get_client(url)
+        response = await send_with_retry(
+            client, "POST", url, "Gemini", **rate_limits("Gemini", api_key, query),
             headers={"Content-Type": "application/json"},
             json={
                 "contents": [{"parts": [{"text": query}]}]
             },
-            timeout=TIMEOUT
+            timeout=timeout
         )
         response.raise_for_status()
         # Parse response carefully
@@ -115,53 +249,63 @@ async def fetch_gemini(query: str, client: httpx.AsyncClient):
         if "candidates" in data and data["candidates"]:
             return data["candidates"][0]["content"]["parts"][0]["text"]
         return "Error (Gemini): No content returned."
+    except RateLimitExceeded:
+        raise  # refused locally: not a provider failure
     except Exception as e:
         return f"Error (Gemini): {str(e)}"
 
-async def fetch_perplexity(query: str, client: httpx.AsyncClient):
-    api_key = os.getenv("PERPLEXITY_API_KEY")
+async def fetch_perplexity(query: str, client: httpx.AsyncClient = None, model: str = PERPLEXITY_MODEL, url: str = PERPLEXITY_URL, api_key: str = None, timeout: float = TIMEOUT):
+    api_key = os.getenv("PERPLEXITY_API_KEY") if api_key is None else api_key
     if not api_key:
         # Perplexity free web access via g4f might be limited, trying generic fallback or specific if available
         return await fetch_g4f(query, "llama-3-70b-chat", "Perplexity")
     
+    client = client or get_client(url)
+    limits = rate_limits("Perplexity", api_key, query)
     try:
-        response = await client.post(
-            "https://api.perplexity.ai/chat/completions",
+        response = await send_with_retry(
+            client, "POST", url, "Perplexity", **limits,
             headers={
                 "Authorization": f"Bearer {api_key}",
                 "Content-Type": "application/json"
             },
             json={
-                "model": "llama-3-sonar-large-32k-online",
+                "model": model,
                 "messages": [{"role": "user", "content": query}]
             },
-            timeout=TIMEOUT
+            timeout=timeout
         )
         response.raise_for_status()
-        return response.json()["choices"][0]["message"]["content"]
+        data = response.json()
+        settle(limits, data.get("usage"), "total_tokens")
+        return data["choices"][0]["message"]["content"]
+    except RateLimitExceeded:
+        raise  # refused locally: not a provider failure
     except Exception as e:
         return f"Error (Perplexity): {str(e)}"
 
-async def fetch_ollama(query: str, model: str, client: httpx.AsyncClient):
+async def fetch_ollama(query: str, model: str, client: httpx.AsyncClient = None, url: str = None, timeout: float = OLLAMA_TIMEOUT):
     """
-    Fetch response from Ollama instance (local or remote).
+    Fetch response from Ollama instance (local or remote). Without `url` the
+    request goes to the least loaded fleet node serving `model`.
     """
     try:
-        response = await client.post(
-            OLLAMA_URL,
-            json={
-                "model": model,
-                "prompt": query,
-                "stream": False
-            },
-            timeout=OLLAMA_TIMEOUT
-        )
-        response.raise_for_status()
-        return response.json()["response"]
+        async with fleet.route(model, url) as target:
+            response = await (client or get_client(target)).post(
+                target,
+                json={
+                    "model": model,
+                    "prompt": query,
+                    "stream": False
+                },
+                timeout=timeout
+            )
+            response.raise_for_status()
+            return response.json()["response"]
     except Exception as e:
         return f"Error (Ollama - {model}): {str(e)}"
 
-async def fetch_generic_openai_compatible(query: str, api_key: str, base_url: str, model: str, provider_name: str, client: httpx.AsyncClient):
+async def fetch_generic_openai_compatible(query: str, api_key: str, base_url: str, model: str, provider_name: str, client: httpx.AsyncClient = None, timeout: float = TIMEOUT):
     """
     Fetch response from any OpenAI-compatible API (Groq, OpenRouter, etc.)
     """
@@ -177,42 +321,324 @@ async def fetch_generic_openai_compatible(query: str, api_key: str, base_url: st
             else:
                 url += "/chat/completions"
                 
-        response = await client.post(
-            url,
+        client = client or get_client(url)
+        limits = rate_limits(provider_name, api_key, query)
+        response = await send_with_retry(
+            client, "POST", url, provider_name, **limits,
             headers={"Authorization": f"Bearer {api_key}"},
             json={
                 "model": model,
                 "messages": [{"role": "user", "content": query}]
             },
-            timeout=TIMEOUT
+            timeout=timeout
         )
         response.raise_for_status()
-        return response.json()["choices"][0]["message"]["content"]
+        data = response.json()
+        settle(limits, data.get("usage"), "total_tokens")
+        return data["choices"][0]["message"]["content"]
+    except RateLimitExceeded:
+        raise  # refused locally: not a provider failure
     except Exception as e:
         return f"Error ({provider_name}): {str(e)}"
 
+# --- Token Streaming ---
+# stream_* mirror the fetch_* functions above but yield text deltas as the
+# upstream produces them. Errors are raised rather than returned as strings;
+# fan_out_stream turns them into the usual "Error: ..." result.
+
+async def _iter_sse_json(response: httpx.Response):
+    """Yield the JSON payload of every `data:` line of a Server-Sent Events body."""
+    async for line in response.aiter_lines():
+        if not line.startswith("data:"):
+            continue
+        data = line[5:].strip()
+        if not data or data == "[DONE]":
+            continue
+        yield json.loads(data)
+
+async def stream_chat_completions(url: str, headers: dict, payload: dict, client: httpx.AsyncClient, provider: str = None, limits: dict = None, timeout: float = TIMEOUT):
+    """Stream `choices[0].delta.content` from an OpenAI-compatible endpoint."""
+    async with stream_with_retry(client, "POST", url, provider or _origin(url), **(limits or {}), headers=headers, json={**payload, "stream": True}, timeout=timeout) as response:
+        response.raise_for_status()
+        async for event in _iter_sse_json(response):
+            choices = event.get("choices") or [{}]
+            delta = choices[0].get("delta", {}).get("content")
+            if delta:
+                yield delta
+
+async def stream_g4f(query: str, model: str, provider_name: str):
+    """g4f has no reliable async streaming; yield the whole answer as one chunk."""
+    yield await fetch_g4f(query, model, provider_name)
+
+async def stream_openai(query: str, client: httpx.AsyncClient = None, model: str = OPENAI_MODEL, url: str = OPENAI_URL, api_key: str = None, timeout: float = TIMEOUT):
+    api_key = os.getenv("OPENAI_API_KEY") if api_key is None else api_key
+    if not api_key:
+        yield await fetch_g4f(query, "gpt-4o", "ChatGPT")
+        return
+    
+    async for delta in stream_chat_completions(
+        url,
+        {"Authorization": f"Bearer {api_key}"},
+        {"model": model, "messages": [{"role": "user", "content": query}]},
+        client or get_client(url),
+        "OpenAI",
+        rate_limits("OpenAI", api_key, query),
+        timeout
+    ):
+        yield delta
+
+async def stream_anthropic(query: str, client: httpx.AsyncClient = None, model: str = ANTHROPIC_MODEL, url: str = ANTHROPIC_URL, api_key: str = None, timeout: float = TIMEOUT):
+    api_key = os.getenv("ANTHROPIC_API_KEY") if api_key is None else api_key
+    if not api_key:
+        yield await fetch_g4f(query, "claude-3-opus", "Claude")
+        return
+    
+    client = client or get_client(url)
+    async with stream_with_retry(
+        client,
+        "POST",
+        url,
+        "Anthropic",
+        **rate_limits("Anthropic", api_key, query),
+        headers={
+            "x-api-key": api_key,
+            "anthropic-version": "2023-06-01",
+            "content-type": "application/json"
+        },
+        json={
+            "model": model,
+            "max_tokens": 1024,
+            "messages": [{"role": "user", "content": query}],
+            "stream": True
+        },
+        timeout=timeout
+    ) as response:
+        response.raise_for_status()
+        async for event in _iter_sse_json(response):
+            if event.get("type") == "content_block_delta":
+                text = event.get("delta", {}).get("text")
+                if text:
+                    yield text
+
+async def stream_gemini(query: str, client: httpx.AsyncClient = None, model: str = GEMINI_MODEL, url: str = GEMINI_URL, api_key: str = None, timeout: float = TIMEOUT):
+    api_key = os.getenv("GOOGLE_API_KEY") if api_key is None else api_key
+    if not api_key:
+        yield await fetch_g4f(query, "gemini-pro", "Gemini")
+        return
+    
+    url = f"{url.rstrip('/')}/models/{model}:streamGenerateContent?alt=sse&key={api_key}"
+    client = client or get_client(url)
+    async with stream_with_retry(
+        client,
+        "POST",
+        url,
+        "Gemini",
+        **rate_limits("Gemini", api_key, query),
+        headers={"Content-Type": "application/json"},
+        json={"contents": [{"parts": [{"text": query}]}]},
+        timeout=timeout
+    ) as response:
+        response.raise_for_status()
+        async for event in _iter_sse_json(response):
+            for candidate in event.get("candidates", [])[:1]:
+                for part in candidate.get("content", {}).get("parts", []):
+                    if part.get("text"):
+                        yield part["text"]
+
+async def stream_perplexity(query: str, client: httpx.AsyncClient = None, model: str = PERPLEXITY_MODEL, url: str = PERPLEXITY_URL, api_key: str = None, timeout: float = TIMEOUT):
+    api_key = os.getenv("PERPLEXITY_API_KEY") if api_key is None else api_key
+    if not api_key:
+        yield await fetch_g4f(query, "llama-3-70b-chat", "Perplexity")
+        return
+    
+    async for delta in stream_chat_completions(
+        url,
+        {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
+        {"model": model, "messages": [{"role": "user", "content": query}]},
+        client or get_client(url),
+        "Perplexity",
+        rate_limits("Perplexity", api_key, query),
+        timeout
+    ):
+        yield delta
+
+async def stream_ollama(query: str, model: str, client: httpx.AsyncClient = None, url: str = None, timeout: float = OLLAMA_TIMEOUT):
+    """
+    Stream an Ollama generation (routed like fetch_ollama). Ollama answers
+    `"stream": true` with newline-delimited JSON objects carrying a `response`
+    fragment each.
+    """
+    async with fleet.route(model, url) as target:
+        async with (client or get_client(target)).stream(
+            "POST",
+            target,
+            json={"model": model, "prompt": query, "stream": True},
+            timeout=timeout
+        ) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.strip():
+                    continue
+                chunk = json.loads(line)
+                if chunk.get("error"):
+                    raise RuntimeError(chunk["error"])
+                if chunk.get("response"):
+                    yield chunk["response"]
+                if chunk.get("done"):
+                    break
+
+async def stream_generic_openai_compatible(query: str, api_key: str, base_url: str, model: str, provider_name: str, client: httpx.AsyncClient = None, timeout: float = TIMEOUT):
+    url = base_url
+    if not url.endswith("/chat/completions"):
+        url = url.rstrip("/") + "/chat/completions"
+    
+    async for delta in stream_chat_completions(
+        url,
+        {"Authorization": f"Bearer {api_key}"},
+        {"model": model, "messages": [{"role": "user", "content": query}]},
+        client or get_client(url),
+        provider_name,
+        rate_limits(provider_name, api_key, query),
+        timeout
+    ):
+        yield delta
+
+def is_success(result: str, error=None) -> bool:
+    """True for a usable provider answer (providers report failures as "Error..." strings)."""
+    return error is None and not str(result).startswith("Error")
+
+def circuit_open_error(name: str) -> CircuitOpenError:
+    breaker = get_breaker(name)
+    return CircuitOpenError(f"{name} skipped, circuit open after repeated failures (next try in {breaker.retry_in():.0f}s)")
+
+async def fan_out(tasks: list, quorum: int = None, deadline: float = None):
+    """
+    Run (name, coroutine) pairs concurrently and yield (name, result, error)
+    tuples in completion order, so callers can emit each answer as soon as it lands.
+    Stops early once `quorum` successful answers have arrived or `deadline`
+    seconds have passed; pending tasks are then cancelled, as they are if the
+    consumer stops iterating early. Callers find the dropped providers by
+    comparing the names they received against `tasks`.
+    Every outcome feeds the provider's circuit breaker (calls refused by the
+    local rate limiter don't); providers whose circuit is open are not called
+    and fail immediately with CircuitOpenError.
+    """
+    async def run(name, coro):
+        set_deadline(deadline)  # retries in this task stop at the fan-out deadline
+        breaker = get_breaker(name)
+        if not breaker.allow():
+            coro.close()
+            error = circuit_open_error(name)
+            return name, f"Error: {str(error)}", error
+        started = time.monotonic()
+        try:
+            result = await coro
+        except asyncio.CancelledError:
+            breaker.release()
+            raise
+        except RateLimitExceeded as e:
+            breaker.release()  # never reached the provider
+            return name, f"Error: {str(e)}", e
+        except Exception as e:
+            breaker.record(False, time.monotonic() - started)
+            return name, f"Error: {str(e)}", e
+        breaker.record(is_success(result), time.monotonic() - started)
+        return name, result, None
+
+    pending = [asyncio.ensure_future(run(name, coro)) for name, coro in tasks]
+    succeeded = 0
+    try:
+        for future in asyncio.as_completed(pending, timeout=deadline):
+            try:
+                item = await future
+            except asyncio.TimeoutError:
+                break
+            yield item
+            if is_success(item[1], item[2]):
+                succeeded += 1
+                if quorum and succeeded >= quorum:
+                    break
+    finally:
+        for task in pending:
+            if not task.done():
+                task.cancel()
+
+async def fan_out_stream(streams: list, quorum: int = None, deadline: float = None):
+    """
+    Multiplex (name, async iterator) pairs into one stream of
+    (name, kind, text, error) tuples. kind is "delta" for every token chunk and
+    "done" once a provider finishes, with the full text (or "Error: ...") as
+    text. `quorum` and `deadline` behave as in fan_out; providers still
+    streaming when either is hit never get a "done" event.
+    Pending streams are cancelled if the consumer stops iterating early.
+    Circuit breakers are consulted and fed as in fan_out.
+    """
+    queue = asyncio.Queue()
+
+    async def pump(name, stream):
+        set_deadline(deadline)
+        breaker = get_breaker(name)
+        if not breaker.allow():
+            error = circuit_open_error(name)
+            await queue.put((name, "done", f"Error: {str(error)}", error))
+            return
+        chunks = []
+        started = time.monotonic()
+        try:
+            async for delta in stream:
+                if delta:
+                    chunks.append(delta)
+                    await queue.put((name, "delta", delta, None))
+            text = "".join(chunks)
+            breaker.record(is_success(text), time.monotonic() - started)
+            await queue.put((name, "done", text, None))
+        except asyncio.CancelledError:
+            breaker.release()
+            raise
+        except RateLimitExceeded as e:
+            breaker.release()
+            await queue.put((name, "done", f"Error: {str(e)}", e))
+        except Exception as e:
+            breaker.record(False, time.monotonic() - started)
+            await queue.put((name, "done", f"Error: {str(e)}", e))
+
+    loop = asyncio.get_running_loop()
+    expires = loop.time() + deadline if deadline is not None else None
+    pending = [asyncio.ensure_future(pump(name, stream)) for name, stream in streams]
+    succeeded = 0
+    try:
+        remaining = len(pending)
+        while remaining:
+            timeout = None if expires is None else max(expires - loop.time(), 0)
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            yield item
+            if item[1] == "done":
+                remaining -= 1
+                if is_success(item[2], item[3]):
+                    succeeded += 1
+                    if quorum and succeeded >= quorum:
+                        break
+    finally:
+        for task in pending:
+            if not task.done():
+                task.cancel()
+
 async def get_all_responses(query: str, active_providers: list):
     """
     Fetch responses from selected providers.
-    active_providers: List of dicts [{"name": "ChatGPT", "func": fetch_openai}, ...]
+    active_providers: List of dicts [{"name": "ChatGPT", "type": "online"}, {"name": ..., "type": "ollama", "model": "llama3"}, ...]
     """
-    async with httpx.AsyncClient() as client:
-        tasks = []
-        provider_names = []
-        
-        for provider in active_providers:
-            provider_names.append(provider["name"])
-            if provider["type"] == "ollama":
-                tasks.append(fetch_ollama(query, provider["model"], client))
-            elif provider["name"] == "ChatGPT":
-                tasks.append(fetch_openai(query, client))
-            elif provider["name"] == "Claude":
-                tasks.append(fetch_anthropic(query, client))
-            elif provider["name"] == "Gemini":
-                tasks.append(fetch_gemini(query, client))
-            elif provider["name"] == "Perplexity":
-                tasks.append(fetch_perplexity(query, client))
-                
-        results = await asyncio.gather(*tasks)
-        
-    return dict(zip(provider_names, results))
+    # Imported here: provider_registry dispatches to the functions of this module
+    from provider_registry import find, ollama_provider, gather_responses
+    
+    providers = []
+    for provider in active_providers:
+        if provider["type"] == "ollama":
+            providers.append(ollama_provider(provider["model"], name=provider["name"]))
+        elif find(provider["name"]):
+            providers.append(find(provider["name"]))
+    
+    return await gather_responses(query, providers)
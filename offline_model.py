@@ -1,5 +1,8 @@
-import httpx
 import json
+import os
+import asyncio
+from llm_providers import get_client, stream_ollama, stream_chat_completions
+from fleet import fleet
 
 # Import centralized config for portability
 try:
@@ -13,26 +16,27 @@ except ImportError:
     MODEL_NAME = "llama3"
     TIMEOUT = 60.0
 
-async def synthesize_responses(query: str, responses: dict, context: str = "", target_url: str = OLLAMA_URL, target_model: str = MODEL_NAME):
-    """
-    Synthesizes multiple LLM responses into a single coherent answer using a local or remote Ollama model.
-    """
-    
-    # Construct a prompt that includes all the responses
-    context_text = ""
-    for provider, response in responses.items():
-        if not response.startswith("Error"):
-            context_text += f"\n\n--- {provider} Response ---\n{response}"
-    
-    if not context_text:
-        return "Error: No valid responses received from online providers to synthesize."
+try:
+    from config import SYNTHESIS_PROMPT_TOKENS, SYNTHESIS_PROMPT_BUDGETS
+except ImportError:
+    SYNTHESIS_PROMPT_TOKENS = 3000
+    SYNTHESIS_PROMPT_BUDGETS = {}
 
-    # Add retrieved memory context if available
-    memory_section = ""
-    if context:
-        memory_section = f"\n\n--- RELEVANT KNOWLEDGE FROM MEMORY ---\n{context}\n--------------------------------------\n"
+try:
+    from config import MAP_REDUCE_GROUP_SIZE
+except ImportError:
+    MAP_REDUCE_GROUP_SIZE = 3
+
+try:
+    from config import SYNTHESIS_CHAIN, SYNTHESIS_HEDGE_DELAYS
+except ImportError:
+    SYNTHESIS_CHAIN = ["ollama", "openai", "g4f"]
+    SYNTHESIS_HEDGE_DELAYS = []
+
+SYNTHESIZER_SYSTEM_PROMPT = "You are an expert synthesizer. Summarize the provided AI responses into one comprehensive answer."
+NO_VALID_RESPONSES = "Error: No valid responses received from online providers to synthesize."
 
-    prompt = f"""
+PROMPT_TEMPLATE = """
     You are an expert synthesizer. 
     User Question: "{query}"
     
@@ -52,59 +56,396 @@ async def synthesize_responses(query: str, responses: dict, context: str = "", t
     Final Answer:
     """
 
+# Running totals of what the prompt builder cut (exposed via /metrics)
+prompt_stats = {"prompts": 0, "trimmed_prompts": 0, "tokens_in": 0, "tokens_sent": 0, "duplicate_paragraphs": 0}
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token for English text)."""
+    return len(text) // 4 + 1
+
+def prompt_budget(model: str) -> int:
+    """Prompt token budget for a synthesizer: exact model name, then its family (before ':'), then the default."""
+    model = model or ""
+    budget = SYNTHESIS_PROMPT_BUDGETS.get(model) or SYNTHESIS_PROMPT_BUDGETS.get(model.split(":")[0])
+    return int(budget or SYNTHESIS_PROMPT_TOKENS)
+
+def _dedupe_paragraphs(sections: dict):
+    """Drop paragraphs that already appeared (whitespace/case-insensitively) in an earlier section."""
+    seen = set()
+    removed = 0
+    result = {}
+    for name, text in sections.items():
+        kept = []
+        for paragraph in text.split("\n\n"):
+            key = " ".join(paragraph.lower().split())
+            if key and key in seen:
+                removed += 1
+                continue
+            seen.add(key)
+            kept.append(paragraph)
+        result[name] = "\n\n".join(kept).strip()
+    return result, removed
+
+def _allocate(sizes: dict, available: int) -> dict:
+    """
+    Split a token budget across sections: sections smaller than their fair
+    share keep everything, the longer ones share what is left equally, so a
+    very long response is cut the most and short ones survive intact.
+    """
+    allowance = {}
+    remaining = available
+    pending = sorted(sizes, key=lambda name: sizes[name])
+    for i, name in enumerate(pending):
+        share = remaining // (len(pending) - i)
+        allowance[name] = min(sizes[name], share)
+        remaining -= allowance[name]
+    return allowance
+
+def _truncate(text: str, max_tokens: int) -> str:
+    """Cut text to about max_tokens, preferably at a paragraph or sentence boundary."""
+    max_chars = max(max_tokens, 1) * 4
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars]
+    boundary = max(cut.rfind("\n\n"), cut.rfind(". "))
+    if boundary > max_chars // 2:
+        cut = cut[:boundary + 1]
+    return cut.rstrip() + "\n[...]"
+
+def build_synthesis_prompt(query: str, responses: dict, context: str = "", max_tokens: int = None):
+    """
+    Build the synthesis prompt from the provider responses and memory context.
+    Returns None when there is no usable (non-error) response to synthesize.
+
+    With `max_tokens`, paragraphs repeated across providers are dropped and
+    the longest responses/memory context are trimmed (see _allocate) so the
+    whole prompt fits the budget.
+    """
+    usable = {provider: response for provider, response in responses.items() if not response.startswith("Error")}
+    if not usable:
+        return None
+
+    sections = dict(usable)
+    if context:
+        sections[None] = context  # memory context, trimmed like the responses
+    tokens_in = sum(estimate_tokens(text) for text in sections.values())
+    duplicates = 0
+
+    if max_tokens:
+        sections, duplicates = _dedupe_paragraphs(sections)
+        overhead = estimate_tokens(PROMPT_TEMPLATE.format(query=query, memory_section="", context_text="")) + 20 * len(sections)
+        available = max(max_tokens - overhead, 0)
+        total = sum(estimate_tokens(text) for text in sections.values())
+        if total > available:
+            allowance = _allocate({name: estimate_tokens(text) for name, text in sections.items()}, available)
+            sections = {name: _truncate(text, allowance[name]) for name, text in sections.items()}
+
+    # Construct a prompt that includes all the responses
+    context_text = ""
+    for provider, response in sections.items():
+        if provider is not None and response:
+            context_text += f"\n\n--- {provider} Response ---\n{response}"
+
+    # Add retrieved memory context if available
+    memory_section = ""
+    if sections.get(None):
+        memory_section = f"\n\n--- RELEVANT KNOWLEDGE FROM MEMORY ---\n{sections[None]}\n--------------------------------------\n"
+
+    tokens_sent = sum(estimate_tokens(text) for text in sections.values())
+    prompt_stats["prompts"] += 1
+    prompt_stats["tokens_in"] += tokens_in
+    prompt_stats["tokens_sent"] += tokens_sent
+    prompt_stats["duplicate_paragraphs"] += duplicates
+    if tokens_sent < tokens_in:
+        prompt_stats["trimmed_prompts"] += 1
+        print(f"Synthesis prompt trimmed: ~{tokens_in} -> ~{tokens_sent} tokens ({duplicates} duplicate paragraphs)")
+
+    return PROMPT_TEMPLATE.format(query=query, memory_section=memory_section, context_text=context_text)
+
+# --- Synthesis backends and hedging ---
+# Backends by SYNTHESIS_CHAIN name: (display name, banner, one-shot call, streaming call)
+async def _ollama_synthesis(prompt: str, url: str, model: str):
+    async with fleet.route(model, url) as target:
+        response = await get_client(target).post(
+            target,
+            json={
+                "model": model,
+                "prompt": prompt,
+                "stream": False
+            },
+            timeout=TIMEOUT
+        )
+        response.raise_for_status()
+        return response.json()["response"]
+
+async def _openai_synthesis(prompt: str):
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise RuntimeError("Key missing")
+    response = await get_client("https://api.openai.com").post(
+        "https://api.openai.com/v1/chat/completions",
+        headers={"Authorization": f"Bearer {api_key}"},
+        json={
+            "model": "gpt-4o-mini", 
+            "messages": [
+                {"role": "system", "content": SYNTHESIZER_SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}
+            ]
+        },
+        timeout=30.0
+    )
+    response.raise_for_status()
+    return response.json()['choices'][0]['message']['content']
+
+async def _g4f_synthesis(prompt: str):
+    import g4f
+    # Use gpt_4 as it is verified stable
+    response = await g4f.ChatCompletion.create_async(
+        model=g4f.models.gpt_4,
+        messages=[
+            {"role": "system", "content": SYNTHESIZER_SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ],
+    )
+    return str(response)
+
+def _synthesis_backends(prompt: str, target_url: str, target_model: str):
+    backends = {
+        "ollama": ("Ollama", "",
+                   lambda: _ollama_synthesis(prompt, target_url, target_model),
+                   lambda: stream_ollama(prompt, target_model, url=target_url)),
+        "openai": ("OpenAI", "**(Synthesized via Cloud Fallback)**\n\n",
+                   lambda: _openai_synthesis(prompt),
+                   lambda: _stream_openai_synthesis(prompt)),
+        "g4f": ("Free Web", "**(Synthesized via Free Web Fallback)**\n\n",
+                lambda: _g4f_synthesis(prompt),
+                lambda: _stream_g4f_synthesis(prompt)),
+    }
+    # Backends without credentials are left out instead of being started only to fail
+    # (which would also bring the next fallback forward)
+    if not os.getenv("OPENAI_API_KEY"):
+        del backends["openai"]
+    chain = [backends[name] for name in SYNTHESIS_CHAIN if name in backends]
+    return chain or list(backends.values())
+
+def _hedge_delay(attempt: int):
+    """Seconds to wait before starting attempt number `attempt` (1 = first fallback); None = only on failure."""
+    if not SYNTHESIS_HEDGE_DELAYS:
+        return None
+    return SYNTHESIS_HEDGE_DELAYS[min(attempt - 1, len(SYNTHESIS_HEDGE_DELAYS) - 1)]
+
+async def _hedge(attempts: list):
+    """
+    Run [(name, factory)] with hedging: start the first attempt, start the next
+    one after its hedge delay or as soon as a running attempt fails, take the
+    first non-empty result and cancel the rest (results that also completed
+    are closed, see _discard).
+    Returns (index, result, errors); index is None if every attempt failed.
+    """
+    pending = {}
+    errors = []
+    launched = 0
+
+    def launch():
+        nonlocal launched
+        name, factory = attempts[launched]
+        pending[asyncio.ensure_future(factory())] = (launched, name)
+        launched += 1
+
+    launch()
+    try:
+        while pending:
+            delay = _hedge_delay(launched) if launched < len(attempts) else None
+            done, _ = await asyncio.wait(pending, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                print(f"No synthesis after {delay}s, hedging with {attempts[launched][0]}...")
+                launch()
+                continue
+            failed = False
+            for task in done:
+                index, name = pending.pop(task)
+                try:
+                    result = task.result()
+                except Exception as e:
+                    print(f"{name} synthesis failed ({str(e)}). Trying next fallback...")
+                    errors.append(f"{name}: {str(e)}")
+                    failed = True
+                    continue
+                if result:
+                    return index, result, errors
+                errors.append(f"{name}: Empty response")
+                failed = True
+            if failed and launched < len(attempts):
+                launch()
+        return None, None, errors
+    finally:
+        for task in pending:
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled() and task.exception() is None:
+                await _discard(task.result())
+
+async def _discard(result):
+    """Close a losing hedge result that holds a connection (the (stream, delta) of _open_stream)."""
+    stream = result[0] if isinstance(result, tuple) else result
+    if hasattr(stream, "aclose"):
+        try:
+            await stream.aclose()
+        except Exception as e:
+            print(f"Warning: closing a hedged synthesis stream failed: {e}")
+
+async def synthesize_responses(query: str, responses: dict, context: str = "", target_url: str = None, target_model: str = MODEL_NAME):
+    """
+    Synthesizes multiple LLM responses into a single coherent answer using a local or remote Ollama model
+    (`target_url`, or the least loaded fleet node serving `target_model` when not given).
+    Falls back along SYNTHESIS_CHAIN (Ollama -> OpenAI -> g4f by default), hedged:
+    a fallback also starts when the current backend is slower than its
+    SYNTHESIS_HEDGE_DELAYS entry, and the first good answer wins.
+    """
+    prompt = build_synthesis_prompt(query, responses, context, max_tokens=prompt_budget(target_model))
+    if prompt is None:
+        return NO_VALID_RESPONSES
+
+    backends = _synthesis_backends(prompt, target_url, target_model)
+    index, answer, errors = await _hedge([(name, call) for name, _, call, _ in backends])
+    if index is None:
+        return "Error: All synthesis methods failed.\n" + "\n".join(errors)
+    return f"{backends[index][1]}{answer}"
+
+async def _stream_openai_synthesis(prompt: str):
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise RuntimeError("Key missing")
+    url = "https://api.openai.com/v1/chat/completions"
+    async for delta in stream_chat_completions(
+        url,
+        {"Authorization": f"Bearer {api_key}"},
+        {
+            "model": "gpt-4o-mini",
+            "messages": [
+                {"role": "system", "content": SYNTHESIZER_SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}
+            ]
+        },
+        get_client(url)
+    ):
+        yield delta
+
+async def _stream_g4f_synthesis(prompt: str):
+    yield await _g4f_synthesis(prompt)
+
+async def _open_stream(make_stream):
+    """Start a stream and wait for its first non-empty delta; returns (stream, delta) or None if it ended empty."""
+    stream = make_stream()
+    async for delta in stream:
+        if delta:
+            return stream, delta
+    return None
+
+async def synthesize_responses_stream(query: str, responses: dict, context: str = "", target_url: str = None, target_model: str = MODEL_NAME):
+    """
+    Streaming variant of synthesize_responses: yields the synthesized answer
+    token by token. Backends are hedged the same way until one produces its
+    first token; that one is kept and the others are cancelled. A failure
+    after the first token ends the answer with an interruption note instead.
+    """
+    prompt = build_synthesis_prompt(query, responses, context, max_tokens=prompt_budget(target_model))
+    if prompt is None:
+        yield NO_VALID_RESPONSES
+        return
+
+    backends = _synthesis_backends(prompt, target_url, target_model)
+    index, opened, errors = await _hedge([
+        (name, lambda make_stream=make_stream: _open_stream(make_stream)) for name, _, _, make_stream in backends
+    ])
+    if index is None:
+        yield "Error: All synthesis methods failed.\n" + "\n".join(errors)
+        return
+
+    stream, first = opened
+    if backends[index][1]:
+        yield backends[index][1]
+    yield first
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                target_url,
-                json={
-                    "model": target_model,
-                    "prompt": prompt,
-                    "stream": False
-                },
-                timeout=60.0
-            )
-            response.raise_for_status()
-            return response.json()["response"]
+        async for delta in stream:
+            if delta:
+                yield delta
     except Exception as e:
-        # Fallback to Cloud Model (OpenAI) if Ollama is offline
-        print(f"Ollama offline ({str(e)}). Switching to Cloud Fallback...")
-        
-        import os
-        api_key = os.getenv("OPENAI_API_KEY")
-        
-        # 1. Try OpenAI if key exists
-        if api_key:
+        yield f"\n\n*(Synthesis interrupted: {str(e)})*"
+
+# --- Map-reduce synthesis ---
+def plan_synthesis_groups(responses: dict, group_size: int, max_tokens: int):
+    """
+    Split the usable responses into groups of at most `group_size` responses
+    and `max_tokens` estimated tokens (a single oversized response gets its own group).
+    """
+    groups, current, used = [], {}, 0
+    for provider, response in responses.items():
+        if response.startswith("Error"):
+            continue
+        cost = estimate_tokens(response)
+        if current and (len(current) >= group_size or used + cost > max_tokens):
+            groups.append(current)
+            current, used = {}, 0
+        current[provider] = response
+        used += cost
+    if current:
+        groups.append(current)
+    return groups
+
+async def map_synthesis(query: str, responses: dict, nodes: list, group_size: int = None):
+    """
+    Map phase: synthesize groups of responses in parallel, spread round-robin
+    over `nodes` ([(generate_url, model)]; a None URL lets the fleet pick a
+    replica per group), level by level until everything fits
+    one synthesis prompt. Returns the (partial) responses for the final merge.
+    Partials only run on Ollama; groups whose partial synthesis fails are
+    passed on unmerged.
+    """
+    group_size = max(group_size or MAP_REDUCE_GROUP_SIZE, 2)
+    level = 0
+    while True:
+        budget = min(prompt_budget(model) for _, model in nodes)
+        groups = plan_synthesis_groups(responses, group_size, budget)
+        if len(groups) <= 1:
+            return responses
+        level += 1
+
+        async def synthesize_group(i, group):
+            if len(group) == 1:
+                return group
+            url, model = nodes[i % len(nodes)]
+            # Partials run on Ollama only: the cloud fallback chain is kept for the final merge
+            prompt = build_synthesis_prompt(query, group, max_tokens=prompt_budget(model))
+            if prompt is None:
+                return group
             try:
-                async with httpx.AsyncClient() as client:
-                    response = await client.post(
-                        "https://api.openai.com/v1/chat/completions",
-                        headers={"Authorization": f"Bearer {api_key}"},
-                        json={
-                            "model": "gpt-4o-mini", 
-                            "messages": [
-                                {"role": "system", "content": "You are an expert synthesizer. Summarize the provided AI responses into one comprehensive answer."},
-                                {"role": "user", "content": prompt}
-                            ]
-                        },
-                        timeout=30.0
-                    )
-                    response.raise_for_status()
-                    return f"**(Synthesized via Cloud Fallback)**\n\n{response.json()['choices'][0]['message']['content']}"
-            except Exception as cloud_e:
-                print(f"OpenAI Fallback failed: {cloud_e}")
-                # Fall through to g4f
-        
-        # 2. Try Free Web Fallback (g4f)
-        try:
-            import g4f
-            # Use gpt_4 as it is verified stable
-            response = await g4f.ChatCompletion.create_async(
-                model=g4f.models.gpt_4,
-                messages=[
-                    {"role": "system", "content": "You are an expert synthesizer. Summarize the provided AI responses into one comprehensive answer."},
-                    {"role": "user", "content": prompt}
-                ],
-            )
-            return f"**(Synthesized via Free Web Fallback)**\n\n{response}"
-        except Exception as g4f_e:
-             return f"Error: All synthesis methods failed.\nOllama: {str(e)}\nOpenAI: Key missing or failed\nFree Web: {str(g4f_e)}"
+                partial = await _ollama_synthesis(prompt, url, model)
+            except Exception as e:
+                print(f"Partial synthesis on {model} failed ({str(e)}), passing its group on unmerged")
+                return group
+            if not partial:
+                return group
+            return {f"Partial synthesis {level}.{i + 1}": partial}
+
+        merged = {}
+        for result in await asyncio.gather(*(synthesize_group(i, group) for i, group in enumerate(groups))):
+            merged.update(result)
+        if len(merged) >= sum(len(group) for group in groups):
+            return merged  # nothing could be merged at this level
+        responses = merged
+
+async def synthesize_map_reduce(query: str, responses: dict, context: str = "", target_url: str = None, target_model: str = MODEL_NAME, nodes: list = None):
+    """
+    Hierarchical synthesis: groups of responses are merged in parallel across
+    `nodes` (defaults to the target alone), then the target ("Brain") merges the
+    partial syntheses with the memory context into the final answer.
+    """
+    reduced = await map_synthesis(query, responses, nodes or [(target_url, target_model)])
+    return await synthesize_responses(query, reduced, context, target_url, target_model)
+
+async def synthesize_map_reduce_stream(query: str, responses: dict, context: str = "", target_url: str = None, target_model: str = MODEL_NAME, nodes: list = None):
+    """Streaming variant of synthesize_map_reduce: the final merge is streamed token by token."""
+    reduced = await map_synthesis(query, responses, nodes or [(target_url, target_model)])
+    async for delta in synthesize_responses_stream(query, reduced, context, target_url, target_model):
+        yield delta
@@ -0,0 +1,155 @@
+"""
+Per-provider circuit breakers. Every provider call records its outcome and
+latency in a rolling window; when too many recent calls failed (or were slow)
+the circuit opens and the provider is skipped instantly instead of costing a
+full timeout on every request. "Slow" is relative to the provider's own
+timeout when it is known (CIRCUIT_SLOW_SHARE of it), so local models that
+routinely take most of a long OLLAMA_TIMEOUT are not mistaken for failures. After a cooldown one probe call is let through
+(half-open): success closes the circuit again, failure re-opens it.
+"""
+import threading
+import time
+from collections import deque
+
+# Import centralized config for portability
+try:
+    from config import (CIRCUIT_ENABLED, CIRCUIT_WINDOW, CIRCUIT_MIN_CALLS, CIRCUIT_ERROR_RATE,
+                        CIRCUIT_SLOW_CALL, CIRCUIT_SLOW_SHARE, CIRCUIT_OPEN_SECONDS)
+except ImportError:
+    CIRCUIT_ENABLED = True
+    CIRCUIT_WINDOW = 120.0
+    CIRCUIT_MIN_CALLS = 4
+    CIRCUIT_ERROR_RATE = 0.5
+    CIRCUIT_SLOW_CALL = 25.0
+    CIRCUIT_SLOW_SHARE = 0.8
+    CIRCUIT_OPEN_SECONDS = 30.0
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+class CircuitOpenError(Exception):
+    """Raised in place of a call to a provider whose circuit is open."""
+
+def _percentile(values: list, q: float):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(int(q * len(values)), len(values) - 1)], 3)
+
+class CircuitBreaker:
+    """Closed/open/half-open breaker over a rolling window of (time, ok, latency) calls."""
+
+    def __init__(self, name: str, timeout: float = None):
+        self.name = name
+        self.timeout = timeout
+        self.state = CLOSED
+        self.calls = deque()
+        self.opened_at = 0.0
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def _trim(self, now: float):
+        while self.calls and now - self.calls[0][0] > CIRCUIT_WINDOW:
+            self.calls.popleft()
+
+    def slow_call(self) -> float:
+        """Latency (seconds) from which a call counts as failed."""
+        return self.timeout * CIRCUIT_SLOW_SHARE if self.timeout else CIRCUIT_SLOW_CALL
+
+    def _failure_rate(self):
+        # Slow calls count as failures: a provider that answers close to its timeout hurts like one that times out
+        slow = self.slow_call()
+        bad = sum(1 for _, ok, latency in self.calls if not ok or latency >= slow)
+        return bad / len(self.calls) if self.calls else 0.0
+
+    def retry_in(self, now: float = None) -> float:
+        """Seconds until an open circuit lets a probe through."""
+        if self.state != OPEN:
+            return 0.0
+        return max(self.opened_at + CIRCUIT_OPEN_SECONDS - (now or time.monotonic()), 0.0)
+
+    def allow(self) -> bool:
+        """Whether a call may go out now. Claims the probe slot when half-opening."""
+        if not CIRCUIT_ENABLED:
+            return True
+        with self.lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and self.retry_in() > 0:
+                return False
+            if self.probing:
+                return False
+            self.state = HALF_OPEN
+            self.probing = True
+            return True
+
+    def record(self, ok: bool, latency: float):
+        now = time.monotonic()
+        with self.lock:
+            self.calls.append((now, ok, latency))
+            self._trim(now)
+            if self.state == HALF_OPEN:
+                self.probing = False
+                if ok and latency < self.slow_call():
+                    self.state = CLOSED
+                    self.calls.clear()
+                else:
+                    self._open(now)
+            elif self.state == CLOSED and len(self.calls) >= CIRCUIT_MIN_CALLS and self._failure_rate() >= CIRCUIT_ERROR_RATE:
+                self._open(now)
+
+    def release(self):
+        """The call was cancelled before finishing (quorum/deadline): free the probe slot."""
+        with self.lock:
+            if self.state == HALF_OPEN and self.probing:
+                self.probing = False
+                # Still unknown: back to open, probing again on the next request
+                self.state = OPEN
+                self.opened_at = time.monotonic() - CIRCUIT_OPEN_SECONDS
+
+    def _open(self, now: float):
+        self.state = OPEN
+        self.opened_at = now
+        print(f"⚠️ Circuit open for {self.name}: skipping it for {CIRCUIT_OPEN_SECONDS:.0f}s")
+
+    def health(self) -> dict:
+        now = time.monotonic()
+        with self.lock:
+            self._trim(now)
+            latencies = [latency for _, _, latency in self.calls]
+            failure_rate = self._failure_rate()
+            return {
+                "state": self.state,
+                "score": round(0.0 if self.state == OPEN else 1.0 - failure_rate, 3),
+                "calls": len(self.calls),
+                "failure_rate": round(failure_rate, 3),
+                "latency_p50": _percentile(latencies, 0.5),
+                "latency_p95": _percentile(latencies, 0.95),
+                "retry_in": round(self.retry_in(now), 1)
+            }
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+def get_breaker(name: str, timeout: float = None) -> CircuitBreaker:
+    """
+    The breaker for a provider (as named in fan-out results), created on first
+    use. `timeout` (the provider's request timeout) sets its slow-call threshold.
+    """
+    breaker = _breakers.get(name)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.setdefault(name, CircuitBreaker(name, timeout))
+    if timeout:
+        breaker.timeout = timeout
+    return breaker
+
+def health_report() -> dict:
+    """Health of every provider called so far, by name."""
+    return {name: breaker.health() for name, breaker in list(_breakers.items())}
+
+def reset():
+    """Forget all recorded calls (closes every circuit)."""
+    with _breakers_lock:
+        _breakers.clear()
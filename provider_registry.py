@@ -0,0 +1,205 @@
+"""
+Provider registry: one descriptor per selectable model (built-ins from
+config.py, custom ones from custom_providers.json) and a single dispatch path
+that turns descriptors into provider calls. Used by the API, the Streamlit app
+and the legacy backend so every front end dispatches (and is pooled, rate
+limited and circuit-broken) the same way.
+"""
+import asyncio
+import json
+import os
+import threading
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import llm_providers
+from provider_health import get_breaker
+
+# Import centralized config for portability
+try:
+    from config import CUSTOM_PROVIDERS_FILE, API_TIMEOUT, OLLAMA_TIMEOUT, PROVIDER_COSTS
+except ImportError:
+    CUSTOM_PROVIDERS_FILE = "custom_providers.json"
+    API_TIMEOUT = 30.0
+    OLLAMA_TIMEOUT = 60.0
+    PROVIDER_COSTS = {}
+
+@dataclass(frozen=True)
+class ProviderSpec:
+    """How to reach one model. `label` is what users select, `name` keys its answer."""
+    label: str
+    name: str
+    kind: str  # openai, anthropic, gemini, perplexity, g4f, ollama or openai_compatible
+    model: str
+    endpoint: str = ""
+    api_key: str = ""  # custom providers; built-ins read their key from the environment per call
+    api_key_env: str = ""
+    timeout: float = API_TIMEOUT
+    streaming: bool = True  # False: stream() yields the fetched answer as one chunk
+    online: bool = True
+    cost: Tuple[float, float] = (0.0, 0.0)  # USD per 1K prompt / completion tokens
+
+    def key(self) -> str:
+        """The API key to call with; read per call so rotated keys in the environment are picked up."""
+        return os.getenv(self.api_key_env, "") if self.api_key_env else self.api_key
+
+    def estimate_cost(self, prompt_tokens: int, completion_tokens: int) -> float:
+        return (prompt_tokens * self.cost[0] + completion_tokens * self.cost[1]) / 1000
+
+def _cost(name: str) -> Tuple[float, float]:
+    prices = PROVIDER_COSTS.get(name) or (0.0, 0.0)
+    return float(prices[0]), float(prices[1])
+
+def builtin_providers() -> List[ProviderSpec]:
+    return [
+        ProviderSpec("ChatGPT (OpenAI)", "ChatGPT", "openai", llm_providers.OPENAI_MODEL, llm_providers.OPENAI_URL,
+                     api_key_env="OPENAI_API_KEY", cost=_cost("ChatGPT")),
+        ProviderSpec("Claude (Anthropic)", "Claude", "anthropic", llm_providers.ANTHROPIC_MODEL, llm_providers.ANTHROPIC_URL,
+                     api_key_env="ANTHROPIC_API_KEY", cost=_cost("Claude")),
+        ProviderSpec("Gemini (Google)", "Gemini", "gemini", llm_providers.GEMINI_MODEL, llm_providers.GEMINI_URL,
+                     api_key_env="GOOGLE_API_KEY", cost=_cost("Gemini")),
+        ProviderSpec("Perplexity", "Perplexity", "perplexity", llm_providers.PERPLEXITY_MODEL, llm_providers.PERPLEXITY_URL,
+                     api_key_env="PERPLEXITY_API_KEY", cost=_cost("Perplexity")),
+        ProviderSpec("Free Web (g4f)", "GPT-4 (Free)", "g4f", "gpt_4", streaming=False),
+    ]
+
+def custom_provider(entry: dict) -> ProviderSpec:
+    """Descriptor of a custom_providers.json entry (as saved by the Streamlit app)."""
+    name = entry["name"]
+    kind = {"g4f_discovered": "g4f", "ollama_discovered": "ollama"}.get(entry.get("type"), "openai_compatible")
+    endpoint = entry.get("base_url", "")
+    if kind == "ollama":
+        endpoint = f"{endpoint.rstrip('/')}/api/generate"
+    return ProviderSpec(
+        label=name,
+        name=name,
+        kind=kind,
+        model=entry["model"],
+        endpoint=endpoint,
+        api_key=entry.get("api_key", ""),
+        timeout=float(entry.get("timeout") or (OLLAMA_TIMEOUT if kind == "ollama" else API_TIMEOUT)),
+        streaming=kind != "g4f",
+        online=kind != "ollama",
+        cost=tuple(entry.get("cost") or _cost(name))
+    )
+
+def ollama_provider(model: str, url: str = None, name: str = None) -> ProviderSpec:
+    """
+    Descriptor of an Ollama model. Without `url` (an /api/generate endpoint to
+    pin it to) each call goes to the least loaded fleet node serving `model`.
+    """
+    return ProviderSpec(
+        label=name or f"Ollama ({model})",
+        name=name or f"Ollama ({model})",
+        kind="ollama",
+        model=model,
+        endpoint=url or "",
+        timeout=OLLAMA_TIMEOUT,
+        online=False
+    )
+
+def load_custom_providers(path: str = None) -> List[ProviderSpec]:
+    path = path or CUSTOM_PROVIDERS_FILE
+    if not os.path.exists(path):
+        return []
+    try:
+        with open(path, "r") as f:
+            entries = json.load(f)
+        return [custom_provider(entry) for entry in entries]
+    except Exception as e:
+        print(f"Warning: could not load custom providers from {path}: {e}")
+        return []
+
+_registry = None
+_registry_mtime = None
+_registry_lock = threading.Lock()
+
+def _custom_mtime():
+    try:
+        return os.path.getmtime(CUSTOM_PROVIDERS_FILE)
+    except OSError:
+        return None
+
+def get_registry() -> Dict[str, ProviderSpec]:
+    """
+    All selectable providers by label, built-ins first. Built once and only
+    rebuilt when custom_providers.json changes on disk.
+    """
+    global _registry, _registry_mtime
+    mtime = _custom_mtime()
+    if _registry is None or mtime != _registry_mtime:
+        with _registry_lock:
+            if _registry is None or mtime != _registry_mtime:
+                registry = {p.label: p for p in builtin_providers()}
+                for p in load_custom_providers():
+                    registry.setdefault(p.label, p)
+                _registry, _registry_mtime = registry, mtime
+    return _registry
+
+def reload_registry():
+    """Drop the cached registry (e.g. after custom providers were saved)."""
+    global _registry
+    with _registry_lock:
+        _registry = None
+
+def resolve(online: List[str] = (), offline: List[str] = ()) -> List[ProviderSpec]:
+    """Descriptors for selected labels (unknown ones are skipped) and Ollama model names."""
+    registry = get_registry()
+    providers = [registry[label] for label in online if label in registry]
+    return providers + [ollama_provider(model) for model in offline]
+
+def find(name: str) -> Optional[ProviderSpec]:
+    """Descriptor by answer name (e.g. "ChatGPT") or label."""
+    registry = get_registry()
+    if name in registry:
+        return registry[name]
+    return next((p for p in registry.values() if p.name == name), None)
+
+# --- Dispatch ---
+# Provider functions are looked up on llm_providers at call time so tests and
+# callers patching them there are honoured. Every path gets the descriptor's
+# endpoint, key and timeout.
+
+def fetch(provider: ProviderSpec, query: str, client=None):
+    """Coroutine returning the provider's answer (or an "Error ..." string)."""
+    kind = provider.kind
+    if kind == "g4f":
+        # g4f picks its own upstream and has no timeout of its own
+        return asyncio.wait_for(llm_providers.fetch_g4f(query, provider.model, provider.name), provider.timeout)
+    if kind == "ollama":
+        return llm_providers.fetch_ollama(query, provider.model, client, url=provider.endpoint, timeout=provider.timeout)
+    if kind == "openai_compatible":
+        return llm_providers.fetch_generic_openai_compatible(query, provider.key(), provider.endpoint, provider.model, provider.name, client,
+                                                             timeout=provider.timeout)
+    return getattr(llm_providers, f"fetch_{kind}")(query, client, model=provider.model, url=provider.endpoint,
+                                                   api_key=provider.key(), timeout=provider.timeout)
+
+async def _one_chunk(answer):
+    yield await answer
+
+def stream(provider: ProviderSpec, query: str, client=None):
+    """Async iterator of the provider's answer chunks (one chunk unless the descriptor supports streaming)."""
+    kind = provider.kind
+    if not provider.streaming:
+        return _one_chunk(fetch(provider, query, client))
+    if kind == "ollama":
+        return llm_providers.stream_ollama(query, provider.model, client, url=provider.endpoint, timeout=provider.timeout)
+    if kind == "openai_compatible":
+        return llm_providers.stream_generic_openai_compatible(query, provider.key(), provider.endpoint, provider.model, provider.name, client,
+                                                              timeout=provider.timeout)
+    return getattr(llm_providers, f"stream_{kind}")(query, client, model=provider.model, url=provider.endpoint,
+                                                    api_key=provider.key(), timeout=provider.timeout)
+
+def build_tasks(providers: List[ProviderSpec], query: str, streaming: bool = False) -> list:
+    """(name, coroutine) pairs for fan_out, or (name, async iterator) pairs for fan_out_stream."""
+    call = stream if streaming else fetch
+    for p in providers:
+        get_breaker(p.name, p.timeout)  # slow-call threshold of fan_out's breaker follows the provider timeout
+    return [(p.name, call(p, query)) for p in providers]
+
+async def gather_responses(query: str, providers: List[ProviderSpec]) -> Dict[str, str]:
+    """Query every provider concurrently and return {name: answer}."""
+    results = await asyncio.gather(*(fetch(p, query) for p in providers), return_exceptions=True)
+    # Fetchers report provider errors as strings; exceptions (e.g. local rate limit refusals) are converted here
+    return {p.name: f"Error ({p.name}): {result}" if isinstance(result, Exception) else result
+            for p, result in zip(providers, results)}
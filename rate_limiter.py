@@ -0,0 +1,157 @@
+"""
+Client-side token buckets per (provider, API key), for requests/min and
+tokens/min, so concurrent fan-outs stay under the upstream quotas instead of
+triggering 429 storms. Callers reserve capacity before each request and wait
+their turn (first come, first served) as long as the wait ends before the
+request deadline (retry_policy.set_deadline, else RATE_LIMIT_MAX_WAIT);
+otherwise they fail fast with RateLimitExceeded.
+
+Limits come from RATE_LIMITS and, when a provider reports its quota in
+x-ratelimit-limit-* / anthropic-ratelimit-*-limit headers, from those
+(scaled by RATE_LIMIT_HEADROOM).
+"""
+import asyncio
+import hashlib
+import threading
+import time
+
+from retry_policy import remaining
+
+# Import centralized config for portability
+try:
+    from config import RATE_LIMITS, RATE_LIMIT_MAX_WAIT, RATE_LIMIT_HEADROOM, RATE_LIMIT_OUTPUT_TOKENS
+except ImportError:
+    RATE_LIMITS = {}
+    RATE_LIMIT_MAX_WAIT = 30.0
+    RATE_LIMIT_HEADROOM = 0.9
+    RATE_LIMIT_OUTPUT_TOKENS = 500
+
+BURST_SECONDS = 10.0  # bucket size: this many seconds worth of the per-minute limit
+MIN_PER_MINUTE = 1.0  # floor for reported limits of 0: one probe a minute picks up the quota once it is restored
+
+class RateLimitExceeded(Exception):
+    """The local quota would only free up after the request deadline."""
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token for English text)."""
+    return len(text) // 4 + 1
+
+class TokenBucket:
+    """
+    Reservation-based token bucket: the level may go negative, which is how
+    much later callers have to wait, so waiters are served in order.
+    """
+    def __init__(self, per_minute: float):
+        self.level = 0.0
+        self.updated = time.monotonic()
+        self.set_rate(per_minute)
+        self.level = self.capacity
+
+    def set_rate(self, per_minute: float):
+        self.per_minute = per_minute
+        self.rate = max(per_minute, MIN_PER_MINUTE) / 60.0
+        self.capacity = max(self.rate * BURST_SECONDS, 1.0)
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_for(self, amount: float, now: float) -> float:
+        self._refill(now)
+        return max(amount - self.level, 0.0) / self.rate
+
+    def take(self, amount: float):
+        self.level -= amount
+
+class RateLimiter:
+    """Requests/min and tokens/min buckets of one (provider, API key)."""
+
+    def __init__(self, name: str, rpm: float = None, tpm: float = None):
+        self.name = name
+        self.buckets = {}
+        self.configured = {"requests": rpm, "tokens": tpm}
+        self.stats = {"requests": 0, "queued": 0, "waited": 0.0, "rejected": 0}
+        self.lock = threading.Lock()
+        for kind, limit in self.configured.items():
+            if limit:
+                self.buckets[kind] = TokenBucket(limit)
+
+    async def acquire(self, tokens: int = 0):
+        """Reserve one request and `tokens` tokens, waiting for them if needed."""
+        amounts = {"requests": 1, "tokens": tokens}
+        with self.lock:
+            now = time.monotonic()
+            wait = max((bucket.wait_for(amounts[kind], now) for kind, bucket in self.buckets.items()), default=0.0)
+            left = remaining()
+            limit = RATE_LIMIT_MAX_WAIT if left is None else min(left, RATE_LIMIT_MAX_WAIT)
+            if wait > limit:
+                self.stats["rejected"] += 1
+                raise RateLimitExceeded(f"{self.name} rate limit: next slot in {wait:.1f}s, past the deadline")
+            for kind, bucket in self.buckets.items():
+                bucket.take(amounts[kind])
+            self.stats["requests"] += 1
+            if wait > 0:
+                self.stats["queued"] += 1
+                self.stats["waited"] = round(self.stats["waited"] + wait, 3)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def settle(self, reserved: int, used: int):
+        """Correct the token reservation with the usage the provider reported."""
+        bucket = self.buckets.get("tokens")
+        if bucket and used:
+            with self.lock:
+                bucket.level = min(bucket.capacity, bucket.level - (used - reserved))
+
+    def observe(self, headers):
+        """Pick up the quota from rate-limit headers unless configured explicitly."""
+        limits = {
+            "requests": headers.get("x-ratelimit-limit-requests") or headers.get("anthropic-ratelimit-requests-limit"),
+            "tokens": headers.get("x-ratelimit-limit-tokens") or headers.get("anthropic-ratelimit-tokens-limit"),
+        }
+        with self.lock:
+            for kind, value in limits.items():
+                if self.configured[kind] or not isinstance(value, str):
+                    continue
+                try:
+                    per_minute = float(value) * RATE_LIMIT_HEADROOM
+                except (TypeError, ValueError):
+                    continue
+                bucket = self.buckets.get(kind)
+                if bucket is None:
+                    self.buckets[kind] = TokenBucket(per_minute)
+                elif bucket.per_minute != per_minute:
+                    bucket.set_rate(per_minute)
+
+    def report(self) -> dict:
+        with self.lock:
+            limits = {f"{kind}_per_minute": round(bucket.per_minute, 1) for kind, bucket in self.buckets.items()}
+            return {**limits, **self.stats}
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def get_limiter(provider: str, api_key: str = None) -> RateLimiter:
+    """The shared limiter of a provider and key (keys are only kept as a hash)."""
+    key_id = hashlib.sha256(api_key.encode()).hexdigest()[:8] if api_key else "-"
+    name = f"{provider}:{key_id}"
+    limiter = _limiters.get(name)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(name)
+            if limiter is None:
+                limits = RATE_LIMITS.get(provider, {})
+                limiter = _limiters[name] = RateLimiter(provider, limits.get("rpm"), limits.get("tpm"))
+    return limiter
+
+def request_tokens(prompt: str) -> int:
+    """Tokens to reserve for a call: the prompt plus the expected answer."""
+    return estimate_tokens(prompt) + RATE_LIMIT_OUTPUT_TOKENS
+
+def limiter_stats() -> dict:
+    return {name: limiter.report() for name, limiter in list(_limiters.items())}
+
+def reset():
+    """Forget all buckets and learned limits."""
+    with _limiters_lock:
+        _limiters.clear()
@@ -0,0 +1,179 @@
+"""
+Retry policy for provider HTTP calls. Rate limits (429) and transient upstream
+errors (5xx, overloaded, connection failures) are retried with decorrelated
+jitter; when the provider says how long to wait (Retry-After, OpenAI
+x-ratelimit-reset-*, Anthropic anthropic-ratelimit-*-reset) that wait is used
+instead. Retries never outlast the request deadline set with set_deadline:
+a wait that would end past it gives up right away with the last response.
+"""
+import asyncio
+import contextvars
+import random
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import httpx
+
+# Import centralized config for portability
+try:
+    from config import RETRY_MAX_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY
+except ImportError:
+    RETRY_MAX_ATTEMPTS = 3
+    RETRY_BASE_DELAY = 0.5
+    RETRY_MAX_DELAY = 20.0
+
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504, 529}  # 529: Anthropic "overloaded"
+RETRY_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError)
+
+# Absolute time.monotonic() by which the current request must be done (None = no deadline)
+_deadline = contextvars.ContextVar("retry_deadline", default=None)
+
+retry_stats = {}
+
+def set_deadline(seconds: float = None):
+    """Bound retries in the current task (and tasks it starts) to `seconds` from now."""
+    _deadline.set(time.monotonic() + seconds if seconds else None)
+
+def remaining() -> float:
+    """Seconds left until the deadline (None without one)."""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+def _stats(provider: str) -> dict:
+    return retry_stats.setdefault(provider, {"requests": 0, "retries": 0, "server_delays": 0, "gave_up": 0, "waited": 0.0})
+
+def _duration(value: str) -> float:
+    """OpenAI reset durations: "20ms", "1s", "6m0s", "1h2m3.5s"."""
+    total, number = 0.0, ""
+    units = {"h": 3600, "m": 60, "s": 1}
+    i = 0
+    while i < len(value):
+        ch = value[i]
+        if ch.isdigit() or ch == ".":
+            number += ch
+        elif value.startswith("ms", i):
+            total += float(number) / 1000
+            number = ""
+            i += 1
+        elif ch in units:
+            total += float(number) * units[ch]
+            number = ""
+        else:
+            raise ValueError(value)
+        i += 1
+    return total + (float(number) if number else 0.0)
+
+def _until(value: str) -> float:
+    """Seconds until an RFC 3339 (Anthropic) or HTTP date."""
+    try:
+        when = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        when = parsedate_to_datetime(value)
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return (when - datetime.now(timezone.utc)).total_seconds()
+
+def server_delay(headers: httpx.Headers):
+    """How long the provider asked us to wait, in seconds, or None."""
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            value = headers["retry-after"]
+            return float(value) if value.replace(".", "", 1).isdigit() else max(_until(value), 0.0)
+        # Exhausted rate-limit buckets report when they refill
+        waits = []
+        for kind in ("requests", "tokens"):
+            if headers.get(f"x-ratelimit-remaining-{kind}") == "0" and f"x-ratelimit-reset-{kind}" in headers:
+                waits.append(_duration(headers[f"x-ratelimit-reset-{kind}"]))
+        for kind in ("requests", "tokens", "input-tokens", "output-tokens"):
+            if headers.get(f"anthropic-ratelimit-{kind}-remaining") == "0" and f"anthropic-ratelimit-{kind}-reset" in headers:
+                waits.append(_until(headers[f"anthropic-ratelimit-{kind}-reset"]))
+        if waits:
+            return max(max(waits), 0.0)
+    except (ValueError, TypeError):
+        pass
+    return None
+
+def next_backoff(previous: float) -> float:
+    """Decorrelated jitter: random between the base delay and 3x the previous wait, capped."""
+    return min(RETRY_MAX_DELAY, random.uniform(RETRY_BASE_DELAY, max(previous, RETRY_BASE_DELAY) * 3))
+
+async def send_with_retry(client: httpx.AsyncClient, method: str, url: str, provider: str, stream: bool = False,
+                          limiter=None, tokens: int = 0, **kwargs) -> httpx.Response:
+    """
+    client.request with retries. Returns the last response (the caller still
+    calls raise_for_status); connection errors of the last attempt are raised.
+    With `stream` the body is not read and the caller must close the response.
+    Every attempt first takes a slot (and `tokens`) from `limiter`, a
+    rate_limiter.RateLimiter, which also learns the quota from the responses.
+    """
+    stats = _stats(provider)
+    stats["requests"] += 1
+    backoff = RETRY_BASE_DELAY
+    for attempt in range(1, RETRY_MAX_ATTEMPTS + 1):
+        error = None
+        if limiter is not None:
+            await limiter.acquire(tokens)
+        try:
+            if stream:
+                response = await client.send(client.build_request(method, url, **kwargs), stream=True)
+            else:
+                response = await client.request(method, url, **kwargs)
+            if limiter is not None:
+                limiter.observe(response.headers)
+            if response.status_code not in RETRY_STATUSES:
+                return response
+        except RETRY_ERRORS as e:
+            error, response = e, None
+
+        hint = server_delay(response.headers) if response is not None else None
+        backoff = next_backoff(backoff)
+        wait = hint if hint is not None else backoff
+        left = remaining()
+        if attempt == RETRY_MAX_ATTEMPTS or wait > RETRY_MAX_DELAY or (left is not None and wait >= left):
+            stats["gave_up"] += 1
+            if error is not None:
+                raise error
+            return response
+
+        if response is not None:
+            await response.aclose()
+        stats["retries"] += 1
+        stats["server_delays"] += hint is not None
+        stats["waited"] = round(stats["waited"] + wait, 3)
+        print(f"⚠️ {provider}: {error or response.status_code}, retry {attempt}/{RETRY_MAX_ATTEMPTS - 1} in {wait:.1f}s")
+        await asyncio.sleep(wait)
+
+@asynccontextmanager
+async def stream_with_retry(client: httpx.AsyncClient, method: str, url: str, provider: str, limiter=None, tokens: int = 0, **kwargs):
+    """Like client.stream, retrying the request until the response headers look good."""
+    response = await send_with_retry(client, method, url, provider, stream=True, limiter=limiter, tokens=tokens, **kwargs)
+    try:
+        yield response
+    finally:
+        await response.aclose()
+
+async def retry_call(call, provider: str, retryable: tuple):
+    """
+    Retry an arbitrary coroutine factory (e.g. a g4f call) on `retryable`
+    exceptions with decorrelated jitter, within the same attempt and deadline limits.
+    """
+    stats = _stats(provider)
+    stats["requests"] += 1
+    backoff = RETRY_BASE_DELAY
+    for attempt in range(1, RETRY_MAX_ATTEMPTS + 1):
+        try:
+            return await call()
+        except retryable as e:
+            backoff = next_backoff(backoff)
+            left = remaining()
+            if attempt == RETRY_MAX_ATTEMPTS or (left is not None and backoff >= left):
+                stats["gave_up"] += 1
+                raise
+            stats["retries"] += 1
+            stats["waited"] = round(stats["waited"] + backoff, 3)
+            print(f"⚠️ {provider}: {e}, retry {attempt}/{RETRY_MAX_ATTEMPTS - 1} in {backoff:.1f}s")
+            await asyncio.sleep(backoff)
@@ -0,0 +1,84 @@
+"""
+Single-flight request coalescing: concurrent callers asking for the same key
+share one run of the underlying async event stream instead of each starting
+their own. Every subscriber receives the full event sequence, including the
+events emitted before it joined.
+"""
+import asyncio
+from typing import AsyncIterator, Callable, Hashable
+
+class Flight:
+    """One shared run of an async event stream with any number of subscribers."""
+
+    def __init__(self, source: AsyncIterator):
+        self.events = []
+        self.done = False
+        self.error = None
+        self.subscribers = 0
+        self._changed = asyncio.Condition()
+        self.task = asyncio.ensure_future(self._run(source))
+
+    async def _run(self, source: AsyncIterator):
+        try:
+            async for event in source:
+                self.events.append(event)
+                async with self._changed:
+                    self._changed.notify_all()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            async with self._changed:
+                self._changed.notify_all()
+
+    async def subscribe(self):
+        """
+        Replay the events so far, then follow the live stream until it ends.
+        The shared run is cancelled when its last subscriber leaves early.
+        """
+        self.subscribers += 1
+        index = 0
+        try:
+            while True:
+                while index < len(self.events):
+                    yield self.events[index]
+                    index += 1
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                async with self._changed:
+                    await self._changed.wait_for(lambda: index < len(self.events) or self.done)
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self.done:
+                self.task.cancel()
+
+class SingleFlight:
+    """Registry of in-flight runs keyed by request identity."""
+
+    def __init__(self):
+        self._flights = {}
+
+    def subscribe(self, key: Hashable, factory: Callable[[], AsyncIterator]):
+        """
+        Join the in-flight run for `key`, or start one with `factory()` if there
+        is none, and return an async iterator over its events.
+        """
+        flight = self._flights.get(key)
+        if flight is None or flight.done:
+            flight = Flight(factory())
+            self._flights[key] = flight
+
+            def forget(_task, key=key, flight=flight):
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+
+            flight.task.add_done_callback(forget)
+        return flight.subscribe()
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._flights),
+            "subscribers": sum(f.subscribers for f in self._flights.values())
+        }
@@ -0,0 +1,18 @@
+import os
+import tempfile
+
+# Keep the test suite away from the real memory store (set before config is imported)
+os.environ.setdefault("MEMORY_DB_PATH", tempfile.mkdtemp(prefix="nexus_memory_"))
+
+import pytest
+import provider_health
+import rate_limiter
+
+@pytest.fixture(autouse=True)
+def fresh_provider_state():
+    # Failures or quotas simulated by one test must not throttle the providers of the next
+    provider_health.reset()
+    rate_limiter.reset()
+    yield
+    provider_health.reset()
+    rate_limiter.reset()
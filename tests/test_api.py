@@ -2,6 +2,10 @@ import pytest
 from fastapi.testclient import TestClient
 import sys
 import os
+import asyncio
+import json
+import httpx
+from unittest.mock import AsyncMock, MagicMock, patch
 
 # Add parent directory to path to import api
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -35,3 +39,164 @@ def test_cors_headers():
     assert response.status_code == 200
     assert response.headers["access-control-allow-origin"] == "*"
     assert response.headers["access-control-allow-methods"] == "*"
+
+def test_metrics():
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert "http_pool" in response.json()
+    assert "retries" in response.json()
+
+def test_chat_quorum_reports_dropped_models():
+    async def fast(query, client=None, **kwargs):
+        return "Fast answer"
+
+    async def slow(query, client=None, **kwargs):
+        await asyncio.sleep(5)
+        return "Slow answer"
+
+    with patch("llm_providers.fetch_openai", fast), patch("llm_providers.fetch_anthropic", slow), \
+         patch("api.synthesize_responses", AsyncMock(return_value="Final")) as mock_synth:
+        response = client.post("/chat", json={
+            "query": "Hi",
+            "online_models": ["ChatGPT (OpenAI)", "Claude (Anthropic)"],
+            "use_memory": False,
+            "quorum": 1
+        })
+
+    data = response.json()
+    assert data["final_answer"] == "Final"
+    assert data["dropped_models"] == ["Claude"]
+    assert data["individual_responses"]["Claude"].startswith("Dropped")
+    # Dropped models are not passed to the synthesizer
+    assert "Claude" not in mock_synth.call_args.args[1]
+
+def test_chat_semantic_cache_hit_skips_providers():
+    cache = MagicMock()
+    cache.cache_key.return_value = "key"
+    cache.lookup.return_value = {
+        "final_answer": "Cached answer",
+        "individual_responses": {"ChatGPT": "Earlier answer"},
+        "similarity": 0.99,
+        "cached_query": "hi"
+    }
+    fetch = AsyncMock(return_value="Fresh answer")
+
+    with patch("api.CACHE_AVAILABLE", True), patch("api.response_cache", cache), patch("llm_providers.fetch_openai", fetch):
+        response = client.post("/chat", json={"query": "Hi", "online_models": ["ChatGPT (OpenAI)"], "use_memory": False})
+
+    data = response.json()
+    assert data["cached"] is True
+    assert data["final_answer"] == "Cached answer"
+    fetch.assert_not_called()
+    cache.cache_key.assert_called_once_with(["ChatGPT (OpenAI)"], [], "llama3")
+
+@pytest.mark.asyncio
+async def test_concurrent_identical_chats_share_one_fan_out():
+    calls = 0
+
+    async def slow(query, client=None, **kwargs):
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.1)
+        return "Answer"
+
+    payload = {"query": "Trending question", "online_models": ["ChatGPT (OpenAI)"], "use_memory": False, "use_cache": False}
+    transport = httpx.ASGITransport(app=app)
+    with patch("llm_providers.fetch_openai", slow), patch("api.synthesize_responses", AsyncMock(return_value="Final")):
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            first, second = await asyncio.gather(
+                http.post("/chat", json=payload),
+                http.post("/chat", json={**payload, "query": "  trending QUESTION "})
+            )
+
+    assert calls == 1
+    assert first.json() == second.json()
+    assert first.json()["final_answer"] == "Final"
+
+def test_history_stream_is_ndjson():
+    items = [{"id": "a", "query": "q1"}, {"id": "b", "query": "q2"}]
+    with patch("api.MEMORY_AVAILABLE", True), patch("api.iter_history", MagicMock(return_value=iter(items))) as history:
+        response = client.get("/history/stream?fields=id,query")
+
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    assert [json.loads(line) for line in response.text.splitlines()] == items
+    assert history.call_args.kwargs["fields"] == ("id", "query")
+
+def test_history_rejects_unknown_fields():
+    with patch("api.MEMORY_AVAILABLE", True):
+        response = client.get("/history?fields=id,embedding")
+    assert response.status_code == 400
+
+def test_chat_skips_synthesis_when_models_agree():
+    async def openai(query, client=None, **kwargs):
+        return "Paris is the capital of France."
+
+    async def anthropic(query, client=None, **kwargs):
+        return "The capital of France is Paris."
+
+    same_vector = lambda texts: [[1.0, 0.0] for _ in texts]  # embeddings of two wordings of one answer
+    with patch("llm_providers.fetch_openai", openai), patch("llm_providers.fetch_anthropic", anthropic), \
+         patch("consensus.is_warm", lambda: True), patch("consensus.embed", same_vector), \
+         patch("api.synthesize_responses", AsyncMock(return_value="Final")) as mock_synth:
+        response = client.post("/chat", json={
+            "query": "Capital of France?",
+            "online_models": ["ChatGPT (OpenAI)", "Claude (Anthropic)"],
+            "use_memory": False,
+            "use_cache": False
+        })
+
+    data = response.json()
+    mock_synth.assert_not_called()
+    assert data["final_answer"] in ("Paris is the capital of France.", "The capital of France is Paris.")
+    assert data["agreement"]["synthesis_skipped"] is True
+
+def test_chat_synthesizes_contradicting_short_answers():
+    async def openai(query, client=None, **kwargs):
+        return "Yes, it is safe to take ibuprofen with food."
+
+    async def anthropic(query, client=None, **kwargs):
+        return "No, it is not safe to take ibuprofen with food."
+
+    # Before the embedding model is loaded only word overlap is available
+    with patch("llm_providers.fetch_openai", openai), patch("llm_providers.fetch_anthropic", anthropic), \
+         patch("consensus.is_warm", lambda: False), \
+         patch("api.synthesize_responses", AsyncMock(return_value="Final")) as mock_synth:
+        response = client.post("/chat", json={
+            "query": "Is it safe to take ibuprofen with food?",
+            "online_models": ["ChatGPT (OpenAI)", "Claude (Anthropic)"],
+            "use_memory": False,
+            "use_cache": False
+        })
+
+    data = response.json()
+    mock_synth.assert_called_once()
+    assert len(mock_synth.call_args.args[1]) == 2  # both answers, untrimmed
+    assert data["final_answer"] == "Final"
+    assert data["agreement"]["synthesis_skipped"] is False
+
+def test_models_report_provider_health():
+    async def down(query, client=None, **kwargs):
+        return "Error (OpenAI): 503"
+
+    with patch("llm_providers.fetch_openai", down), patch("api.synthesize_responses", AsyncMock(return_value="Final")):
+        client.post("/chat", json={"query": "Hi", "online_models": ["ChatGPT (OpenAI)"], "use_memory": False, "use_cache": False})
+
+    health = client.get("/models").json()["health"]
+    assert health["ChatGPT"]["calls"] == 1
+    assert health["ChatGPT"]["failure_rate"] == 1.0
+
+def test_models_served_from_fleet_discovery_cache():
+    nodes = [
+        {"name": "Local", "url": "http://localhost:11434", "reachable": True, "models": ["llama3"], "error": None, "age": 3.0},
+        {"name": "Attic", "url": "http://10.0.0.5:11434", "reachable": True, "models": ["llama3", "mistral"], "error": None, "age": 3.0},
+        {"name": "Down", "url": "http://10.0.0.6:11434", "reachable": False, "models": ["phi3"], "error": "timeout", "age": 3.0},
+    ]
+    with patch("api.fleet.inventory", return_value=nodes):
+        data = client.get("/models").json()
+    assert data["offline"] == ["llama3", "mistral"]
+    assert data["nodes"] == nodes
+
+@pytest.mark.parametrize("field", ["quorum", "deadline_ms"])
+def test_chat_rejects_non_positive_quorum_and_deadline(field):
+    response = client.post("/chat", json={"query": "Hi", "online_models": ["ChatGPT (OpenAI)"], field: -1})
+    assert response.status_code == 422
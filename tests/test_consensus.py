@@ -0,0 +1,73 @@
+import pytest
+import consensus
+
+@pytest.fixture(autouse=True)
+def word_overlap(monkeypatch):
+    # Jaccard path: the embedding model is never loaded in tests
+    monkeypatch.setattr(consensus, "is_warm", lambda: False)
+
+def bag_of_words(texts):
+    # Stand-in for MiniLM: word count vectors (word order doesn't matter)
+    vectors = []
+    for text in texts:
+        vector = [0.0] * 64
+        for word in consensus._words(text):
+            vector[hash(word) % 64] += 1.0
+        vectors.append(vector)
+    return vectors
+
+@pytest.fixture
+def embeddings(monkeypatch):
+    monkeypatch.setattr(consensus, "is_warm", lambda: True)
+    monkeypatch.setattr(consensus, "embed", bag_of_words)
+
+def test_near_identical_answers_skip_synthesis(embeddings):
+    result = consensus.find_consensus({
+        "ChatGPT": "Paris is the capital of France.",
+        "Claude": "The capital of France is Paris.",
+        "Gemini": "Error (Google): quota exceeded"
+    })
+    assert result["method"] == "embedding"
+    assert result["models"] == ["ChatGPT", "Claude"]
+    assert result["agreement"] >= consensus.CONSENSUS_THRESHOLD
+    assert result["answer"] == "Paris is the capital of France."
+    assert result["responses"] is None
+
+def test_word_overlap_only_reports_agreement():
+    answers = {"ChatGPT": "Paris is the capital of France.", "Claude": "The capital of France is Paris."}
+    result = consensus.find_consensus(answers)
+    assert result["method"] == "jaccard"
+    assert result["agreement"] == 1.0
+    assert result["answer"] is None
+    assert result["responses"] == answers
+
+@pytest.mark.parametrize("a, b", [
+    ("The answer is 42.", "The answer is 41."),
+    ("Yes, it is safe to take ibuprofen with food.", "No, it is not safe to take ibuprofen with food."),
+    ("The meeting is on Monday at 10am in room 4.", "The meeting is on Tuesday at 10am in room 4."),
+])
+def test_contradicting_answers_are_never_skipped(a, b):
+    result = consensus.find_consensus({"A": a, "B": b})
+    assert result["answer"] is None
+    assert result["responses"] == {"A": a, "B": b}
+
+def test_disagreement_keeps_only_novel_paragraphs(embeddings):
+    shared = "Paris is the capital of France."
+    result = consensus.find_consensus({
+        "ChatGPT": f"{shared}\n\nIt has about two million inhabitants.",
+        "Claude": f"{shared}\n\nThe Seine river flows through the city center."
+    })
+    assert result["answer"] is None
+    best = result["best"]
+    other = next(m for m in result["models"] if m != best)
+    assert result["responses"][best].startswith(shared)
+    assert shared not in result["responses"][other]
+
+def test_needs_two_usable_answers():
+    assert consensus.find_consensus({"ChatGPT": "Paris", "Claude": "Error: timeout"}) is None
+
+def test_agreement_summary_is_json_friendly():
+    result = consensus.find_consensus({"A": "yes indeed", "B": "yes indeed"})
+    summary = consensus.agreement_summary(result, skipped=True)
+    assert summary["matrix"] == [[1.0, 1.0], [1.0, 1.0]]
+    assert summary["synthesis_skipped"] is True
@@ -0,0 +1,137 @@
+import asyncio
+import time
+import httpx
+import pytest
+import fleet as fleet_module
+import llm_providers
+import provider_health
+from fleet import Fleet
+from provider_health import CircuitOpenError
+
+def make_fleet(strategy="least_outstanding"):
+    f = Fleet(strategy)
+    f.add_node("A", "http://a:11434", models=["llama3"])
+    f.add_node("B", "http://b:11434/api/generate", models=["llama3", "mistral"])
+    return f
+
+def test_pick_least_outstanding_replica():
+    f = make_fleet()
+    first = f.pick("llama3")
+    second = f.pick("llama3")
+    assert {first.name, second.name} == {"A", "B"}
+
+    f.release(first, "llama3", True, 1.0)
+    assert f.pick("llama3") is first
+    # Only B serves mistral
+    assert f.pick("mistral").name == "B"
+    assert f.pick("phi3") is None
+
+def test_undiscovered_nodes_only_used_without_known_replicas():
+    f = make_fleet()
+    f.add_node("New", "http://new:11434")
+    assert f.pick("llama3").name in ("A", "B")
+    assert f.pick("phi3").name == "New"
+
+def test_weight_and_ewma_strategies():
+    f = make_fleet()
+    f.add_node("A", "http://a:11434", weight=3, models=["llama3"])
+    picks = [f.pick("llama3").name for _ in range(4)]
+    assert picks.count("A") == 3
+
+    f = make_fleet("ewma")
+    a, b = f.nodes["http://a:11434"], f.nodes["http://b:11434"]
+    a.ewma, b.ewma = 4.0, 1.0
+    assert f.pick("llama3") is b
+    assert f.pick("llama3") is b  # 1s x 2 queued still beats 4s x 1
+    assert f.pick("llama3") is b
+    assert f.pick("llama3") is a
+
+@pytest.mark.asyncio
+async def test_failing_node_drops_out_of_the_pool(monkeypatch):
+    monkeypatch.setattr(provider_health, "CIRCUIT_MIN_CALLS", 2)
+    f = make_fleet()
+    f.nodes["http://b:11434"].ewma = 10.0  # A is preferred while healthy
+
+    for _ in range(2):
+        with pytest.raises(httpx.ConnectError):
+            async with f.route("llama3") as url:
+                assert url == "http://a:11434/api/generate"
+                raise httpx.ConnectError("down")
+
+    async with f.route("llama3") as url:
+        assert url == "http://b:11434/api/generate"
+    stats = f.stats()
+    assert stats["A"]["failures"] == 2 and stats["A"]["outstanding"] == 0
+    assert stats["B"]["requests"] == 1
+
+@pytest.mark.asyncio
+async def test_pinned_and_fallback_routes():
+    f = make_fleet()
+    async with f.route("llama3", "http://b:11434/api/generate") as url:
+        assert url == "http://b:11434/api/generate"
+        assert f.nodes["http://b:11434"].outstanding == 1
+    async with f.route("phi3") as url:
+        assert url == f"{fleet_module.OLLAMA_BASE_URL}/api/generate"
+
+@pytest.mark.asyncio
+async def test_route_fails_fast_when_every_replica_is_open(monkeypatch):
+    monkeypatch.setattr(provider_health, "CIRCUIT_MIN_CALLS", 1)
+    f = make_fleet()
+    for node in f.nodes.values():
+        node.breaker("mistral").record(False, 1.0)
+
+    with pytest.raises(CircuitOpenError):
+        async with f.route("mistral"):
+            pass
+    # llama3 breakers are separate and still closed
+    async with f.route("llama3") as url:
+        assert url.startswith(("http://a:", "http://b:"))
+
+@pytest.mark.asyncio
+async def test_fetch_ollama_spreads_concurrent_requests(monkeypatch):
+    monkeypatch.setattr(llm_providers, "fleet", make_fleet())
+    hosts = []
+
+    async def handler(request):
+        hosts.append(request.url.host)
+        await asyncio.sleep(0.05)
+        return httpx.Response(200, json={"response": f"from {request.url.host}"})
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        answers = await asyncio.gather(*(llm_providers.fetch_ollama("Hi", "llama3", client) for _ in range(4)))
+
+    assert sorted(hosts) == ["a", "a", "b", "b"]
+    assert set(answers) == {"from a", "from b"}
+
+@pytest.mark.asyncio
+async def test_refresh_probes_nodes_concurrently():
+    f = make_fleet()
+    f.add_node("Down", "http://down:11434", models=["llama3"])
+
+    async def handler(request):
+        await asyncio.sleep(0.2)
+        if request.url.host == "down":
+            raise httpx.ConnectError("unreachable")
+        return httpx.Response(200, json={"models": [{"name": "phi3"}, {"name": "llama3"}]})
+
+    start = asyncio.get_event_loop().time()
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        await f.refresh(client)
+    assert asyncio.get_event_loop().time() - start < 0.35
+
+    inventory = {node["name"]: node for node in f.inventory()}
+    assert inventory["A"]["models"] == ["llama3", "phi3"] and inventory["A"]["reachable"]
+    assert inventory["Down"]["reachable"] is False and "unreachable" in inventory["Down"]["error"]
+    # Unreachable nodes leave the pools
+    assert {f.pick("llama3").name for _ in range(4)} == {"A", "B"}
+
+def test_inventory_serves_stale_cache_while_refreshing(monkeypatch):
+    f = make_fleet()
+    for node in f.nodes.values():
+        node.reachable, node.checked_at = True, time.monotonic() - 3600  # long expired
+    started = []
+    monkeypatch.setattr(f, "refresh_in_background", lambda: started.append(True))
+
+    inventory = f.inventory()
+    assert started == [True]
+    assert [node["models"] for node in inventory] == [["llama3"], ["llama3", "mistral"]]
@@ -0,0 +1,200 @@
+import gzip
+import json
+import threading
+from datetime import datetime
+import pytest
+from unittest.mock import MagicMock
+
+memory = pytest.importorskip("agents.memory")
+
+@pytest.fixture
+def fake_store(monkeypatch):
+    client = MagicMock()
+    monkeypatch.setattr(memory, "_chroma_client", client)
+    monkeypatch.setattr(memory, "_embedding_function", MagicMock(side_effect=lambda texts: [[float(len(t)), 1.0] for t in texts]))
+    monkeypatch.setattr(memory, "_collections", {})
+    monkeypatch.setattr(memory, "_embedding_cache", memory.OrderedDict())
+    monkeypatch.setattr(memory, "_embedding_db", None)
+    monkeypatch.setattr(memory, "EMBEDDING_CACHE_PATH", "")
+    return client
+
+def test_collection_is_created_once_and_shared(fake_store):
+    assert memory.get_collection() is memory.get_collection()
+    assert memory.collection is memory.get_collection()
+    fake_store.get_or_create_collection.assert_called_once()
+
+def test_embeddings_are_computed_once_per_text(fake_store):
+    assert memory.embed(["a", "bb", "a"]) == [[1.0, 1.0], [2.0, 1.0], [1.0, 1.0]]
+    assert memory.embed(["bb"]) == [[2.0, 1.0]]
+    memory._embedding_function.assert_called_once_with(["a", "bb"])
+
+def test_embeddings_persist_on_disk(fake_store, monkeypatch, tmp_path):
+    monkeypatch.setattr(memory, "EMBEDDING_CACHE_PATH", str(tmp_path / "embeddings.sqlite3"))
+    memory.embed(["hello"])
+    # Fresh in-memory cache (as after a restart): served from SQLite
+    monkeypatch.setattr(memory, "_embedding_cache", memory.OrderedDict())
+    monkeypatch.setattr(memory, "_embedding_db", None)
+    assert memory.embed(["hello"]) == [[5.0, 1.0]]
+    memory._embedding_function.assert_called_once()
+    memory._embedding_db.close()
+
+def test_concurrent_first_use_initializes_once(fake_store):
+    threads = [threading.Thread(target=memory.get_collection) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    fake_store.get_or_create_collection.assert_called_once()
+
+@pytest.mark.asyncio
+async def test_aretrieve_context_runs_off_the_event_loop(fake_store, monkeypatch):
+    from agents import retrieval
+    loop_thread = threading.get_ident()
+    seen = {}
+
+    def search(query, max_results=None, max_tokens=None):
+        seen["thread"] = threading.get_ident()
+        return [("id1", "Question: q\nAnswer: a")]
+
+    monkeypatch.setattr(retrieval, "hybrid_search", search)
+    context = await memory.aretrieve_context("q")
+    assert "[Memory 1]: Question: q" in context
+    assert seen["thread"] != loop_thread
+
+def test_enqueued_pairs_are_written_in_background(fake_store):
+    assert memory.enqueue_memory("q", "a", "Test")
+    memory.flush_memory()
+    kwargs = memory.get_collection().add.call_args.kwargs
+    assert kwargs["metadatas"][0]["query"] == "q"
+
+def test_queued_pairs_are_saved_in_one_batch(fake_store, monkeypatch):
+    monkeypatch.setattr(memory, "MEMORY_FLUSH_INTERVAL", 30.0)
+    for i in range(3):
+        assert memory.enqueue_memory(f"q{i}", "a", "Test")
+    memory.flush_memory()
+    add = memory.get_collection().add
+    add.assert_called_once()
+    assert [m["query"] for m in add.call_args.kwargs["metadatas"]] == ["q0", "q1", "q2"]
+    assert len(set(add.call_args.kwargs["ids"])) == 3
+
+class PagedCollection:
+    """Minimal stand-in for collection.get(limit=, offset=) paging and get(ids=)."""
+    def __init__(self, records):
+        self.records = records
+        self.calls = 0
+
+    def get(self, ids=None, include=None, limit=None, offset=0):
+        self.calls += 1
+        if ids is not None:
+            page = [r for r in self.records if r[0] in ids][::-1]  # order is not guaranteed
+        else:
+            page = self.records[offset:offset + limit]
+        return {"ids": [r[0] for r in page], "metadatas": [r[1] for r in page]}
+
+@pytest.fixture(autouse=True)
+def fresh_history_index(monkeypatch):
+    monkeypatch.setattr(memory, "_history_keys", None)
+
+def make_records(n):
+    return [(f"id{i}", {"query": f"q{i}", "answer": "a", "source": "Test", "timestamp": f"2024-01-01T00:00:{i:02d}"}) for i in range(n)]
+
+def test_history_is_paged_newest_first(monkeypatch):
+    collection = PagedCollection(make_records(7))
+    monkeypatch.setattr(memory, "get_collection", lambda: collection)
+    monkeypatch.setattr(memory, "MEMORY_PAGE_SIZE", 3)
+
+    items, cursor = memory.get_history(limit=3)
+    assert [i["id"] for i in items] == ["id6", "id5", "id4"]
+    assert collection.calls == 4  # index built by one 3-page scan, then one read of the page
+    items, cursor = memory.get_history(limit=3, before=cursor)
+    assert [i["id"] for i in items] == ["id3", "id2", "id1"]
+    items, cursor = memory.get_history(limit=3, before=cursor, fields=("query",))
+    assert items == [{"query": "q0"}]
+    assert cursor is None
+    assert collection.calls == 6  # later pages only read their own items
+
+def test_history_index_follows_writes(fake_store, monkeypatch):
+    collection = PagedCollection(make_records(3))
+    collection.add = lambda ids, metadatas, **kwargs: collection.records.extend(zip(ids, metadatas))
+    monkeypatch.setattr(memory, "get_collection", lambda: collection)
+    memory.get_history(limit=1)
+
+    memory.add_many_to_memory([("late", "a", "Test")], ["2024-01-02T00:00:00"])
+    items, _ = memory.get_history(limit=2)
+    assert [i["query"] for i in items] == ["late", "q2"]
+    memory._index_history(deleted=["Test_2024-01-02T00:00:00"])
+    items, _ = memory.get_history(limit=1)
+    assert [i["query"] for i in items] == ["q2"]
+
+def test_history_oldest_first_after_timestamp(monkeypatch):
+    monkeypatch.setattr(memory, "get_collection", lambda: PagedCollection(make_records(5)))
+    items, _ = memory.get_history(limit=2, after="2024-01-01T00:00:01", newest_first=False)
+    assert [i["id"] for i in items] == ["id2", "id3"]
+    assert [i["id"] for i in memory.iter_history(after="2024-01-01T00:00:02")] == ["id4", "id3"]
+
+def test_iter_history_is_newest_first_in_pages(monkeypatch):
+    collection = PagedCollection(make_records(7))
+    monkeypatch.setattr(memory, "get_collection", lambda: collection)
+    monkeypatch.setattr(memory, "MEMORY_PAGE_SIZE", 3)
+    memory._history_index()
+    collection.calls = 0
+
+    assert [i["id"] for i in memory.iter_history(before="2024-01-01T00:00:06")] == [f"id{i}" for i in range(5, -1, -1)]
+    assert collection.calls == 2
+
+def read_jsonl(path):
+    opener = gzip.open if str(path).endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+def test_export_is_paged_and_incremental(monkeypatch, tmp_path):
+    records = make_records(4)
+    collection = PagedCollection(records)
+    monkeypatch.setattr(memory, "get_collection", lambda: collection)
+    monkeypatch.setattr(memory, "MEMORY_PAGE_SIZE", 3)
+    output = str(tmp_path / "data.jsonl")
+
+    assert memory.export_dataset(output, compression="gzip") == f"Exported 4 items to {output}.gz"
+    assert collection.calls == 2
+
+    records.append(("id9", {"query": "new", "answer": "a", "source": "Test", "timestamp": "2024-01-02T00:00:00"}))
+    assert memory.export_dataset(output, compression="gzip", incremental=True).startswith("Exported 1 new items")
+    assert memory.export_dataset(output, compression="gzip", incremental=True) == "No new data to export."
+    assert [e["instruction"] for e in read_jsonl(output + ".gz")] == ["q0", "q1", "q2", "q3", "new"]
+
+@pytest.fixture
+def real_collection(monkeypatch, tmp_path):
+    import chromadb
+    client = chromadb.PersistentClient(path=str(tmp_path))
+    collection = client.get_or_create_collection("compaction_test", embedding_function=None)
+    monkeypatch.setattr(memory, "get_collection", lambda: collection)
+    monkeypatch.setattr(memory, "MEMORY_DB_PATH", str(tmp_path))
+    return collection
+
+def add_entry(collection, doc_id, vector, timestamp, source="Synthesized", answer="a"):
+    collection.add(ids=[doc_id], embeddings=[vector], documents=[doc_id],
+                   metadatas=[{"query": doc_id, "answer": answer, "source": source, "timestamp": timestamp}])
+
+def test_compaction_keeps_newest_of_near_duplicates(real_collection):
+    add_entry(real_collection, "old", [1.0, 0.0, 0.01], "2024-01-01T00:00:00")
+    add_entry(real_collection, "new", [1.0, 0.0, 0.0], "2024-02-01T00:00:00")
+    add_entry(real_collection, "newest-error", [1.0, 0.0, 0.0], "2024-03-01T00:00:00", answer="Error: timeout")
+    add_entry(real_collection, "other", [0.0, 1.0, 0.0], "2024-01-15T00:00:00")
+
+    report = memory.compact_memory(similarity=0.99, retention={})
+    assert report["duplicates"] == 2
+    assert sorted(real_collection.get()["ids"]) == ["new", "other"]
+
+def test_compaction_applies_retention_per_source(real_collection):
+    recent = datetime.now().isoformat()
+    add_entry(real_collection, "ancient", [1.0, 0.0], "2000-01-01T00:00:00")
+    add_entry(real_collection, "m1", [0.0, 1.0], "2024-01-01T00:00:00", source="Mobile")
+    add_entry(real_collection, "m2", [0.0, -1.0], recent, source="Mobile")
+
+    retention = {"*": {"max_age_days": 365}, "Mobile": {"max_count": 1}}
+    report = memory.compact_memory(similarity=0.99, retention=retention, dry_run=True)
+    assert (report["expired"], report["over_limit"], report["removed"]) == (1, 1, 2)
+    assert real_collection.count() == 3
+
+    memory.compact_memory(similarity=0.99, retention=retention)
+    assert real_collection.get()["ids"] == ["m2"]
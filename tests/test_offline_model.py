@@ -0,0 +1,197 @@
+import pytest
+import asyncio
+from unittest.mock import AsyncMock, patch
+import offline_model
+
+RESPONSES = {"ChatGPT": "Paris is the capital of France.", "Claude": "Error (Anthropic): timeout"}
+
+async def collect(stream):
+    return [chunk async for chunk in stream]
+
+def test_build_synthesis_prompt_skips_errors():
+    prompt = offline_model.build_synthesis_prompt("Capital of France?", RESPONSES, context="Known fact")
+    assert "--- ChatGPT Response ---" in prompt
+    assert "Claude" not in prompt
+    assert "RELEVANT KNOWLEDGE FROM MEMORY" in prompt
+    assert offline_model.build_synthesis_prompt("Q", {"A": "Error: down"}) is None
+
+@pytest.mark.asyncio
+async def test_synthesize_stream_falls_back_before_first_token():
+    async def ollama_down(*args, **kwargs):
+        raise ConnectionError("refused")
+        yield
+
+    async def cloud(prompt):
+        yield "Par"
+        yield "is"
+
+    with patch("offline_model.stream_ollama", ollama_down), \
+         patch("offline_model._stream_openai_synthesis", cloud), \
+         patch.dict("os.environ", {"OPENAI_API_KEY": "sk-test"}):
+        chunks = await collect(offline_model.synthesize_responses_stream("Q", RESPONSES))
+
+    assert chunks[0].startswith("**(Synthesized via Cloud Fallback)**")
+    assert "".join(chunks[1:]) == "Paris"
+
+@pytest.mark.asyncio
+async def test_synthesize_stream_does_not_switch_after_tokens():
+    async def ollama_flaky(*args, **kwargs):
+        yield "Par"
+        raise ConnectionError("reset")
+
+    async def cloud(prompt):
+        raise AssertionError("fallback must not start after tokens were emitted")
+        yield
+
+    with patch("offline_model.stream_ollama", ollama_flaky), \
+         patch("offline_model._stream_openai_synthesis", cloud):
+        chunks = await collect(offline_model.synthesize_responses_stream("Q", RESPONSES))
+
+    assert chunks[0] == "Par"
+    assert "Synthesis interrupted" in chunks[-1]
+
+@pytest.mark.asyncio
+async def test_synthesize_stream_without_valid_responses():
+    chunks = await collect(offline_model.synthesize_responses_stream("Q", {"A": "Error: down"}))
+    assert chunks == [offline_model.NO_VALID_RESPONSES]
+
+def test_prompt_budget_trims_and_dedupes():
+    shared = "Paris has been the capital of France since 987."
+    responses = {
+        "ChatGPT": shared + "\n\n" + "Long detail about Paris. " * 400,
+        "Claude": shared + "\n\nShort extra note.",
+    }
+    before = dict(offline_model.prompt_stats)
+    prompt = offline_model.build_synthesis_prompt("Capital of France?", responses, max_tokens=800)
+
+    assert offline_model.estimate_tokens(prompt) <= 800
+    assert prompt.count(shared) == 1
+    assert "Short extra note." in prompt
+    assert "[...]" in prompt
+    assert offline_model.prompt_stats["duplicate_paragraphs"] == before["duplicate_paragraphs"] + 1
+    assert offline_model.prompt_stats["trimmed_prompts"] == before["trimmed_prompts"] + 1
+
+def test_prompt_budget_per_model():
+    with patch.dict(offline_model.SYNTHESIS_PROMPT_BUDGETS, {"llama3": 6000, "codegemma:2b": 1500}):
+        assert offline_model.prompt_budget("llama3:8b") == 6000
+        assert offline_model.prompt_budget("codegemma:2b") == 1500
+        assert offline_model.prompt_budget("mistral") == offline_model.SYNTHESIS_PROMPT_TOKENS
+
+@pytest.mark.asyncio
+async def test_map_reduce_spreads_groups_over_nodes():
+    partials, calls = [], []
+
+    async def fake_ollama(prompt, url, model):
+        names = sorted(line[4:-13] for line in prompt.splitlines() if line.startswith("--- M"))
+        partials.append((url, names, "KNOWLEDGE FROM MEMORY ---" in prompt))
+        return f"merged({','.join(names)})"
+
+    async def fake_synthesize(query, responses, context="", target_url=None, target_model=None):
+        calls.append((target_url, sorted(responses), context))
+        return "final"
+
+    responses = {f"M{i}": f"Answer {i}" for i in range(7)}
+    responses["Broken"] = "Error: timeout"
+    nodes = [("http://a/api/generate", "llama3"), ("http://b/api/generate", "llama3")]
+
+    with patch("offline_model._ollama_synthesis", fake_ollama), \
+         patch("offline_model.synthesize_responses", fake_synthesize), \
+         patch.object(offline_model, "MAP_REDUCE_GROUP_SIZE", 3):
+        final = await offline_model.synthesize_map_reduce("Q", responses, context="memory", target_url="http://brain", nodes=nodes)
+
+    # 7 answers -> groups of 3,3,1 -> two partials on different nodes + the single answer -> final merge on the Brain
+    assert [p[0] for p in partials] == ["http://a/api/generate", "http://b/api/generate"]
+    assert [p[1] for p in partials] == [["M0", "M1", "M2"], ["M3", "M4", "M5"]]
+    assert not any(p[2] for p in partials)
+    assert calls == [("http://brain", ["M6", "Partial synthesis 1.1", "Partial synthesis 1.2"], "memory")]
+    assert final == "final"
+
+@pytest.mark.asyncio
+async def test_map_phase_never_falls_back_to_cloud():
+    openai, g4f = AsyncMock(return_value="cloud"), AsyncMock(return_value="cloud")
+    final_merge = AsyncMock(return_value="final")
+    responses = {f"M{i}": f"Answer {i}" for i in range(4)}
+
+    with patch("offline_model._ollama_synthesis", AsyncMock(side_effect=ConnectionError("refused"))), \
+         patch("offline_model._openai_synthesis", openai), \
+         patch("offline_model._g4f_synthesis", g4f), \
+         patch("offline_model.synthesize_responses", final_merge), \
+         patch.object(offline_model, "MAP_REDUCE_GROUP_SIZE", 2):
+        await offline_model.synthesize_map_reduce("Q", responses, nodes=[(None, "llama3")])
+
+    openai.assert_not_called()
+    g4f.assert_not_called()
+    # Groups that could not be merged reach the final merge as they were
+    assert sorted(final_merge.call_args.args[1]) == ["M0", "M1", "M2", "M3"]
+
+@pytest.mark.asyncio
+async def test_slow_primary_is_hedged_and_cancelled():
+    cancelled = asyncio.Event()
+
+    async def slow_ollama(prompt, url, model):
+        try:
+            await asyncio.sleep(30)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    async def cloud(prompt):
+        return "Paris"
+
+    with patch("offline_model._ollama_synthesis", slow_ollama), \
+         patch("offline_model._openai_synthesis", cloud), \
+         patch.dict("os.environ", {"OPENAI_API_KEY": "sk-test"}), \
+         patch.object(offline_model, "SYNTHESIS_HEDGE_DELAYS", [0.05]):
+        answer = await asyncio.wait_for(offline_model.synthesize_responses("Q", RESPONSES), 2)
+
+    assert answer == "**(Synthesized via Cloud Fallback)**\n\nParis"
+    await asyncio.wait_for(cancelled.wait(), 1)
+
+@pytest.mark.asyncio
+async def test_failed_backend_falls_back_immediately():
+    async def down(*args):
+        raise ConnectionError("refused")
+
+    with patch("offline_model._ollama_synthesis", down), \
+         patch("offline_model._openai_synthesis", down), \
+         patch("offline_model._g4f_synthesis", AsyncMock(return_value="Paris")), \
+         patch.object(offline_model, "SYNTHESIS_HEDGE_DELAYS", [60]):
+        answer = await asyncio.wait_for(offline_model.synthesize_responses("Q", RESPONSES), 2)
+
+    assert answer.endswith("Paris")
+
+@pytest.mark.asyncio
+async def test_backends_without_credentials_are_not_started():
+    openai = AsyncMock(return_value="Paris")
+    with patch("offline_model._ollama_synthesis", AsyncMock(side_effect=ConnectionError("refused"))), \
+         patch("offline_model._openai_synthesis", openai), \
+         patch("offline_model._g4f_synthesis", AsyncMock(return_value="Paris")), \
+         patch.dict("os.environ", {}, clear=True):
+        answer = await offline_model.synthesize_responses("Q", RESPONSES)
+
+    openai.assert_not_called()
+    assert answer == "**(Synthesized via Free Web Fallback)**\n\nParis"
+
+@pytest.mark.asyncio
+async def test_hedge_closes_results_that_lost():
+    class Stream:
+        closed = False
+
+        async def aclose(self):
+            self.closed = True
+
+    streams = [Stream(), Stream()]
+    both_started = asyncio.Event()
+
+    async def open_stream(i):
+        if i:
+            both_started.set()
+        await both_started.wait()
+        return streams[i], "token"
+
+    # The fallback starts right away (hedge delay 0) and both attempts finish together
+    with patch.object(offline_model, "SYNTHESIS_HEDGE_DELAYS", [0]):
+        index, (winner, _), errors = await offline_model._hedge([("a", lambda: open_stream(0)), ("b", lambda: open_stream(1))])
+
+    assert winner is streams[index] and not winner.closed
+    assert streams[1 - index].closed
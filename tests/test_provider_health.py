@@ -0,0 +1,61 @@
+import time
+import pytest
+import provider_health
+
+@pytest.fixture
+def breaker(monkeypatch):
+    monkeypatch.setattr(provider_health, "CIRCUIT_MIN_CALLS", 3)
+    monkeypatch.setattr(provider_health, "CIRCUIT_ERROR_RATE", 0.5)
+    monkeypatch.setattr(provider_health, "CIRCUIT_SLOW_CALL", 5.0)
+    monkeypatch.setattr(provider_health, "CIRCUIT_OPEN_SECONDS", 30.0)
+    return provider_health.get_breaker("ChatGPT")
+
+def test_opens_on_error_rate(breaker):
+    breaker.record(True, 1.0)
+    breaker.record(False, 1.0)
+    assert breaker.allow()
+    breaker.record(False, 1.0)
+    assert breaker.state == provider_health.OPEN
+    assert not breaker.allow()
+    assert provider_health.health_report()["ChatGPT"]["score"] == 0.0
+
+def test_slow_calls_count_as_failures(breaker):
+    for _ in range(3):
+        breaker.record(True, 9.0)
+    assert breaker.state == provider_health.OPEN
+
+def test_slow_threshold_follows_provider_timeout(breaker, monkeypatch):
+    monkeypatch.setattr(provider_health, "CIRCUIT_SLOW_SHARE", 0.8)
+    ollama = provider_health.get_breaker("Ollama (llama3)", 60.0)
+    for _ in range(3):
+        ollama.record(True, 40.0)  # a normal CPU generation, well within OLLAMA_TIMEOUT
+    assert ollama.state == provider_health.CLOSED
+
+    cloud = provider_health.get_breaker("Claude", 30.0)
+    for _ in range(3):
+        cloud.record(True, 26.0)
+    assert cloud.state == provider_health.OPEN
+
+def test_half_open_probe_closes_or_reopens(breaker):
+    for _ in range(3):
+        breaker.record(False, 1.0)
+    breaker.opened_at = time.monotonic() - 31  # cooldown elapsed
+
+    assert breaker.allow()          # the probe
+    assert not breaker.allow()      # only one at a time
+    breaker.record(False, 1.0)
+    assert breaker.state == provider_health.OPEN
+
+    breaker.opened_at = time.monotonic() - 31
+    assert breaker.allow()
+    breaker.record(True, 1.0)
+    assert breaker.state == provider_health.CLOSED
+    assert breaker.health()["calls"] == 0
+
+def test_cancelled_probe_frees_the_slot(breaker):
+    for _ in range(3):
+        breaker.record(False, 1.0)
+    breaker.opened_at = time.monotonic() - 31
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.allow()
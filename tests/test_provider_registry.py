@@ -0,0 +1,65 @@
+import json
+import pytest
+from unittest.mock import AsyncMock, patch
+import provider_registry
+
+@pytest.fixture
+def custom_file(monkeypatch, tmp_path):
+    path = tmp_path / "custom_providers.json"
+    path.write_text(json.dumps([
+        {"name": "Groq", "base_url": "https://api.groq.com/openai/v1", "api_key": "gsk", "model": "llama3-70b", "timeout": 5},
+        {"name": "GPT-4 (Free Web)", "api_key": "", "base_url": "", "model": "gpt_4", "type": "g4f_discovered"},
+        {"name": "Attic PC", "base_url": "http://10.0.0.5:11434", "model": "mistral", "type": "ollama_discovered"}
+    ]))
+    monkeypatch.setattr(provider_registry, "CUSTOM_PROVIDERS_FILE", str(path))
+    provider_registry.reload_registry()
+    yield path
+    provider_registry.reload_registry()
+
+def test_registry_merges_builtins_and_custom_providers(custom_file):
+    registry = provider_registry.get_registry()
+    assert registry["ChatGPT (OpenAI)"].name == "ChatGPT"
+    assert registry["Groq"].kind == "openai_compatible"
+    assert registry["GPT-4 (Free Web)"].kind == "g4f"
+    attic = registry["Attic PC"]
+    assert (attic.kind, attic.endpoint, attic.online) == ("ollama", "http://10.0.0.5:11434/api/generate", False)
+    assert provider_registry.get_registry() is registry  # cached until the file changes
+
+def test_resolve_skips_unknown_labels(custom_file):
+    providers = provider_registry.resolve(["Groq", "Nope"], ["llama3"])
+    assert [p.name for p in providers] == ["Groq", "Ollama (llama3)"]
+
+@pytest.mark.asyncio
+async def test_dispatch_uses_descriptor_fields(custom_file):
+    generic = AsyncMock(return_value="groq answer")
+    ollama = AsyncMock(return_value="ollama answer")
+    with patch("llm_providers.fetch_generic_openai_compatible", generic), patch("llm_providers.fetch_ollama", ollama):
+        answers = await provider_registry.gather_responses("Hi", provider_registry.resolve(["Groq", "Attic PC"]))
+
+    assert answers == {"Groq": "groq answer", "Attic PC": "ollama answer"}
+    assert generic.call_args.args[:5] == ("Hi", "gsk", "https://api.groq.com/openai/v1", "llama3-70b", "Groq")
+    assert generic.call_args.kwargs["timeout"] == 5.0
+    assert ollama.call_args.kwargs["url"] == "http://10.0.0.5:11434/api/generate"
+
+@pytest.mark.asyncio
+async def test_builtins_get_endpoint_key_and_timeout(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-rotated")
+    spec = provider_registry.ProviderSpec("Azure GPT", "Azure", "openai", "gpt-4o", "https://proxy.local/v1/chat/completions",
+                                          api_key_env="OPENAI_API_KEY", timeout=7.0)
+    fetch_openai = AsyncMock(return_value="answer")
+    with patch("llm_providers.fetch_openai", fetch_openai):
+        assert await provider_registry.fetch(spec, "Hi") == "answer"
+
+    assert fetch_openai.call_args.kwargs == {"model": "gpt-4o", "url": "https://proxy.local/v1/chat/completions",
+                                             "api_key": "sk-rotated", "timeout": 7.0}
+
+@pytest.mark.asyncio
+async def test_non_streaming_providers_yield_one_chunk():
+    spec = provider_registry.ProviderSpec("Batch", "Batch", "openai_compatible", "m", "https://batch.local/v1", streaming=False)
+    stream_generic = AsyncMock()
+    with patch("llm_providers.fetch_generic_openai_compatible", AsyncMock(return_value="whole answer")), \
+         patch("llm_providers.stream_generic_openai_compatible", stream_generic):
+        chunks = [chunk async for chunk in provider_registry.stream(spec, "Hi")]
+
+    assert chunks == ["whole answer"]
+    stream_generic.assert_not_called()
@@ -1,4 +1,7 @@
 import pytest
+import asyncio
+import json
+import httpx
 from unittest.mock import AsyncMock, MagicMock, patch
 import llm_providers
 import g4f
@@ -38,7 +41,7 @@ async def test_fetch_openai_success():
     mock_response.json.return_value = {
         "choices": [{"message": {"content": "Hello from OpenAI"}}]
     }
-    mock_client.post.return_value = mock_response
+    mock_client.request.return_value = mock_response
 
     with patch.dict("os.environ", {"OPENAI_API_KEY": "sk-test"}):
         response = await llm_providers.fetch_openai("Hi", mock_client)
@@ -54,3 +57,165 @@ async def test_fetch_openai_no_key_fallback():
             response = await llm_providers.fetch_openai("Hi", AsyncMock())
             assert response == "Fallback response"
             mock_g4f.assert_called_once()
+
+@pytest.mark.asyncio
+async def test_fan_out_runs_concurrently_in_completion_order():
+    async def delayed(value, delay):
+        await asyncio.sleep(delay)
+        return value
+
+    async def failing():
+        raise RuntimeError("boom")
+
+    tasks = [
+        ("Slow", delayed("slow", 0.2)),
+        ("Fast", delayed("fast", 0.05)),
+        ("Broken", failing()),
+    ]
+
+    start = asyncio.get_event_loop().time()
+    results = [item async for item in llm_providers.fan_out(tasks)]
+    elapsed = asyncio.get_event_loop().time() - start
+
+    assert [name for name, _, _ in results] == ["Broken", "Fast", "Slow"]
+    assert results[0][1] == "Error: boom"
+    assert isinstance(results[0][2], RuntimeError)
+    assert results[2][2] is None
+    # Concurrent: total time is the max latency, not the sum
+    assert elapsed < 0.3
+
+@pytest.mark.asyncio
+async def test_get_client_pools_per_origin():
+    openai_client = llm_providers.get_client("https://api.openai.com/v1/chat/completions")
+    assert llm_providers.get_client("https://api.openai.com/v1/models") is openai_client
+    assert llm_providers.get_client("http://localhost:11434/api/generate") is not openai_client
+
+    stats = llm_providers.pool_stats()
+    assert "https://api.openai.com" in stats
+    assert "http://localhost:11434" in stats
+
+    await llm_providers.close_clients()
+    assert openai_client.is_closed
+    assert llm_providers.get_client("https://api.openai.com") is not openai_client
+    await llm_providers.close_clients()
+
+@pytest.mark.asyncio
+async def test_stream_ollama_yields_ndjson_tokens():
+    body = "\n".join(json.dumps(chunk) for chunk in [
+        {"response": "Hel", "done": False},
+        {"response": "lo", "done": False},
+        {"response": "", "done": True},
+    ])
+    transport = httpx.MockTransport(lambda request: httpx.Response(200, text=body))
+    async with httpx.AsyncClient(transport=transport) as client:
+        chunks = [c async for c in llm_providers.stream_ollama("Hi", "llama3", client)]
+    assert chunks == ["Hel", "lo"]
+
+@pytest.mark.asyncio
+async def test_stream_openai_yields_sse_deltas():
+    body = "\n\n".join([
+        'data: {"choices": [{"delta": {"role": "assistant"}}]}',
+        'data: {"choices": [{"delta": {"content": "Hello"}}]}',
+        'data: {"choices": [{"delta": {"content": " there"}}]}',
+        "data: [DONE]",
+    ])
+    transport = httpx.MockTransport(lambda request: httpx.Response(200, text=body))
+    async with httpx.AsyncClient(transport=transport) as client:
+        with patch.dict("os.environ", {"OPENAI_API_KEY": "sk-test"}):
+            chunks = [c async for c in llm_providers.stream_openai("Hi", client)]
+    assert chunks == ["Hello", " there"]
+
+@pytest.mark.asyncio
+async def test_fan_out_stream_multiplexes_deltas():
+    async def tokens(*parts):
+        for part in parts:
+            await asyncio.sleep(0.01)
+            yield part
+
+    async def broken():
+        yield "partial"
+        raise RuntimeError("dropped")
+
+    events = [e async for e in llm_providers.fan_out_stream([("A", tokens("a", "b")), ("B", broken())])]
+
+    done = {name: (text, error) for name, kind, text, error in events if kind == "done"}
+    assert done["A"] == ("ab", None)
+    assert done["B"][0] == "Error: dropped"
+    deltas = [(name, text) for name, kind, text, _ in events if kind == "delta"]
+    assert ("A", "a") in deltas and ("B", "partial") in deltas
+
+@pytest.mark.asyncio
+async def test_fan_out_quorum_cancels_stragglers():
+    cancelled = asyncio.Event()
+
+    async def slow():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    async def fast(value):
+        return value
+
+    tasks = [("Slow", slow()), ("A", fast("a")), ("B", fast("Error (B): down")), ("C", fast("c"))]
+    results = [item async for item in llm_providers.fan_out(tasks, quorum=2)]
+
+    assert {name for name, _, _ in results} == {"A", "B", "C"}
+    await asyncio.wait_for(cancelled.wait(), 1)
+
+@pytest.mark.asyncio
+async def test_fan_out_stream_deadline():
+    async def slow_tokens():
+        yield "first"
+        await asyncio.sleep(10)
+        yield "never"
+
+    async def quick():
+        yield "done"
+
+    events = [e async for e in llm_providers.fan_out_stream([("Slow", slow_tokens()), ("Quick", quick())], deadline=0.1)]
+
+    done = [name for name, kind, _, _ in events if kind == "done"]
+    assert done == ["Quick"]
+    assert ("Slow", "delta", "first", None) in events
+
+@pytest.mark.asyncio
+async def test_fan_out_skips_provider_with_open_circuit(monkeypatch):
+    import provider_health
+    monkeypatch.setattr(provider_health, "CIRCUIT_MIN_CALLS", 2)
+    calls = 0
+
+    async def down():
+        nonlocal calls
+        calls += 1
+        return "Error (Down): 503"
+
+    for _ in range(2):
+        [item async for item in llm_providers.fan_out([("Down", down())])]
+    results = [item async for item in llm_providers.fan_out([("Down", down())])]
+
+    assert calls == 2
+    name, result, error = results[0]
+    assert isinstance(error, provider_health.CircuitOpenError)
+    assert result.startswith("Error: Down skipped")
+
+@pytest.mark.asyncio
+async def test_local_rate_limit_rejections_leave_circuit_closed(monkeypatch):
+    import provider_health
+    import rate_limiter
+    monkeypatch.setattr(provider_health, "CIRCUIT_MIN_CALLS", 2)
+
+    async def refuse(tokens=0):
+        raise rate_limiter.RateLimitExceeded("OpenAI rate limit: next slot in 40.0s, past the deadline")
+
+    monkeypatch.setattr(rate_limiter.get_limiter("OpenAI", "sk-test"), "acquire", refuse)
+    with patch.dict("os.environ", {"OPENAI_API_KEY": "sk-test"}):
+        for _ in range(5):
+            results = [item async for item in llm_providers.fan_out([("ChatGPT", llm_providers.fetch_openai("Hi", AsyncMock()))])]
+            name, result, error = results[0]
+            assert isinstance(error, rate_limiter.RateLimitExceeded)
+
+    breaker = provider_health.get_breaker("ChatGPT")
+    assert breaker.state == provider_health.CLOSED
+    assert breaker.health()["calls"] == 0
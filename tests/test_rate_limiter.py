@@ -0,0 +1,46 @@
+import asyncio
+import time
+import httpx
+import pytest
+import rate_limiter
+import retry_policy
+
+@pytest.mark.asyncio
+async def test_requests_queue_for_the_next_slot():
+    limiter = rate_limiter.RateLimiter("Test", rpm=600)  # 10/s, bucket of 100
+    limiter.buckets["requests"].level = 1.0
+    started = time.monotonic()
+    await asyncio.gather(limiter.acquire(), limiter.acquire(), limiter.acquire())
+    # first is free, the other two wait ~0.1 s and ~0.2 s
+    assert 0.15 <= time.monotonic() - started < 1.0
+    assert limiter.report()["queued"] == 2
+
+@pytest.mark.asyncio
+async def test_fails_fast_when_wait_exceeds_deadline():
+    limiter = rate_limiter.RateLimiter("Test", tpm=600)
+    retry_policy.set_deadline(0.5)
+    with pytest.raises(rate_limiter.RateLimitExceeded):
+        await limiter.acquire(tokens=200)  # 100 tokens in the bucket, 10/s refill: 10 s away
+    assert limiter.report()["rejected"] == 1
+
+def test_limiters_are_shared_per_provider_and_key():
+    a = rate_limiter.get_limiter("OpenAI", "sk-one")
+    assert rate_limiter.get_limiter("OpenAI", "sk-one") is a
+    assert rate_limiter.get_limiter("OpenAI", "sk-two") is not a
+    assert all("sk-" not in name for name in rate_limiter.limiter_stats())
+
+def test_quota_is_learned_from_headers():
+    limiter = rate_limiter.RateLimiter("OpenAI")
+    limiter.observe(httpx.Headers({"x-ratelimit-limit-requests": "500", "x-ratelimit-limit-tokens": "30000"}))
+    report = limiter.report()
+    assert report["requests_per_minute"] == 500 * rate_limiter.RATE_LIMIT_HEADROOM
+    assert report["tokens_per_minute"] == 30000 * rate_limiter.RATE_LIMIT_HEADROOM
+
+@pytest.mark.asyncio
+async def test_learned_limit_of_zero_blocks_instead_of_crashing():
+    limiter = rate_limiter.RateLimiter("OpenAI")
+    limiter.observe(httpx.Headers({"x-ratelimit-limit-requests": "0"}))
+    await limiter.acquire()  # the one request a minute that can learn the restored quota
+    with pytest.raises(rate_limiter.RateLimitExceeded):
+        await limiter.acquire()
+    assert limiter.report()["requests_per_minute"] == 0
@@ -0,0 +1,62 @@
+import pytest
+
+memory = pytest.importorskip("agents.memory")
+from agents import retrieval
+
+VECTORS = {"cat": [1.0, 0.0, 0.0], "dog": [0.0, 1.0, 0.0], "error": [0.0, 0.0, 1.0]}
+
+def fake_embed(texts):
+    # Topic vectors: whichever keyword the text mentions
+    return [next((v for k, v in VECTORS.items() if k in t.lower()), [0.5, 0.5, 0.5]) for t in texts]
+
+@pytest.fixture
+def store(monkeypatch, tmp_path):
+    import chromadb
+    client = chromadb.PersistentClient(path=str(tmp_path))
+    collection = client.get_or_create_collection("retrieval_test", embedding_function=None)
+    monkeypatch.setattr(memory, "get_collection", lambda *args, **kwargs: collection)
+    monkeypatch.setattr(memory, "embed", fake_embed)
+    monkeypatch.setattr(memory, "is_warm", lambda: True)
+    monkeypatch.setattr(retrieval, "_index", None)
+    add = lambda query, answer: memory.add_many_to_memory([(query, answer, "Test")], [f"2024-01-01T00:00:0{collection.count()}"])
+    add("How do cats purr?", "Cats purr by vibrating their larynx.")
+    add("Why do dogs bark?", "Dogs bark to communicate.")
+    add("What does E1234 mean?", "Error E1234 means the disk is full.")
+    return add
+
+def test_bm25_ranks_exact_terms_first():
+    index = retrieval.BM25Index()
+    index.add("a", "the disk is full error E1234")
+    index.add("b", "disk usage explained in detail for beginners")
+    index.add("c", "cats and dogs")
+    assert [doc_id for doc_id, _ in index.search("E1234 disk")] == ["a", "b"]
+    index.remove("a")
+    assert [doc_id for doc_id, _ in index.search("E1234")] == []
+
+def test_lexical_match_found_without_vector_similarity(store):
+    # "E1234" alone embeds far from every stored vector, BM25 still finds it
+    hits = retrieval.hybrid_search("E1234")
+    assert hits and "disk is full" in hits[0][1]
+
+def test_vector_and_lexical_hits_are_fused(store):
+    hits = retrieval.hybrid_search("my cat purrs", max_results=2)
+    assert "Cats purr" in hits[0][1]
+
+def test_new_memories_are_indexed_and_budget_applies(store):
+    retrieval.get_index()
+    store("What is Zanzibar?", "Zanzibar is an archipelago. " * 40)
+    hits = retrieval.hybrid_search("zanzibar dogs", max_tokens=50)
+    assert len(hits) == 1 and "Zanzibar" in hits[0][1]
+
+def test_lexical_only_until_model_is_warm(store, monkeypatch):
+    monkeypatch.setattr(memory, "is_warm", lambda: False)
+    monkeypatch.setattr(memory, "preload", lambda: None)
+    monkeypatch.setattr(memory, "embed", lambda texts: pytest.fail("embedding model used while cold"))
+    assert "Dogs bark" in retrieval.hybrid_search("barking dogs")[0][1]
+
+def test_weak_keyword_hits_are_dropped(store, monkeypatch):
+    monkeypatch.setattr(memory, "is_warm", lambda: False)
+    monkeypatch.setattr(memory, "preload", lambda: None)
+    # Only "error" is shared with the E1234 memory: not enough of the query to recall it
+    assert retrieval.hybrid_search("python asyncio error deadlock traceback") == []
+    assert "disk is full" in retrieval.hybrid_search("E1234 error")[0][1]
@@ -0,0 +1,59 @@
+import httpx
+import pytest
+import retry_policy
+
+def sequence(*responses):
+    """MockTransport answering with the given responses in order."""
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return responses[min(len(calls), len(responses)) - 1]
+
+    return httpx.MockTransport(handler), calls
+
+def test_server_delay_headers():
+    assert retry_policy.server_delay(httpx.Headers({"retry-after": "2"})) == 2.0
+    assert retry_policy.server_delay(httpx.Headers({"retry-after-ms": "250"})) == 0.25
+    openai = {"x-ratelimit-remaining-requests": "0", "x-ratelimit-reset-requests": "1m2.5s",
+              "x-ratelimit-remaining-tokens": "10", "x-ratelimit-reset-tokens": "90ms"}
+    assert retry_policy.server_delay(httpx.Headers(openai)) == 62.5
+    assert retry_policy.server_delay(httpx.Headers({})) is None
+
+def test_backoff_stays_within_bounds():
+    previous = retry_policy.RETRY_BASE_DELAY
+    for _ in range(20):
+        previous = retry_policy.next_backoff(previous)
+        assert retry_policy.RETRY_BASE_DELAY <= previous <= retry_policy.RETRY_MAX_DELAY
+
+@pytest.mark.asyncio
+async def test_rate_limit_is_retried_after_server_delay():
+    transport, calls = sequence(
+        httpx.Response(429, headers={"retry-after-ms": "10"}),
+        httpx.Response(200, json={"ok": True})
+    )
+    async with httpx.AsyncClient(transport=transport) as client:
+        response = await retry_policy.send_with_retry(client, "POST", "https://api.test/v1", "RetryTest")
+
+    assert response.json() == {"ok": True}
+    assert len(calls) == 2
+    stats = retry_policy.retry_stats["RetryTest"]
+    assert stats["retries"] >= 1 and stats["server_delays"] >= 1
+
+@pytest.mark.asyncio
+async def test_gives_up_when_wait_exceeds_deadline():
+    transport, calls = sequence(httpx.Response(503, headers={"retry-after": "5"}))
+    retry_policy.set_deadline(1.0)
+    async with httpx.AsyncClient(transport=transport) as client:
+        response = await retry_policy.send_with_retry(client, "POST", "https://api.test/v1", "DeadlineTest")
+
+    assert response.status_code == 503
+    assert len(calls) == 1
+
+@pytest.mark.asyncio
+async def test_hard_failures_are_not_retried():
+    transport, calls = sequence(httpx.Response(401))
+    async with httpx.AsyncClient(transport=transport) as client:
+        async with retry_policy.stream_with_retry(client, "POST", "https://api.test/v1", "AuthTest") as response:
+            assert response.status_code == 401
+    assert len(calls) == 1
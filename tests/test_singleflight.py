@@ -0,0 +1,72 @@
+import pytest
+import asyncio
+from singleflight import SingleFlight
+
+async def collect(stream):
+    return [event async for event in stream]
+
+@pytest.mark.asyncio
+async def test_concurrent_subscribers_share_one_run():
+    runs = 0
+
+    async def source():
+        nonlocal runs
+        runs += 1
+        for i in range(3):
+            await asyncio.sleep(0.01)
+            yield i
+
+    flights = SingleFlight()
+    first = flights.subscribe("key", source)
+    await asyncio.sleep(0.015)  # second caller joins mid-flight
+    second = flights.subscribe("key", source)
+
+    results = await asyncio.gather(collect(first), collect(second))
+
+    assert runs == 1
+    assert results == [[0, 1, 2], [0, 1, 2]]
+    assert flights.stats()["in_flight"] == 0
+
+@pytest.mark.asyncio
+async def test_different_keys_run_separately():
+    async def source(value):
+        yield value
+
+    flights = SingleFlight()
+    results = await asyncio.gather(
+        collect(flights.subscribe("a", lambda: source("a"))),
+        collect(flights.subscribe("b", lambda: source("b")))
+    )
+    assert results == [["a"], ["b"]]
+
+@pytest.mark.asyncio
+async def test_errors_reach_every_subscriber():
+    async def source():
+        yield "partial"
+        raise RuntimeError("upstream failed")
+
+    flights = SingleFlight()
+    streams = [flights.subscribe("key", source), flights.subscribe("key", source)]
+    for stream in streams:
+        with pytest.raises(RuntimeError):
+            await collect(stream)
+
+@pytest.mark.asyncio
+async def test_run_cancelled_when_last_subscriber_leaves():
+    cancelled = asyncio.Event()
+
+    async def source():
+        try:
+            yield "first"
+            await asyncio.sleep(10)
+            yield "never"
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    flights = SingleFlight()
+    stream = flights.subscribe("key", source)
+    assert await stream.__anext__() == "first"
+    await stream.aclose()
+
+    await asyncio.wait_for(cancelled.wait(), 1)